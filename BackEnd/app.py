@@ -1,29 +1,51 @@
+import time
 from sqlalchemy import select
 from fastapi import FastAPI, Depends
 from fastapi.responses import JSONResponse
 from dotenv import load_dotenv
 from database.models import Project, User
-from database.connection import engine, Base, init_db, AsyncSessionLocal
+from database.connection import engine, Base, init_db, AsyncSessionLocal, pool_metrics
 from sqlalchemy.ext.asyncio import AsyncSession
-from routers import users, projects, auth, strategies, data
-from services.rate_limiter import fixed_window
-import threading
+from routers import users, projects, auth, strategies, data, jobs, backtests, metrics as metrics_router
+from services import rate_limiter, sweep_service, job_service, password_service, strategy_runtime
+from services import auth_service, bar_cache, bar_stream, indicator_service, metrics, result_cache
 load_dotenv()
 
 app = FastAPI()
-ip_cache = {}
-lock = threading.Lock()
+limiter = rate_limiter.build_limiter()
+
+metrics.instrument(engine, pool_metrics)
+metrics.register("db_pool", pool_metrics.stats)
+metrics.register("event_loop", metrics.loop_monitor.stats)
+metrics.register("bar_cache", bar_cache.bar_cache.stats)
+metrics.register("indicator_cache", indicator_service.indicator_cache.stats)
+metrics.register("result_cache", result_cache.stats.as_dict)
+metrics.register("user_cache", auth_service.user_cache.stats)
+metrics.register("bar_stream", bar_stream.broadcaster.stats)
+metrics.register("jobs", job_service.queue.stats)
+metrics.register("password_hashing", password_service.stats)
+metrics.register("strategy_runtime", strategy_runtime.runtime.stats)
+metrics.register("rate_limiter", limiter.stats)
 
 
 @app.on_event("startup")
 async def startup_event():
     # Create database tables (if they don't exist)
     await init_db()  
+    # rollups for bars that predate them are built by `python -m database.migrations rollups`
+    await job_service.queue.start()
+    await strategy_runtime.runtime.start()
+    metrics.loop_monitor.start()
 
 @app.on_event("shutdown")
 async def on_shutdown():
     # Cleanup resources, close connections if needed
+    await job_service.queue.stop()
+    await metrics.loop_monitor.stop()
     await engine.dispose()  # Dispose async SQLAlchemy engine
+    sweep_service.shutdown_executor()
+    password_service.shutdown()
+    strategy_runtime.runtime.shutdown()
 
 @app.get("/")
 async def read_root():
@@ -35,31 +57,31 @@ app.include_router(projects.router)
 app.include_router(auth.router)
 app.include_router(strategies.router)
 app.include_router(data.router)
-
-@app.middleware("http")
-async def db_session_middleware(request, call_next):
-    response = None
-    async with AsyncSessionLocal() as session:
-        request.state.db = session
-        response = await call_next(request)
-    return response
+app.include_router(jobs.router)
+app.include_router(backtests.router)
+app.include_router(metrics_router.router)
 
 @app.middleware("http")
 async def rate_limit_middleware(request, call_next):
-    # Placeholder for rate limiting logic
-    ip_address = request.client.host
-
-    with lock:
-        if ip_address not in ip_cache:
-            ip_cache[ip_address] = fixed_window(60, 100)  # 100 requests per 60 seconds
-        limiter = ip_cache[ip_address]
+    allowed, retry_after = await limiter.check_async(request.url.path, lambda by: rate_limiter.client_key(request, by))
+    if not allowed:
+        return JSONResponse(status_code=429, content={"detail": "Rate limit exceeded"},
+                            headers={"Retry-After": rate_limiter.retry_after_header(retry_after)})
+    return await call_next(request)
 
-    if not limiter.is_allowed(request.url.path):
-        return JSONResponse(status_code=429, content={"detail": "Rate limit exceeded"})
-    else:
-        limiter.increment()
+@app.middleware("http")
+async def metrics_middleware(request, call_next):
+    # added last, so it is the outermost middleware and times rate-limited requests too
+    stats = metrics.RequestStats()
+    token = metrics.current_request.set(stats)
+    started = time.perf_counter()
+    status = 500
+    try:
         response = await call_next(request)
+        status = response.status_code
         return response
-
-
-
+    finally:
+        metrics.current_request.reset(token)
+        # the route template rather than the path, so ids do not multiply the series
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        metrics.record_request(request.method, route, status, time.perf_counter() - started, stats)
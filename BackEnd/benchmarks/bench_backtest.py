@@ -0,0 +1,38 @@
+# python -m benchmarks.bench_backtest [bars] [repeats]
+import sys
+import time
+import numpy as np
+from services import backtest_service
+
+
+def synthetic_bars(n: int, seed: int = 7) -> dict:
+    rng = np.random.default_rng(seed)
+    close = 100.0 * np.exp(np.cumsum(rng.normal(0.0, 0.001, n)))
+    spread = np.abs(rng.normal(0.0, 0.0005, n)) * close
+    return {
+        "date": np.datetime64("2000-01-03T09:30") + np.arange(n).astype("timedelta64[m]"),
+        "open": close,
+        "high": close + spread,
+        "low": close - spread,
+        "close": close,
+        "volume": rng.integers(100, 10000, n),
+    }
+
+
+def main():
+    bars_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    bars = synthetic_bars(bars_count)
+    for signal in backtest_service.SIGNALS:
+        params = backtest_service.parse_parameters({"signal": signal, "allow_short": True, "periods_per_year": 252 * 390})
+        timings = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            outcome = backtest_service.run_backtest(bars, params)
+            timings.append(time.perf_counter() - started)
+        print(f"{signal:>16}: {bars_count} bars, best {min(timings) * 1000:.1f} ms, "
+              f"median {np.median(timings) * 1000:.1f} ms, {outcome['metrics']['trades']} trades")
+
+
+if __name__ == "__main__":
+    main()
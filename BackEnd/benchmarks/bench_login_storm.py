@@ -0,0 +1,66 @@
+# python -m benchmarks.bench_login_storm [concurrent_logins] [seconds]
+# Measures latency of an unrelated endpoint while a burst of password checks runs,
+# with bcrypt inline on the event loop versus on the password pool.
+import asyncio
+import os
+import sys
+import time
+import bcrypt
+import httpx
+import numpy as np
+
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("ALGORITHM", "HS256")
+
+from app import app
+from services import password_service
+
+
+async def storm(verify, password_hash: bytes, concurrency: int, deadline: float):
+    async def login():
+        while time.perf_counter() < deadline:
+            try:
+                await verify("correct horse", password_hash.decode())
+            except Exception:
+                await asyncio.sleep(0.01)  # 503 from a saturated pool
+    await asyncio.gather(*(login() for _ in range(concurrency)))
+
+
+async def probe(client: httpx.AsyncClient, deadline: float, interval: float = 0.005) -> list:
+    # latency is measured from the scheduled send time, so a stalled loop shows up as latency
+    latencies = []
+    scheduled = time.perf_counter()
+    while scheduled < deadline:
+        await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+        await client.get("/")
+        latencies.append(time.perf_counter() - scheduled)
+        scheduled += interval
+    return latencies
+
+
+async def inline_verify(password: str, password_hash: str):
+    return bcrypt.checkpw(password.encode(), password_hash.encode())
+
+
+async def run(mode: str, verify, password_hash: bytes, concurrency: int, seconds: float):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        deadline = time.perf_counter() + seconds
+        latencies, _ = await asyncio.gather(probe(client, deadline), storm(verify, password_hash, concurrency, deadline))
+    ms = np.array(latencies) * 1000
+    print(f"{mode:>7}: {len(ms)} probe requests, p50 {np.percentile(ms, 50):.1f} ms, "
+          f"p99 {np.percentile(ms, 99):.1f} ms, max {ms.max():.1f} ms")
+
+
+def main():
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 3.0
+    password_hash = bcrypt.hashpw(b"correct horse", bcrypt.gensalt(rounds=password_service.BCRYPT_ROUNDS))
+    asyncio.run(run("idle", inline_verify, password_hash, 0, seconds))
+    asyncio.run(run("inline", inline_verify, password_hash, concurrency, seconds))
+    asyncio.run(run("pool", password_service.verify_password, password_hash, concurrency, seconds))
+    print(password_service.stats())
+
+
+if __name__ == "__main__":
+    main()
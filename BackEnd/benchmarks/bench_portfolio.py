@@ -0,0 +1,50 @@
+# python -m benchmarks.bench_portfolio [tickers] [days]
+import sys
+import time
+import numpy as np
+from services import portfolio_service
+
+
+def synthetic_universe(tickers: int, days: int, seed: int = 11):
+    # business-day calendar; tickers list and delist at random and miss about 1% of their bars
+    rng = np.random.default_rng(seed)
+    calendar = np.arange(np.datetime64("2010-01-04"), np.datetime64("2010-01-04") + days * 7 // 5 + 14)
+    calendar = calendar[np.is_busday(calendar)][:days].astype("datetime64[us]")
+    returns = rng.normal(0.0003, 0.02, (days, tickers)) + rng.normal(0.0, 0.01, (days, 1))
+    prices = 50.0 * np.exp(np.cumsum(returns, axis=0))
+    listed = rng.integers(0, days // 4, tickers)
+    delisted = np.where(rng.random(tickers) < 0.1, rng.integers(days // 2, days, tickers), days)
+    rows = np.arange(days)[:, None]
+    present = (rows >= listed) & (rows < delisted) & (rng.random((days, tickers)) > 0.01)
+    date_index, codes = np.nonzero(present)
+    return calendar[date_index], codes, prices[present]
+
+
+def main():
+    tickers = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 2520
+    dates, codes, values = synthetic_universe(tickers, days)
+    started = time.perf_counter()
+    calendar, panel = portfolio_service.build_panel(dates, codes, values, tickers)
+    print(f"panel: {len(values)} rows -> {panel.shape[0]} x {panel.shape[1]} "
+          f"({panel.nbytes / 1e6:.1f} MB) in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    for signal, weighting in (("momentum", "equal"), ("momentum", "inverse_volatility"),
+                              ("low_volatility", "equal"), ("equal_weight", "equal")):
+        params = portfolio_service.parse_parameters({}, {"signal": signal, "weighting": weighting})
+        timings = {}
+        outcomes = {}
+        for label, chunk in (("one chunk", len(calendar)), ("chunked", max(1, len(calendar) // 10))):
+            started = time.perf_counter()
+            outcomes[label] = portfolio_service.simulate(calendar, panel, params, chunk)
+            timings[label] = time.perf_counter() - started
+        drift = np.max(np.abs(outcomes["one chunk"]["equity"] / outcomes["chunked"]["equity"] - 1.0))
+        metrics = outcomes["chunked"]["metrics"]
+        print(f"{signal:>15}/{weighting:<18} one chunk {timings['one chunk'] * 1000:7.1f} ms, "
+              f"10 chunks {timings['chunked'] * 1000:7.1f} ms, chunking drift {drift:.1e}, "
+              f"return {metrics['total_return']:+.2f}, turnover {metrics['turnover']:.1f}, "
+              f"rebalances {metrics['rebalances']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+# python -m benchmarks.bench_rate_limiter [checks]
+import os
+import sys
+import tempfile
+import time
+from services import rate_limiter
+
+
+def measure(label: str, backend, algorithm, keys: int, checks: int):
+    names = [f"ip:10.0.{i // 256}.{i % 256}" for i in range(keys)]
+    started = time.perf_counter()
+    for i in range(checks):
+        backend.hit(names[i % keys], algorithm)
+    elapsed = time.perf_counter() - started
+    print(f"{label:>40}: {elapsed / checks * 1e6:.2f} us/check ({checks} checks over {keys} keys)")
+
+
+def main():
+    checks = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    sliding = rate_limiter.SlidingWindow(100, 60)
+    bucket = rate_limiter.TokenBucket(rate=10, burst=100)
+    for keys in (1, 10_000, 200_000):
+        measure("memory sliding window", rate_limiter.MemoryBackend(), sliding, keys, checks)
+        measure("memory token bucket", rate_limiter.MemoryBackend(), bucket, keys, checks)
+    measure("memory sliding window, 10k key bound", rate_limiter.MemoryBackend(max_keys=10_000), sliding, 200_000, checks)
+    with tempfile.TemporaryDirectory() as directory:
+        shared = rate_limiter.SQLiteBackend(os.path.join(directory, "limits.sqlite3"))
+        measure("sqlite shared sliding window", shared, sliding, 1_000, checks // 20)
+
+    limiter = rate_limiter.build_limiter()
+    started = time.perf_counter()
+    for _ in range(checks):
+        limiter.check("/api/projects/", lambda by: "ip:127.0.0.1")
+    print(f"{'RateLimiter.check (policy match + memory)':>40}: {(time.perf_counter() - started) / checks * 1e6:.2f} us/check")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+# python -m benchmarks.bench_serialization [rows]
+# Per-row cost of encoding a list response: ORM objects through FastAPI's jsonable_encoder, per-row pydantic
+# models (the old from_orm path), and selected row tuples through FastJSONResponse.
+import json
+import sys
+import time
+from datetime import datetime, timedelta
+from fastapi.encoders import jsonable_encoder
+from database.models import Project
+from routers.projects import PROJECT_COLUMNS
+from routers.users import ProjectOut
+from services import serialization
+
+
+def synthetic_rows(count: int):
+    created = datetime(2024, 1, 1)
+    return [
+        (i, f"project {i}", i % 97, created + timedelta(minutes=i), "backtests for a momentum universe" if i % 3 else None)
+        for i in range(1, count + 1)
+    ]
+
+
+def timed(label: str, rows: int, encode, repeat: int = 3):
+    best = None
+    size = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        size = len(encode())
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{label:>28}: {best * 1000:8.1f} ms, {best / rows * 1e6:6.2f} us/row, {size / 1e6:.1f} MB")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    rows = synthetic_rows(count)
+    objects = [Project(**dict(zip(PROJECT_COLUMNS, row))) for row in rows]
+    encoder = "orjson" if serialization.orjson is not None else "stdlib json"
+    print(f"{count} rows, fast path encoder: {encoder}")
+
+    timed("orm + jsonable_encoder", count, lambda: json.dumps(jsonable_encoder(objects)).encode())
+    timed("pydantic from_orm", count,
+          lambda: json.dumps(jsonable_encoder([ProjectOut.from_orm(p) for p in objects])).encode())
+    timed("row tuples + FastJSONResponse", count,
+          lambda: serialization.FastJSONResponse([dict(zip(PROJECT_COLUMNS, row)) for row in rows]).body)
+
+
+if __name__ == "__main__":
+    main()
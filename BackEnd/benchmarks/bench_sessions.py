@@ -0,0 +1,86 @@
+# python -m benchmarks.bench_sessions [requests] [concurrency] [--legacy-middleware]
+# Sessions created and pool checkouts per request, and requests/sec, against a local SQLite file.
+# --legacy-middleware re-adds the old per-request session middleware for comparison.
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+directory = tempfile.mkdtemp(prefix="bench-sessions-")
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{directory}/bench.db")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("ALGORITHM", "HS256")
+
+import httpx
+import app as app_module
+import database.connection as connection
+from database.models import User, Project
+from routers.auth import create_access_token
+from services import rate_limiter
+
+sessions_created = 0
+session_factory = connection.AsyncSessionLocal
+
+
+def counting_session_factory(*args, **kwargs):
+    global sessions_created
+    sessions_created += 1
+    return session_factory(*args, **kwargs)
+
+
+async def legacy_db_session_middleware(request, call_next):
+    async with connection.AsyncSessionLocal() as session:
+        request.state.db = session
+        return await call_next(request)
+
+
+async def seed():
+    await connection.init_db()
+    async with session_factory() as session:
+        session.add(User(id=1, name="bench", email="bench@example.com", password_hash="x"))
+        session.add_all([Project(name=f"project {i}", owner_id=1) for i in range(20)])
+        await session.commit()
+
+
+async def drive(client, path, headers, requests, concurrency):
+    async def worker(count):
+        for _ in range(count):
+            response = await client.get(path, headers=headers)
+            assert response.status_code == 200, response.text
+    await asyncio.gather(*(worker(requests // concurrency) for _ in range(concurrency)))
+
+
+async def main():
+    global sessions_created
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    requests = int(args[0]) if args else 2000
+    concurrency = int(args[1]) if len(args) > 1 else 16
+    if "--legacy-middleware" in sys.argv:
+        app_module.app.middleware("http")(legacy_db_session_middleware)
+    connection.engine.echo = False
+    app_module.limiter = rate_limiter.RateLimiter([], rate_limiter.MemoryBackend())
+    connection.AsyncSessionLocal = counting_session_factory
+    await seed()
+
+    token = create_access_token("bench@example.com", 1, timedelta(hours=1), "bench")
+    headers = {"Authorization": f"Bearer {token}"}
+    transport = httpx.ASGITransport(app=app_module.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for path, auth in (("/", {}), ("/api/projects/", headers)):
+            await drive(client, path, auth, concurrency, concurrency)  # warm caches and the pool
+            sessions_created = 0
+            checkouts = connection.pool_metrics.checkouts
+            started = time.perf_counter()
+            await drive(client, path, auth, requests, concurrency)
+            elapsed = time.perf_counter() - started
+            print(f"{path:>16}: {requests / elapsed:8.1f} req/s, "
+                  f"{sessions_created / requests:.2f} sessions/request, "
+                  f"{(connection.pool_metrics.checkouts - checkouts) / requests:.2f} checkouts/request")
+    print(connection.pool_metrics.stats())
+    await connection.engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
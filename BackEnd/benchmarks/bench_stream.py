@@ -0,0 +1,117 @@
+# python -m benchmarks.bench_stream [subscribers] [events] [slow fraction]
+# Load generator for /api/data/{ticker}/stream: opens many WebSocket sessions against the ASGI app in
+# process (no network), publishes bar writes and measures fan-out time per event, deliveries per second and
+# how slow consumers are cut off. Uses a local SQLite file for the user lookup.
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+directory = tempfile.mkdtemp(prefix="bench-stream-")
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{directory}/bench.db")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("ALGORITHM", "HS256")
+
+import numpy as np
+import app as app_module
+import database.connection as connection
+from database.models import User
+from routers.auth import create_access_token
+from services import bar_stream, data_events
+
+TICKER = "BENCH"
+SLOW_SEND_SECONDS = 0.01
+
+
+class FakeSocket:
+    # one client as the ASGI server would present it
+    def __init__(self, index: int, token: str, slow: bool):
+        self.scope = {
+            "type": "websocket", "asgi": {"version": "3.0"}, "scheme": "ws", "http_version": "1.1",
+            "path": f"/api/data/{TICKER}/stream", "raw_path": f"/api/data/{TICKER}/stream".encode(),
+            "query_string": f"token={token}".encode(), "root_path": "", "headers": [],
+            "client": ("127.0.0.1", 10000 + index), "server": ("bench", 80), "subprotocols": [],
+        }
+        self.slow = slow
+        self.connected = False
+        self.accepted = asyncio.Event()
+        self.disconnect = asyncio.Event()
+        self.received = 0
+        self.close_code = None
+
+    async def receive(self):
+        if not self.connected:
+            self.connected = True
+            return {"type": "websocket.connect"}
+        await self.disconnect.wait()
+        return {"type": "websocket.disconnect", "code": 1000}
+
+    async def send(self, message):
+        if message["type"] == "websocket.accept":
+            self.accepted.set()
+        elif message["type"] == "websocket.send":
+            self.received += 1
+            if self.slow:
+                await asyncio.sleep(SLOW_SEND_SECONDS)
+        elif message["type"] == "websocket.close":
+            self.close_code = message.get("code")
+            self.accepted.set()
+
+
+async def seed() -> str:
+    await connection.init_db()
+    async with connection.AsyncSessionLocal() as session:
+        session.add(User(id=1, name="bench", email="bench@example.com", password_hash="x"))
+        await session.commit()
+    return create_access_token("bench@example.com", 1, timedelta(hours=1))
+
+
+async def main():
+    subscribers = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    events = int(sys.argv[2]) if len(sys.argv) > 2 else 400
+    slow_fraction = float(sys.argv[3]) if len(sys.argv) > 3 else 0.01
+    token = await seed()
+
+    clients = [FakeSocket(i, token, i < subscribers * slow_fraction) for i in range(subscribers)]
+    started = time.perf_counter()
+    sessions = [asyncio.ensure_future(app_module.app(c.scope, c.receive, c.send)) for c in clients]
+    await asyncio.gather(*(c.accepted.wait() for c in clients))
+    print(f"{subscribers} subscribers connected in {(time.perf_counter() - started) * 1000:.0f} ms "
+          f"({sum(c.slow for c in clients)} slow, buffer {bar_stream.BUFFER_MESSAGES} messages)")
+
+    fast = [c for c in clients if not c.slow]
+    publish_costs = []
+    fan_out = []
+    date = datetime(2030, 1, 1)
+    started = time.perf_counter()
+    for i in range(events):
+        date += timedelta(minutes=1)
+        row = {"ticker": TICKER, "date": date, "open": 1.0, "high": 1.0, "low": 1.0, "close": 1.0 + i, "volume": 10}
+        sent = time.perf_counter()
+        data_events.publish("write", TICKER, date, date, [row])
+        publish_costs.append(time.perf_counter() - sent)
+        # every fast client has been handed the message once its count catches up
+        while any(c.received <= i for c in fast):
+            await asyncio.sleep(0)
+        fan_out.append(time.perf_counter() - sent)
+    elapsed = time.perf_counter() - started
+
+    stats = bar_stream.broadcaster.stats()
+    print(f"{events} events: publish (encode once + enqueue) p50 {np.percentile(publish_costs, 50) * 1e3:.2f} ms, "
+          f"fan-out to all fast clients p50 {np.percentile(fan_out, 50) * 1e3:.2f} ms, "
+          f"p99 {np.percentile(fan_out, 99) * 1e3:.2f} ms")
+    print(f"{stats['deliveries']} deliveries, {stats['deliveries'] / elapsed:,.0f}/s, "
+          f"{stats['dropped']} slow subscribers dropped (closed with "
+          f"{sorted({c.close_code for c in clients if c.close_code is not None}) or 'none'})")
+
+    for c in clients:
+        c.disconnect.set()
+    await asyncio.gather(*sessions, return_exceptions=True)
+    print(f"subscribers left after disconnect: {bar_stream.broadcaster.stats()['subscribers']}")
+    await connection.engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,39 @@
+# python -m benchmarks.bench_sweep [bars] [combinations]
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from benchmarks.bench_backtest import synthetic_bars
+from services import backtest_service, sweep_service
+
+
+def main():
+    bars_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    combination_count = int(sys.argv[2]) if len(sys.argv) > 2 else 256
+    grid = {"fast": list(range(2, 2 + combination_count // 16)), "slow": list(range(20, 36))}
+    combinations = sweep_service.expand_grid(grid)
+    base = backtest_service.parse_parameters({"signal": "sma_crossover"})
+    with tempfile.TemporaryDirectory() as directory:
+        paths = sweep_service.publish_bars(synthetic_bars(bars_count), directory)
+        baseline = None
+        workers = 1
+        while workers <= (os.cpu_count() or 1):
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                # warm the pool so process start-up is not measured
+                wait([executor.submit(sweep_service.run_combinations, paths, base, combinations[:1], False)
+                      for _ in range(workers)])
+                started = time.perf_counter()
+                futures = [executor.submit(sweep_service.run_combinations, paths, base, chunk, False)
+                           for chunk in sweep_service._chunks(combinations, workers)]
+                wait(futures)
+                elapsed = time.perf_counter() - started
+            rate = len(combinations) / elapsed
+            baseline = baseline or rate
+            print(f"{workers:>3} workers: {len(combinations)} backtests x {bars_count} bars in {elapsed:.2f}s, "
+                  f"{rate:.1f}/s, speedup {rate / baseline:.2f}x")
+            workers *= 2
+
+
+if __name__ == "__main__":
+    main()
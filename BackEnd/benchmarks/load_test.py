@@ -0,0 +1,268 @@
+# python -m benchmarks.load_test [--requests N] [--concurrency N] [--only NAME,...] [--save-baseline]
+#                                [--baseline PATH] [--tolerance FRACTION] [seed options]
+# Drives the real ASGI app in process (no network) against the database from benchmarks.seed, seeding it
+# first when needed. Each scenario runs `requests` requests from `concurrency` clients spread over the
+# seeded users, after a warm-up round, and reports throughput, p50/p95/p99 latency and SQL statements per
+# request. Micro-benchmarks time token checks, the authenticated-user lookup, rate limiting and response
+# encoding. Results are compared with a stored baseline (benchmarks/baseline.json by default, written with
+# --save-baseline on the reference machine); the exit status is 1 when something got slower than the
+# tolerance allows.
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+from datetime import datetime, timedelta
+
+from benchmarks import seed
+
+import httpx
+import numpy as np
+from sqlalchemy import func, select
+import app as app_module
+import database.connection as connection
+from database.models import MarketData, Project, Strategy, User
+from routers.auth import create_access_token
+from routers.projects import PROJECT_COLUMNS
+from services import auth_service, metrics, rate_limiter, serialization
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+# metric -> whether larger is better
+DIRECTIONS = {"rps": True, "p50_ms": False, "p95_ms": False, "p99_ms": False, "queries": False, "us_per_op": False}
+# scenarios that write; SQLite takes one writer at a time, so these run without concurrency there
+WRITES = {"backtest_2w"}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load test the API in process")
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--only", help="comma separated scenario names")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed change before a regression")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--strategies", type=int, default=1000)
+    parser.add_argument("--tickers", type=int, default=20)
+    parser.add_argument("--bars", type=int, default=100_000)
+    return parser.parse_args()
+
+
+async def fixtures() -> dict:
+    async with connection.AsyncSessionLocal() as session:
+        users = (await session.execute(
+            select(User.id, User.email, User.name).where(User.email.like(seed.EMAIL.format("%"))).order_by(User.id)
+        )).all()
+        strategies = {}
+        for user_id, strategy_id in (await session.execute(
+            select(Project.owner_id, Strategy.id).join(Strategy, Strategy.project_id == Project.id)
+            .where(Project.owner_id.in_([u.id for u in users]))
+        )).all():
+            strategies.setdefault(user_id, strategy_id)
+        tickers = (await session.scalars(
+            select(MarketData.ticker).where(MarketData.ticker.like("T%")).distinct().order_by(MarketData.ticker)
+        )).all()
+        first, last = (await session.execute(
+            select(func.min(MarketData.date), func.max(MarketData.date)).where(MarketData.ticker == tickers[0])
+        )).one()
+    users = [u for u in users if u.id in strategies]
+    return {
+        "tokens": [create_access_token(u.email, u.id, timedelta(hours=2), u.name) for u in users],
+        "strategies": [strategies[u.id] for u in users],
+        "tickers": tickers,
+        "first": first,
+        "last": last,
+    }
+
+
+def scenarios(f: dict) -> dict:
+    # name -> function(i) returning (method, url, json body, user index)
+    users = len(f["tokens"])
+    tickers = f["tickers"]
+    span = (f["last"] - f["first"]).total_seconds()
+
+    def window(i: int, length: timedelta):
+        # a pseudo-random window inside the seeded range, different per request
+        offset = (i * 7919 % 1000) / 1000 * max(span - length.total_seconds(), 0)
+        start = f["first"] + timedelta(seconds=offset)
+        return start.isoformat(), (start + length).isoformat()
+
+    def historical(i):
+        start, end = window(i, timedelta(days=1))
+        return "GET", f"/api/data/{tickers[i % len(tickers)]}/historical?start={start}&end={end}", None, i
+
+    def resample(i):
+        start, end = window(i, timedelta(days=7))
+        return "GET", f"/api/data/{tickers[i % len(tickers)]}/resample?interval=1h&start={start}&end={end}", None, i
+
+    def backtest(i):
+        start, end = window(i, timedelta(days=14))
+        body = {"ticker": tickers[i % len(tickers)], "start_date": start, "end_date": end,
+                "parameters": {"fast": 5 + i % 20, "slow": 60}}
+        return "POST", f"/strategies/{f['strategies'][i % users]}/backtest", body, i
+
+    return {
+        "root": lambda i: ("GET", "/", None, None),
+        "me": lambda i: ("GET", "/api/users/me", None, i),
+        "projects": lambda i: ("GET", "/api/users/me/projects/", None, i),
+        "strategies": lambda i: ("GET", "/strategies/?limit=100", None, i),
+        "tickers": lambda i: ("GET", "/api/data/tickers", None, i),
+        "historical_1d": historical,
+        "resample_1h": resample,
+        "backtest_2w": backtest,
+    }
+
+
+async def drive(client: httpx.AsyncClient, request, tokens: list, count: int, concurrency: int) -> dict:
+    latencies = []
+    errors = 0
+    next_index = 0
+
+    async def worker():
+        nonlocal next_index, errors
+        while next_index < count:
+            i = next_index
+            next_index += 1
+            method, url, body, user = request(i)
+            headers = {"Authorization": f"Bearer {tokens[user % len(tokens)]}"} if user is not None else {}
+            started = time.perf_counter()
+            response = await client.request(method, url, json=body, headers=headers)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    queries = metrics.query_seconds.series.get((), [0])[-1]
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    ms = np.array(latencies) * 1000
+    return {
+        "rps": count / elapsed,
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "queries": (metrics.query_seconds.series.get((), [0])[-1] - queries) / count,
+        "errors": errors,
+    }
+
+
+def per_op(fn, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat * 1e6
+
+
+async def per_op_async(fn, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        await fn()
+    return (time.perf_counter() - started) / repeat * 1e6
+
+
+async def micro_benchmarks(f: dict) -> dict:
+    token = f["tokens"][0]
+    limiter = rate_limiter.build_limiter()
+    keys = [f"ip:10.0.{i // 256}.{i % 256}" for i in range(10_000)]
+    counter = iter(range(10 ** 9))
+    rows = [(i, f"project {i}", i % 97, datetime(2024, 1, 1), "momentum universe") for i in range(1000)]
+    results = {
+        "token_decode": per_op(lambda: auth_service.user_id_from_token(token), 20_000),
+        "rate_limit_check": per_op(lambda: limiter.check("/api/projects/", lambda by: keys[next(counter) % len(keys)]),
+                                   100_000),
+        "encode_1000_rows": per_op(
+            lambda: serialization.FastJSONResponse([dict(zip(PROJECT_COLUMNS, row)) for row in rows]).body, 200
+        ),
+    }
+    async with connection.AsyncSessionLocal() as session:
+        await auth_service.get_current_user(token, session)
+        results["current_user_cached"] = await per_op_async(lambda: auth_service.get_current_user(token, session), 5_000)
+    return {name: {"us_per_op": value} for name, value in results.items()}
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> int:
+    regressions = 0
+    for section in ("endpoints", "micro"):
+        for name, values in results[section].items():
+            reference = baseline.get(section, {}).get(name)
+            if reference is None:
+                continue
+            for metric, larger_is_better in DIRECTIONS.items():
+                if metric not in values or not reference.get(metric):
+                    continue
+                change = values[metric] / reference[metric] - 1.0
+                worse = -change if larger_is_better else change
+                if worse > tolerance:
+                    regressions += 1
+                    verdict = "REGRESSION"
+                elif worse < -tolerance:
+                    verdict = "improved"
+                else:
+                    continue
+                print(f"  {verdict:>10}: {section}.{name}.{metric} {reference[metric]:.3f} -> {values[metric]:.3f} "
+                      f"({change:+.0%})")
+    return regressions
+
+
+async def main() -> int:
+    args = parse_args()
+    connection.engine.echo = False
+    await seed.seed(args.users, args.strategies, args.tickers, args.bars)
+    # a policy that never rejects keeps the rate-limit check in the path without 429s
+    app_module.limiter = rate_limiter.build_limiter([
+        rate_limiter.Policy("default", "/", rate_limiter.SlidingWindow(10 ** 9, 60)),
+    ])
+    f = await fixtures()
+    selected = scenarios(f)
+    if args.only:
+        selected = {name: selected[name] for name in args.only.split(",")}
+
+    results = {
+        "meta": {
+            "at": datetime.utcnow().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "database": connection.engine.dialect.name,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+        },
+        "endpoints": {},
+        "micro": {},
+    }
+    # a failing request counts as an error instead of ending the run
+    transport = httpx.ASGITransport(app=app_module.app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        print(f"{'scenario':>14} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'sql/req':>8} errors")
+        for name, request in selected.items():
+            concurrency = 1 if name in WRITES and connection.engine.dialect.name == "sqlite" else args.concurrency
+            await drive(client, request, f["tokens"], concurrency, concurrency)
+            r = await drive(client, request, f["tokens"], args.requests, concurrency)
+            results["endpoints"][name] = r
+            print(f"{name:>14} {r['rps']:9.1f} {r['p50_ms']:8.2f} {r['p95_ms']:8.2f} {r['p99_ms']:8.2f} "
+                  f"{r['queries']:8.2f} {r['errors']}")
+    results["micro"] = await micro_benchmarks(f)
+    for name, values in results["micro"].items():
+        print(f"{name:>22}: {values['us_per_op']:.2f} us/op")
+    await connection.engine.dispose()
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as out:
+            json.dump(results, out, indent=2)
+        print(f"baseline written to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"no baseline at {args.baseline}; run with --save-baseline to store one")
+        return 0
+    with open(args.baseline) as source:
+        baseline = json.load(source)
+    print(f"compared with the baseline from {baseline['meta']['at']} ({baseline['meta']['database']}, "
+          f"tolerance {args.tolerance:.0%}):")
+    regressions = compare(results, baseline, args.tolerance)
+    print(f"  {regressions} regression(s)" if regressions else "  no regressions")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,118 @@
+# python -m benchmarks.seed [--users N] [--strategies N] [--tickers N] [--bars N]
+# Fills a database with synthetic users, projects, strategies and minute bars for benchmarks.load_test.
+# DATABASE_URL picks the database (a local Postgres works); by default it is a SQLite file in the temp
+# directory that later runs reuse. Bars are written through ingest_service.write_chunk, the /api/data/bulk
+# path. Seeding is skipped when the database already holds the benchmark users.
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+DEFAULT_DATABASE_URL = f"sqlite+aiosqlite:///{os.path.join(tempfile.gettempdir(), 'quanttrade-bench.db')}"
+os.environ.setdefault("DATABASE_URL", DEFAULT_DATABASE_URL)
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("ALGORITHM", "HS256")
+
+import bcrypt
+import numpy as np
+from sqlalchemy import func, insert, select
+import database.connection as connection
+from database.models import Project, Strategy, User
+from benchmarks.bench_backtest import synthetic_bars
+from services import ingest_service
+
+PASSWORD = "benchmark"
+EMAIL = "bench{}@example.com"
+TICKER = "T{:04d}"
+WRITE_CHUNK_ROWS = 50_000
+START = np.datetime64("2020-01-02T09:30")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Seed a benchmark database")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--strategies", type=int, default=1000)
+    parser.add_argument("--tickers", type=int, default=20)
+    parser.add_argument("--bars", type=int, default=100_000, help="minute bars per ticker")
+    return parser.parse_args(argv)
+
+
+async def seeded_users() -> int:
+    async with connection.AsyncSessionLocal() as session:
+        return await session.scalar(
+            select(func.count()).select_from(User).where(User.email.like(EMAIL.format("%")))
+        )
+
+
+async def seed_accounts(users: int, strategies: int):
+    # one bcrypt hash shared by every user keeps seeding fast; logins still verify against it
+    password_hash = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt()).decode()
+    async with connection.AsyncSessionLocal() as session:
+        await session.execute(insert(User), [
+            {"name": f"bench {i}", "email": EMAIL.format(i), "password_hash": password_hash} for i in range(users)
+        ])
+        user_ids = (await session.scalars(select(User.id).where(User.email.like(EMAIL.format("%"))))).all()
+        await session.execute(insert(Project), [
+            {"name": f"bench project {i}", "owner_id": user_id, "description": "load test"}
+            for i, user_id in enumerate(user_ids)
+        ])
+        project_ids = (await session.scalars(select(Project.id).where(Project.owner_id.in_(user_ids)))).all()
+        rng = np.random.default_rng(11)
+        rows = []
+        for i in range(strategies):
+            fast = int(rng.integers(5, 30))
+            rows.append({
+                "project_id": project_ids[i % len(project_ids)],
+                "name": f"bench strategy {i}",
+                "code": "",
+                "parameters": json.dumps({"fast": fast, "slow": fast * 4}),
+                "is_public": i % 5 == 0,
+                "status": "active" if i % 3 else "draft",
+            })
+        await session.execute(insert(Strategy), rows)
+        await session.commit()
+
+
+async def seed_bars(tickers: int, bars: int):
+    written = 0
+    started = time.perf_counter()
+    for t in range(tickers):
+        series = synthetic_bars(bars, seed=t)
+        dates = (START + np.arange(bars).astype("timedelta64[m]")).astype("datetime64[us]").tolist()
+        for offset in range(0, bars, WRITE_CHUNK_ROWS):
+            end = offset + WRITE_CHUNK_ROWS
+            columns = {name: series[name][offset:end].tolist() for name in ("open", "high", "low", "close", "volume")}
+            rows = [
+                {"ticker": TICKER.format(t), "date": date, "open": o, "high": h, "low": l, "close": c,
+                 "volume": v, "adj_close": c}
+                for date, o, h, l, c, v in zip(dates[offset:end], columns["open"], columns["high"],
+                                               columns["low"], columns["close"], columns["volume"])
+            ]
+            async with connection.AsyncSessionLocal() as session:
+                written += await ingest_service.write_chunk(session, rows)
+        print(f"  {TICKER.format(t)}: {written:,} bars, {written / (time.perf_counter() - started):,.0f} bars/s")
+
+
+async def seed(users: int = 50, strategies: int = 1000, tickers: int = 20, bars: int = 100_000) -> bool:
+    # False when the database was already seeded
+    await connection.init_db()
+    if await seeded_users():
+        return False
+    print(f"seeding {connection.engine.url.render_as_string(hide_password=True)}: {users} users, "
+          f"{strategies} strategies, {tickers} tickers x {bars:,} bars")
+    await seed_accounts(users, strategies)
+    await seed_bars(tickers, bars)
+    return True
+
+
+async def main():
+    args = parse_args()
+    if not await seed(args.users, args.strategies, args.tickers, args.bars):
+        print("already seeded; remove the database or point DATABASE_URL elsewhere to reseed")
+    await connection.engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,297 @@
+import asyncio
+import os
+import sys
+from datetime import datetime
+from sqlalchemy import event, insert, inspect, select, text, update
+from sqlalchemy.ext.asyncio import AsyncConnection
+from database.models import MarketData, Project, Strategy, BacktestResult, BacktestTrade
+
+# "month", "year" or empty for a plain table
+PARTITIONING = os.getenv("MARKET_DATA_PARTITIONING", "").lower()
+
+PRICE_COLUMNS = ("open", "high", "low", "close", "adj_close")
+ADJUSTED_COLUMNS = ("adj_close", "adj_open", "adj_high", "adj_low", "adj_volume")
+# (ticker, date) is already covered by the uix_ticker_date unique index
+REDUNDANT_INDEXES = ("idx_ticker_date", "ix_market_data_ticker")
+
+# partitions known to exist; names created in a transaction wait in connection.info until it commits, so a
+# rolled-back CREATE is issued again next time
+_known_partitions = set()
+_tracked_engines = set()
+
+LEGACY_TRADES_BATCH = 100
+
+
+async def _column_type(conn: AsyncConnection, table: str, column: str):
+    result = await conn.execute(
+        text("SELECT data_type FROM information_schema.columns WHERE table_name = :t AND column_name = :c"),
+        {"t": table, "c": column},
+    )
+    return result.scalar()
+
+
+async def _is_partitioned(conn: AsyncConnection) -> bool:
+    result = await conn.execute(
+        text("SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+             "WHERE c.relname = 'market_data'")
+    )
+    return result.scalar() is not None
+
+
+async def migrate_market_data_numeric(conn: AsyncConnection):
+    # Converts the legacy text OHLCV columns in place
+    dialect = conn.dialect.name
+    if dialect == "postgresql":
+        if await _column_type(conn, "market_data", "open") not in ("character varying", "text"):
+            return False
+        clauses = [
+            f"ALTER COLUMN {c} TYPE double precision USING NULLIF(trim({c}), '')::double precision"
+            for c in PRICE_COLUMNS
+        ]
+        clauses.append("ALTER COLUMN volume TYPE bigint USING round(NULLIF(trim(volume), '')::numeric)::bigint")
+        # one ALTER so the table is rewritten once
+        await conn.execute(text("ALTER TABLE market_data " + ", ".join(clauses)))
+        return True
+    if dialect == "sqlite":
+        # sqlite cannot change a column type in place; rebuild the table with the new declaration
+        result = await conn.execute(text("SELECT type FROM pragma_table_info('market_data') WHERE name = 'open'"))
+        if (result.scalar() or "").upper() not in ("VARCHAR", "TEXT"):
+            return False
+        await conn.execute(text("ALTER TABLE market_data RENAME TO market_data_text"))
+        for name in REDUNDANT_INDEXES + ("ix_market_data_date",):
+            await conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+        await conn.run_sync(MarketData.__table__.create)
+        casts = [f"CAST(NULLIF(trim({c}), '') AS REAL)" for c in PRICE_COLUMNS]
+        await conn.execute(text(
+            f"INSERT INTO market_data (id, ticker, date, {', '.join(PRICE_COLUMNS)}, volume) "
+            f"SELECT id, ticker, date, {', '.join(casts)}, CAST(round(CAST(volume AS REAL)) AS INTEGER) "
+            f"FROM market_data_text"
+        ))
+        await conn.execute(text("DROP TABLE market_data_text"))
+        return True
+    return False
+
+
+async def add_missing_columns(conn: AsyncConnection, table, columns):
+    # create_all never alters an existing table; add newly declared nullable columns
+    existing = set(await conn.run_sync(lambda c: [col["name"] for col in inspect(c).get_columns(table.name)]))
+    for name in columns:
+        if name in existing:
+            continue
+        column = table.c[name]
+        column_type = column.type.compile(dialect=conn.dialect)
+        await conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {name} {column_type}"))
+        for index in table.indexes:
+            if [c.name for c in index.columns] == [name]:
+                await conn.execute(text(f"CREATE INDEX IF NOT EXISTS {index.name} ON {table.name} ({name})"))
+
+
+async def add_missing_indexes(conn: AsyncConnection, table):
+    # create_all skips tables that already exist, so indexes declared later are created here
+    await conn.run_sync(lambda c: [index.create(c, checkfirst=True) for index in table.indexes])
+
+
+def _legacy_trade_rows(backtest_id: int, ticker, trades: list) -> list:
+    rows = []
+    for trade in trades:
+        rows.append({
+            "backtest_id": backtest_id,
+            "ticker": trade.get("ticker", ticker),
+            "side": -1 if trade["side"] in ("short", -1) else 1,
+            "size": float(trade.get("size", 1.0)),
+            "entry_date": datetime.fromisoformat(trade["entry_date"]),
+            "exit_date": datetime.fromisoformat(trade["exit_date"]),
+            "entry_price": float(trade["entry_price"]),
+            "exit_price": float(trade["exit_price"]),
+            "trade_return": float(trade["return"]),
+            "pnl": float(trade["pnl"]),
+        })
+    return rows
+
+
+async def migrate_backtest_trades(conn: AsyncConnection):
+    # Moves trades stored as a JSON list on backtest_results into backtest_trades. Results whose
+    # list cannot be read keep it, so nothing is lost.
+    table = BacktestResult.__table__
+    moved = 0
+    skipped = set()
+    while True:
+        stmt = select(table.c.id, table.c.ticker, table.c.trades).where(table.c.trades.is_not(None))
+        if skipped:
+            stmt = stmt.where(table.c.id.not_in(skipped))
+        batch = (await conn.execute(stmt.order_by(table.c.id).limit(LEGACY_TRADES_BATCH))).all()
+        if not batch:
+            return moved
+        for backtest_id, ticker, trades in batch:
+            try:
+                rows = _legacy_trade_rows(backtest_id, ticker, trades or [])
+            except (KeyError, TypeError, ValueError, AttributeError):
+                skipped.add(backtest_id)
+                continue
+            if rows:
+                await conn.execute(insert(BacktestTrade), rows)
+            await conn.execute(
+                update(table).where(table.c.id == backtest_id).values(trades=None, trade_count=len(rows))
+            )
+            moved += 1
+
+
+async def drop_redundant_indexes(conn: AsyncConnection):
+    for name in REDUNDANT_INDEXES:
+        await conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+
+def _period_start(dt: datetime, granularity: str) -> datetime:
+    if granularity == "year":
+        return datetime(dt.year, 1, 1)
+    return datetime(dt.year, dt.month, 1)
+
+
+def _next_period(dt: datetime, granularity: str) -> datetime:
+    if granularity == "year":
+        return datetime(dt.year + 1, 1, 1)
+    if dt.month == 12:
+        return datetime(dt.year + 1, 1, 1)
+    return datetime(dt.year, dt.month + 1, 1)
+
+
+def _partition_name(dt: datetime, granularity: str) -> str:
+    if granularity == "year":
+        return f"market_data_y{dt.year}"
+    return f"market_data_m{dt.year}_{dt.month:02d}"
+
+
+async def ensure_partitions(conn: AsyncConnection, start: datetime, end: datetime, granularity: str = None):
+    # Creates the partitions covering [start, end]; a no-op unless partitioning is enabled
+    granularity = granularity or PARTITIONING
+    if granularity not in ("month", "year") or conn.dialect.name != "postgresql":
+        return
+    period = _period_start(start, granularity)
+    while period <= end:
+        name = _partition_name(period, granularity)
+        upper = _next_period(period, granularity)
+        pending = conn.info.setdefault("pending_partitions", set())
+        if name not in _known_partitions and name not in pending:
+            await conn.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF market_data "
+                f"FOR VALUES FROM ('{period.isoformat()}') TO ('{upper.isoformat()}')"
+            ))
+            _track(conn.sync_engine)
+            pending.add(name)
+        period = upper
+
+
+def _on_commit(conn):
+    _known_partitions.update(conn.info.pop("pending_partitions", ()))
+
+
+def _on_rollback(conn):
+    conn.info.pop("pending_partitions", None)
+
+
+def _track(engine):
+    if engine not in _tracked_engines:
+        event.listen(engine, "commit", _on_commit)
+        event.listen(engine, "rollback", _on_rollback)
+        _tracked_engines.add(engine)
+
+
+async def partition_market_data(conn: AsyncConnection, granularity: str):
+    # Rebuilds market_data as a table range-partitioned on date. Each partition carries its own
+    # (ticker, date) unique index, so a ticker + date range scan only visits the periods it covers.
+    if conn.dialect.name != "postgresql":
+        raise RuntimeError("partitioned market_data requires PostgreSQL")
+    if granularity not in ("month", "year"):
+        raise ValueError("granularity must be 'month' or 'year'")
+    if await _is_partitioned(conn):
+        return False
+
+    await conn.execute(text("ALTER TABLE market_data RENAME TO market_data_unpartitioned"))
+    await conn.execute(text("ALTER TABLE market_data_unpartitioned RENAME CONSTRAINT uix_ticker_date TO uix_ticker_date_unpartitioned"))
+    await conn.execute(text("ALTER TABLE market_data_unpartitioned RENAME CONSTRAINT market_data_pkey TO market_data_unpartitioned_pkey"))
+    await conn.execute(text("DROP INDEX IF EXISTS ix_market_data_date"))
+    await conn.execute(text("""
+        CREATE TABLE market_data (
+            id integer NOT NULL DEFAULT nextval('market_data_id_seq'),
+            ticker varchar NOT NULL,
+            date timestamp without time zone NOT NULL,
+            open double precision NOT NULL,
+            high double precision NOT NULL,
+            low double precision NOT NULL,
+            close double precision NOT NULL,
+            volume bigint NOT NULL,
+            adj_close double precision,
+            adj_open double precision,
+            adj_high double precision,
+            adj_low double precision,
+            adj_volume double precision,
+            CONSTRAINT market_data_pkey PRIMARY KEY (id, date),
+            CONSTRAINT uix_ticker_date UNIQUE (ticker, date)
+        ) PARTITION BY RANGE (date)
+    """))
+    await conn.execute(text("CREATE INDEX ix_market_data_date ON market_data (date)"))
+    # keep the id sequence alive once the old table is dropped
+    await conn.execute(text("ALTER SEQUENCE market_data_id_seq OWNED BY market_data.id"))
+
+    bounds = await conn.execute(text("SELECT min(date), max(date) FROM market_data_unpartitioned"))
+    start, end = bounds.one()
+    if start is not None:
+        await ensure_partitions(conn, start, end, granularity)
+        columns = "id, ticker, date, open, high, low, close, volume, " + ", ".join(ADJUSTED_COLUMNS)
+        await conn.execute(text(
+            f"INSERT INTO market_data ({columns}) SELECT {columns} FROM market_data_unpartitioned"
+        ))
+    now = datetime.utcnow()
+    await ensure_partitions(conn, now, _next_period(now, granularity), granularity)
+    await conn.execute(text("DROP TABLE market_data_unpartitioned"))
+    return True
+
+
+async def migrate(conn: AsyncConnection):
+    # Idempotent; run on startup after create_all
+    await migrate_market_data_numeric(conn)
+    await drop_redundant_indexes(conn)
+    await add_missing_columns(conn, MarketData.__table__, ADJUSTED_COLUMNS)
+    await add_missing_columns(conn, BacktestResult.__table__, (
+        "ticker", "trade_count", "equity_curve", "cache_key", "data_stamp", "cache_state",
+    ))
+    await migrate_backtest_trades(conn)
+    await add_missing_indexes(conn, Project.__table__)
+    await add_missing_indexes(conn, Strategy.__table__)
+    if PARTITIONING and conn.dialect.name == "postgresql":
+        await partition_market_data(conn, PARTITIONING)
+
+
+async def _main(argv):
+    from database.connection import engine
+    command = argv[0] if argv else "migrate"
+    if command == "rollups":
+        # rollups for bars that predate them, or a newly configured interval; one transaction per ticker,
+        # so a long backfill can be interrupted and picks up where it stopped
+        from database.connection import AsyncSessionLocal
+        from services import resample_service
+        async with AsyncSessionLocal() as session:
+            tickers = await resample_service.backfill_rollups(session)
+        print(f"rollups built for {len(tickers)} tickers")
+        await engine.dispose()
+        return
+    async with engine.begin() as conn:
+        if command == "numeric":
+            changed = await migrate_market_data_numeric(conn)
+            await drop_redundant_indexes(conn)
+            print("market_data converted to numeric columns" if changed else "market_data already numeric")
+        elif command == "partition":
+            granularity = argv[1] if len(argv) > 1 else PARTITIONING or "month"
+            await migrate_market_data_numeric(conn)
+            await add_missing_columns(conn, MarketData.__table__, ADJUSTED_COLUMNS)
+            changed = await partition_market_data(conn, granularity)
+            print(f"market_data partitioned by {granularity}" if changed else "market_data already partitioned")
+        else:
+            await migrate(conn)
+            print("migrations applied")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    # python -m database.migrations [migrate | numeric | partition [month|year] | rollups]
+    asyncio.run(_main(sys.argv[1:]))
@@ -1,7 +1,8 @@
 from sqlalchemy import (
-    Column, Integer, String, DateTime, Text, ForeignKey, UniqueConstraint, Index, Boolean, JSON
+    Column, Integer, BigInteger, SmallInteger, Double, String, DateTime, Text, ForeignKey, UniqueConstraint, Index,
+    Boolean, JSON, LargeBinary
 )
-from sqlalchemy.orm import declarative_base, relationship
+from sqlalchemy.orm import declarative_base, deferred, relationship
 from datetime import datetime
 
 Base = declarative_base()
@@ -26,6 +27,10 @@ class Project(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     description = Column(Text)
     strategies = relationship("Strategy", back_populates="project", cascade="all, delete-orphan")
+
+    __table_args__ = (
+        Index('idx_projects_owner', 'owner_id', 'id'),
+    )
     
 
 class Strategy(Base):
@@ -41,22 +46,35 @@ class Strategy(Base):
     status = Column(String, default="draft")  # e.g. active, inactive, backtesting
     is_public = Column(Boolean, default=False)  # visibility
     backtests = relationship("BacktestResult", back_populates="strategy", cascade="all, delete-orphan")
+
+    # listings walk these in id order: the caller's projects, then everything public (optionally by status)
+    __table_args__ = (
+        Index('idx_strategies_project', 'project_id', 'id'),
+        Index('idx_strategies_public', 'is_public', 'id'),
+        Index('idx_strategies_public_status', 'is_public', 'status', 'id'),
+    )
     
 class MarketData(Base):
     __tablename__ = "market_data"
     id = Column(Integer, primary_key=True)
-    ticker = Column(String, index=True, nullable=False)
+    ticker = Column(String, nullable=False)
     date = Column(DateTime, index=True, nullable=False)
-    open = Column(String, nullable=False)
-    high = Column(String, nullable=False)
-    low = Column(String, nullable=False)
-    close = Column(String, nullable=False)
-    volume = Column(String, nullable=False)
-    adj_close = Column(String, nullable=True)
+    open = Column(Double, nullable=False)
+    high = Column(Double, nullable=False)
+    low = Column(Double, nullable=False)
+    close = Column(Double, nullable=False)
+    volume = Column(BigInteger, nullable=False)
+    # split and dividend adjusted series, written by services/corporate_actions.py
+    adj_close = Column(Double, nullable=True)
+    adj_open = Column(Double, nullable=True)
+    adj_high = Column(Double, nullable=True)
+    adj_low = Column(Double, nullable=True)
+    adj_volume = Column(Double, nullable=True)
 
+    # uix_ticker_date doubles as the (ticker, date) lookup index; see database/migrations.py
+    # for converting old text columns and for the optional time-partitioned layout
     __table_args__ = (
         UniqueConstraint('ticker', 'date', name='uix_ticker_date'),
-        Index('idx_ticker_date', 'ticker', 'date'),
     )
     
 class BacktestResult(Base):
@@ -64,9 +82,105 @@ class BacktestResult(Base):
     id = Column(Integer, primary_key=True)
     strategy_id = Column(Integer, ForeignKey("strategies.id"), nullable=False)
     strategy = relationship("Strategy", back_populates="backtests")
+    ticker = Column(String, index=True)  # null for multi-asset backtests
     start_date = Column(DateTime, nullable=False)
     end_date = Column(DateTime, nullable=False)
     results = Column(JSON, default={})  # Summary stats, performance metrics stored as JSON
-    trades = Column(JSON, default=[])  # List of trades executed, each with details (entry/exit, price, size)
+    # legacy per-result trade list; trades are now rows in backtest_trades
+    trades = deferred(Column(JSON(none_as_null=True), nullable=True))
+    trade_count = Column(Integer, default=0)
+    equity_curve = deferred(Column(LargeBinary, nullable=True))  # compressed (dates, equity) arrays
+    # result cache (services/result_cache.py): hash of the inputs, fingerprint of the bars they covered and
+    # the engine state at the last bar; cache_key is cleared when covered market data changes
+    cache_key = Column(String, index=True, nullable=True)
+    data_stamp = Column(String, nullable=True)
+    cache_state = deferred(Column(JSON, nullable=True))
     logs = Column(Text, default='')  # Optional logs or error messages
     created_at = Column(DateTime, default=datetime.utcnow)
+    # rows are removed by the database (ON DELETE CASCADE) rather than loaded and deleted one by one
+    trade_rows = relationship("BacktestTrade", cascade="all, delete-orphan", passive_deletes=True)
+
+
+class BacktestTrade(Base):
+    __tablename__ = "backtest_trades"
+    id = Column(Integer, primary_key=True)
+    backtest_id = Column(Integer, ForeignKey("backtest_results.id", ondelete="CASCADE"), nullable=False)
+    ticker = Column(String, nullable=True)
+    side = Column(SmallInteger, nullable=False)  # 1 long, -1 short
+    size = Column(Double, nullable=False)
+    entry_date = Column(DateTime, nullable=False)
+    exit_date = Column(DateTime, nullable=False)
+    entry_price = Column(Double, nullable=False)
+    exit_price = Column(Double, nullable=False)
+    trade_return = Column(Double, nullable=False)
+    pnl = Column(Double, nullable=False)
+
+    __table_args__ = (
+        Index('idx_backtest_trades_entry', 'backtest_id', 'entry_date', 'id'),
+        Index('idx_backtest_trades_ticker', 'backtest_id', 'ticker', 'entry_date'),
+    )
+
+class Job(Base):
+    __tablename__ = "jobs"
+    id = Column(String, primary_key=True)  # uuid4 hex
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    kind = Column(String, nullable=False)  # e.g. backtest, sweep
+    payload = Column(JSON, default={})
+    priority = Column(Integer, default=0)  # higher runs first
+    status = Column(String, default="queued", index=True)  # queued, running, succeeded, failed, cancelled
+    progress = Column(Double, default=0.0)  # 0..1
+    result = Column(JSON, nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+class MarketDataRollup(Base):
+    # materialised OHLCV bars for commonly requested intervals, kept current as bars are written
+    __tablename__ = "market_data_rollups"
+    id = Column(Integer, primary_key=True)
+    ticker = Column(String, nullable=False)
+    interval = Column(String, nullable=False)  # e.g. 1h, 1d
+    bucket = Column(DateTime, nullable=False)  # bucket start
+    open = Column(Double, nullable=False)
+    high = Column(Double, nullable=False)
+    low = Column(Double, nullable=False)
+    close = Column(Double, nullable=False)
+    volume = Column(BigInteger, nullable=False)
+    vwap = Column(Double, nullable=True)
+    bars = Column(Integer, nullable=False)  # source bars in the bucket
+
+    __table_args__ = (
+        UniqueConstraint('ticker', 'interval', 'bucket', name='uix_rollup_ticker_interval_bucket'),
+    )
+
+
+class CorporateAction(Base):
+    __tablename__ = "corporate_actions"
+    id = Column(Integer, primary_key=True)
+    ticker = Column(String, nullable=False)
+    ex_date = Column(DateTime, nullable=False)  # first bar that trades without the split or dividend
+    kind = Column(String, nullable=False)  # split or dividend
+    ratio = Column(Double, nullable=True)  # split: new shares per old share
+    amount = Column(Double, nullable=True)  # dividend: cash per share
+    # multiplier for prices before ex_date, fixed when the action is first applied; null until then
+    factor = Column(Double, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint('ticker', 'ex_date', 'kind', name='uix_corporate_action'),
+    )
+
+
+class DataQualityIssue(Base):
+    # found while adjusting a ticker; replaced for the range each pass covers
+    __tablename__ = "market_data_issues"
+    id = Column(Integer, primary_key=True)
+    ticker = Column(String, nullable=False)
+    date = Column(DateTime, nullable=False)
+    kind = Column(String, nullable=False)  # gap, duplicate, outlier or invalid
+    detail = Column(String, nullable=True)
+
+    __table_args__ = (
+        Index('idx_market_data_issues_ticker', 'ticker', 'date'),
+    )
@@ -11,6 +11,7 @@ import bcrypt
 from datetime import datetime, timedelta
 from jose import JWTError, jwt as jose_jwt
 from services.auth_service import oauth2_bearer, SECRET_KEY, ALGORITHM, get_current_user
+from services import password_service
 
 router = APIRouter(prefix="/api/auth", tags=["auth"])
 
@@ -36,12 +37,13 @@ async def create_user(user_data: UserCreate, db: AsyncSession = Depends(get_db))
         raise HTTPException(status_code=400, detail="password too long for bcrypt (max 72 bytes); please use a shorter password")
 
     try:
-        # bcrypt.hashpw works with bytes; gensalt() returns a salt
-        hashed = bcrypt.hashpw(pw_bytes, bcrypt.gensalt())
-        db_user.password_hash = hashed.decode("utf-8")
+        # hashed on the bounded bcrypt pool; raises 503 when it is saturated
+        db_user.password_hash = await password_service.hash_password(user_data.password)
     except ValueError as e:
         # This can occur when the underlying bcrypt backend rejects the input (e.g. >72 bytes)
         raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         # Catch other unexpected backend errors and return a 400 with the message.
         raise HTTPException(status_code=400, detail=str(e))
@@ -63,7 +65,7 @@ async def login_for_access_token(form_data:OAuth2PasswordRequestForm = Depends()
     user = await authenticate_user(form_data.username, form_data.password, db)
     if user is None:
         return {"error": "Invalid credentials"}
-    token = create_access_token(user.email, user.id, timedelta(days=1))
+    token = create_access_token(user.email, user.id, timedelta(days=1), user.name)
     return {'access_token': token, 'token_type': 'bearer'}
 
 async def authenticate_user(email: str, password: str, db: AsyncSession):
@@ -72,13 +74,14 @@ async def authenticate_user(email: str, password: str, db: AsyncSession):
     )
     user = result.scalars().first()
     if user:
-        # checkpw expects bytes
-        if bcrypt.checkpw(password.encode('utf-8'), user.password_hash.encode('utf-8')):
+        if await password_service.verify_password(password, user.password_hash):
             return user
     return None
 
-def create_access_token(username: str, user_id: int, expires_delta: timedelta):
+def create_access_token(username: str, user_id: int, expires_delta: timedelta, name: Optional[str] = None):
     to_encode = {"sub": username, "user_id": user_id}
+    if name is not None:
+        to_encode["name"] = name  # lets AUTH_STATELESS mode answer /me without a lookup
     expire = datetime.utcnow() + expires_delta
     to_encode.update({"exp": expire})
     encoded_jwt = jose_jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
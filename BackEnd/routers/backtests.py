@@ -0,0 +1,76 @@
+import importlib.util
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from database.models import User
+from database.connection import get_db
+from services.auth_service import get_current_user
+from services import data_service, result_cache, result_service
+from services.serialization import CURSOR_HEADER
+
+router = APIRouter(prefix="/api/backtests", tags=["backtests"])
+
+EQUITY_COLUMNS = ("date", "equity")
+EQUITY_CHUNK_POINTS = 10000
+MEDIA_TYPES = {
+    "json": "application/json",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+@router.get("/cache")
+async def get_cache_stats(user: User = Depends(get_current_user)):
+    # result cache counters for this process since it started
+    return result_cache.stats.as_dict()
+
+@router.get("/{backtest_id}")
+async def get_backtest(backtest_id: int, db: AsyncSession = Depends(get_db),
+                       user: User = Depends(get_current_user)):
+    row = await result_service.get_visible_summary(db, backtest_id, user.id)
+    return result_service.summary_record(row)
+
+@router.get("/{backtest_id}/trades")
+async def get_backtest_trades(backtest_id: int, response: Response, start: Optional[datetime] = None,
+                              end: Optional[datetime] = None, side: Optional[str] = None,
+                              ticker: Optional[str] = None, limit: int = 100, after: Optional[str] = None,
+                              cursor: Optional[str] = None,
+                              db: AsyncSession = Depends(get_db), user: User = Depends(get_current_user)):
+    # one page of trades ordered by entry date; pass next_cursor (also in X-Next-Cursor) back as `after` to
+    # get the following page. `cursor` is the older name for `after`. Always paged: trades were never listed whole
+    await result_service.get_visible_summary(db, backtest_id, user.id)
+    try:
+        trades, next_cursor = await result_service.query_trades(
+            db, backtest_id, start, end, side, ticker.upper() if ticker else None, limit, after or cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor is not None:
+        response.headers[CURSOR_HEADER] = next_cursor
+    return {"trades": trades, "next_cursor": next_cursor}
+
+@router.get("/{backtest_id}/equity")
+async def get_backtest_equity(backtest_id: int, request: Request, points: Optional[int] = None,
+                              format: Optional[str] = None, db: AsyncSession = Depends(get_db),
+                              user: User = Depends(get_current_user)):
+    fmt = format or ("arrow" if MEDIA_TYPES["arrow"] in request.headers.get("accept", "") else "json")
+    if fmt not in MEDIA_TYPES:
+        raise HTTPException(status_code=406, detail=f"format must be one of {', '.join(MEDIA_TYPES)}")
+    if fmt == "arrow" and importlib.util.find_spec("pyarrow") is None:
+        raise HTTPException(status_code=406, detail="arrow responses require pyarrow")
+    dates, equity = await result_service.get_visible_equity(db, backtest_id, user.id)
+    dates, equity = result_service.downsample(dates, equity, points)
+
+    async def batches():
+        for start in range(0, len(dates), EQUITY_CHUNK_POINTS):
+            yield {"date": dates[start:start + EQUITY_CHUNK_POINTS], "equity": equity[start:start + EQUITY_CHUNK_POINTS]}
+
+    async def row_chunks():
+        async for batch in batches():
+            yield list(zip(batch["date"].tolist(), batch["equity"].tolist()))
+
+    if fmt == "arrow":
+        body = data_service.encode_arrow(batches(), EQUITY_COLUMNS)
+    else:
+        body = data_service.encode_json(row_chunks(), EQUITY_COLUMNS)
+    return StreamingResponse(body, media_type=MEDIA_TYPES[fmt])
@@ -1,11 +1,19 @@
-from typing import Optional
-from fastapi import APIRouter, Depends
+import importlib.util
+from datetime import datetime
+from typing import List, Optional
+import anyio
+from fastapi import APIRouter, Depends, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from sqlalchemy import select
+from sqlalchemy import and_, or_, select
 from sqlalchemy.ext.asyncio import AsyncSession
-from database.models import User, Project, Strategy, MarketData
+from database.models import User, Project, Strategy, MarketData, CorporateAction, DataQualityIssue
 from database.connection import AsyncSessionLocal, get_db
+from database.migrations import ensure_partitions
 from services.auth_service import get_current_user
+from services.serialization import FastJSONResponse, fetch_limit, keyset, page_response
+from services import ingest_service, data_service, resample_service, indicator_service, data_events, result_cache, bar_cache, bar_stream
+from services import corporate_actions, job_service, result_service
 
 router = APIRouter(prefix="/api/data", tags=["data"])
 
@@ -23,25 +31,276 @@ class MarketDataCreate(BaseModel):
         
 @router.post("/upload")
 async def upload_market_data(data: MarketDataCreate, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
-    db_data = MarketData(**data.dict())
+    try:
+        row = ingest_service.normalize_record(data.dict())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    await ensure_partitions(await db.connection(), row["date"], row["date"])
+    await corporate_actions.fill_adjusted(db, [row])
+    db_data = MarketData(**row)
     db.add(db_data)
+    await db.flush()
+    await resample_service.refresh_rollups(db, row["ticker"], row["date"], row["date"])
+    await result_cache.invalidate(db, row["ticker"], row["date"], row["date"])
     await db.commit()
+    data_events.publish("write", row["ticker"], row["date"], row["date"], [row])
     await db.refresh(db_data)
     return db_data
 
-@router.get("/tickers")
-async def get_tickers(db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
-    result = await db.execute(select(MarketData.ticker).distinct())
-    tickers = result.scalars().all()
-    return tickers
+@router.post("/bulk")
+async def bulk_upload_market_data(request: Request, format: Optional[str] = None, on_conflict: str = "update",
+                                  ticker: Optional[str] = None, db: AsyncSession = Depends(get_db),
+                                  current_user: User = Depends(get_current_user)):
+    # Streams the request body; rows are parsed and written chunk by chunk so memory stays flat
+    fmt = format or ingest_service.format_from_content_type(request.headers.get("content-type"))
+    if fmt not in ingest_service.FORMATS:
+        raise HTTPException(status_code=415, detail=f"format must be one of {', '.join(ingest_service.FORMATS)}")
+    if on_conflict not in ("update", "skip"):
+        raise HTTPException(status_code=400, detail="on_conflict must be 'update' or 'skip'")
+    try:
+        stats = await ingest_service.ingest_stream(db, request.stream(), fmt, on_conflict, ticker)
+    except RuntimeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return stats.as_dict()
+
+@router.get("/tickers", response_class=FastJSONResponse)
+async def get_tickers(limit: Optional[int] = None, after: Optional[str] = None, db: AsyncSession = Depends(get_db),
+                      current_user: User = Depends(get_current_user)):
+    result = await db.execute(keyset(select(MarketData.ticker).distinct(), MarketData.ticker, after, limit))
+    return page_response(result.all(), None, limit)
+
+MEDIA_TYPES = {
+    "json": "application/json",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+def _negotiate_format(format: Optional[str], accept: Optional[str]):
+    if format:
+        return format
+    for media_range in (accept or "").split(","):
+        media_type = media_range.split(";")[0].strip()
+        for name, known in MEDIA_TYPES.items():
+            if media_type == known:
+                return name
+    return "json"
+
+@router.get("/cache")
+async def get_cache_stats(current_user: User = Depends(get_current_user)):
+    # this process's bar and indicator caches and bar stream subscribers
+    return {"bars": bar_cache.bar_cache.stats(), "indicators": indicator_service.indicator_cache.stats(),
+            "streams": bar_stream.broadcaster.stats()}
+
+@router.get("/indicators")
+async def list_indicators(current_user: User = Depends(get_current_user)):
+    return {name: {"parameters": spec.defaults, "outputs": list(spec.outputs)}
+            for name, spec in indicator_service.INDICATORS.items()}
+
+@router.get("/{ticker}/indicators/{name}")
+async def get_indicator(ticker: str, name: str, request: Request, start: Optional[datetime] = None,
+                        end: Optional[datetime] = None, db: AsyncSession = Depends(get_db),
+                        current_user: User = Depends(get_current_user)):
+    # indicator parameters are passed as extra query parameters, e.g. ?window=20&k=2.5
+    ticker = ticker.upper()
+    raw = {k: v for k, v in request.query_params.items() if k not in ("start", "end")}
+    try:
+        params, dates, outputs = await indicator_service.get_indicator(db, ticker, name, raw, start, end)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"ticker": ticker, "indicator": name, "parameters": params,
+            "values": indicator_service.to_records(dates, outputs)}
 
 @router.get("/{ticker}/historical")
-async def get_historical_data(ticker: str, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
-    result = await db.execute(
-        select(MarketData).where(MarketData.ticker == ticker)
-    )
-    data = result.scalars().all()
-    return data
+async def get_historical_data(ticker: str, request: Request, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                              columns: Optional[str] = None, format: Optional[str] = None,
+                              current_user: User = Depends(get_current_user)):
+    ticker = ticker.upper()
+    fmt = _negotiate_format(format, request.headers.get("accept"))
+    if fmt not in MEDIA_TYPES:
+        raise HTTPException(status_code=406, detail=f"format must be one of {', '.join(MEDIA_TYPES)}")
+    try:
+        names = data_service.parse_columns(columns)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if fmt != "json" and importlib.util.find_spec("pyarrow") is None:
+        raise HTTPException(status_code=406, detail=f"{fmt} responses require pyarrow")
+
+    # the response outlives the request dependencies, so the stream owns its session
+    async def cached_bars():
+        async with AsyncSessionLocal() as session:
+            entry = await bar_cache.bar_cache.lookup(session, ticker, start)
+        return entry.view(start, end, names) if entry is not None else None
+
+    async def row_chunks():
+        bars = await cached_bars()
+        if bars is not None:
+            for rows in bar_cache.chunk_rows(bars, names):
+                yield rows
+            return
+        async with AsyncSessionLocal() as session:
+            async for rows in data_service.stream_bar_rows(session, ticker, start, end, names):
+                yield rows
+
+    async def batches():
+        bars = await cached_bars()
+        if bars is not None:
+            for batch in bar_cache.chunk_arrays(bars):
+                yield batch
+            return
+        async with AsyncSessionLocal() as session:
+            async for batch in data_service.stream_bar_batches(session, ticker, start, end, names):
+                yield batch
+
+    if fmt == "json":
+        body = data_service.encode_json(row_chunks(), names)
+    elif fmt == "arrow":
+        body = data_service.encode_arrow(batches(), names)
+    else:
+        body = data_service.encode_parquet(batches(), names)
+    return StreamingResponse(body, media_type=MEDIA_TYPES[fmt])
+
+@router.websocket("/{ticker}/stream")
+async def stream_bars(websocket: WebSocket, ticker: str, since: Optional[datetime] = None, token: Optional[str] = None):
+    # pushes bars as they are written; `since` first replays the bars after it. Browsers cannot set headers
+    # on a WebSocket, so the token may also come as a query parameter.
+    ticker = ticker.upper()
+    authorization = websocket.headers.get("authorization", "")
+    token = token or (authorization[7:] if authorization[:7].lower() == "bearer " else None)
+    async with AsyncSessionLocal() as session:
+        try:
+            if token is None:
+                raise HTTPException(status_code=401)
+            await get_current_user(token, session)
+        except HTTPException:
+            await websocket.close(code=1008)
+            return
+    await websocket.accept()
+    # subscribe before replaying so nothing written in between is missed
+    subscriber = bar_stream.broadcaster.subscribe(ticker)
+    replayed_until = None
+    try:
+        if since is not None:
+            async with AsyncSessionLocal() as session:
+                messages, replayed_until, complete = await bar_stream.replay(session, ticker, since)
+            for message in messages:
+                await websocket.send_text(message)
+            await websocket.send_json({"event": "replayed", "ticker": ticker, "complete": complete})
+
+        async def send_messages():
+            while True:
+                last_date, message = await subscriber.queue.get()
+                if subscriber.dropped:
+                    # fell too far behind; the client reconnects with `since` to catch up
+                    await websocket.close(code=1013)
+                    return
+                if replayed_until is not None and last_date is not None and last_date <= replayed_until:
+                    continue
+                await websocket.send_text(message)
+
+        async def wait_disconnect():
+            while (await websocket.receive())["type"] != "websocket.disconnect":
+                pass
+
+        async def until_done(task, group):
+            try:
+                await task()
+            except (WebSocketDisconnect, RuntimeError):
+                pass  # the socket closed while sending
+            group.cancel_scope.cancel()
+
+        # whichever finishes first (client gone, or this side closing) stops the other
+        async with anyio.create_task_group() as group:
+            group.start_soon(until_done, send_messages, group)
+            group.start_soon(until_done, wait_disconnect, group)
+    finally:
+        bar_stream.broadcaster.unsubscribe(ticker, subscriber)
+
+@router.get("/{ticker}/resample")
+async def resample_market_data(ticker: str, interval: str, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                               fill: bool = False, source: str = "auto", db: AsyncSession = Depends(get_db),
+                               current_user: User = Depends(get_current_user)):
+    # OHLCV bars aggregated per interval bucket (first/max/min/last/sum) with VWAP and the source bar count
+    if source not in ("auto", "raw", "rollup"):
+        raise HTTPException(status_code=400, detail="source must be 'auto', 'raw' or 'rollup'")
+    ticker = ticker.upper()
+    try:
+        bars, used = await resample_service.resample(db, ticker, interval, start, end, fill, source)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"ticker": ticker, "interval": interval, "source": used, "bars": resample_service.bars_to_records(bars)}
+
+@router.post("/{ticker}/rollups")
+async def rebuild_rollups(ticker: str, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    ticker = ticker.upper()
+    await resample_service.rebuild_rollups(db, ticker)
+    return {"ticker": ticker, "intervals": list(resample_service.ROLLUP_INTERVALS)}
+
+class CorporateActionIn(BaseModel):
+    ex_date: datetime
+    kind: str  # split or dividend
+    ratio: Optional[float] = None  # split: new shares per old share, e.g. 4 for a 4-for-1 split
+    amount: Optional[float] = None  # dividend: cash per share
+
+    class Config:
+        extra = "forbid"
+
+ACTION_COLUMNS = ("id", "ex_date", "kind", "ratio", "amount", "factor")
+ISSUE_COLUMNS = ("id", "date", "kind", "detail")
+
+async def _submit_adjust(user_id: int, ticker: str, full: bool):
+    try:
+        return await job_service.queue.submit(user_id, "adjust", {"ticker": ticker, "full": full})
+    except job_service.JobLimitExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+@router.post("/{ticker}/corporate-actions", status_code=202)
+async def upload_corporate_actions(ticker: str, actions: List[CorporateActionIn], db: AsyncSession = Depends(get_db),
+                                   current_user: User = Depends(get_current_user)):
+    # stores the actions and queues the adjustment pass over the ticker's bars before them
+    ticker = ticker.upper()
+    try:
+        records = [corporate_actions.normalize_action(action.dict()) for action in actions]
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    changed = await corporate_actions.store_actions(db, ticker, records)
+    job = await _submit_adjust(current_user.id, ticker, False) if changed else None
+    return {"ticker": ticker, "changed": changed, "job": job.snapshot() if job is not None else None}
+
+@router.get("/{ticker}/corporate-actions", response_class=FastJSONResponse)
+async def get_corporate_actions(ticker: str, db: AsyncSession = Depends(get_db),
+                                current_user: User = Depends(get_current_user)):
+    stmt = select(*[getattr(CorporateAction, c) for c in ACTION_COLUMNS]).where(CorporateAction.ticker == ticker.upper())
+    rows = (await db.execute(stmt.order_by(CorporateAction.ex_date))).all()
+    return FastJSONResponse([dict(zip(ACTION_COLUMNS, row)) for row in rows])
+
+@router.post("/{ticker}/adjust", status_code=202)
+async def adjust_market_data(ticker: str, full: bool = True, current_user: User = Depends(get_current_user)):
+    # rewrites the adjusted columns and rechecks data quality; full=false only applies new actions
+    job = await _submit_adjust(current_user.id, ticker.upper(), full)
+    return job.snapshot()
+
+@router.get("/{ticker}/quality", response_class=FastJSONResponse)
+async def get_quality_issues(ticker: str, kind: Optional[str] = None, limit: Optional[int] = None,
+                             after: Optional[str] = None, db: AsyncSession = Depends(get_db),
+                             current_user: User = Depends(get_current_user)):
+    # issues found by the adjustment passes in (date, id) order; ids do not follow dates, since an incremental
+    # pass replaces only the issues before its cutoff. `after` is the opaque X-Next-Cursor value
+    stmt = select(*[getattr(DataQualityIssue, c) for c in ISSUE_COLUMNS]).where(DataQualityIssue.ticker == ticker.upper())
+    if kind is not None:
+        stmt = stmt.where(DataQualityIssue.kind == kind)
+    if after is not None:
+        try:
+            after_date, after_id = result_service.decode_cursor(after)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        stmt = stmt.where(or_(
+            DataQualityIssue.date > after_date,
+            and_(DataQualityIssue.date == after_date, DataQualityIssue.id > after_id),
+        ))
+    stmt = stmt.order_by(DataQualityIssue.date, DataQualityIssue.id).limit(fetch_limit(limit))
+    result = await db.execute(stmt)
+    return page_response(result.all(), ISSUE_COLUMNS, limit,
+                         lambda issue: result_service.encode_cursor(issue["date"], issue["id"]))
 
 @router.delete("/{data_id}")
 async def delete_market_data(data_id: int, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
@@ -51,6 +310,11 @@ async def delete_market_data(data_id: int, db: AsyncSession = Depends(get_db), c
     data = result.scalars().first()
     if data is None:
         return {"error": "Market data not found"}
+    ticker, date = data.ticker, data.date
     await db.delete(data)
+    await db.flush()
+    await resample_service.refresh_rollups(db, ticker, date, date)
+    await result_cache.invalidate(db, ticker, date, date)
     await db.commit()
+    data_events.publish("delete", ticker, date, date)
     return {"detail": "Market data deleted"}
\ No newline at end of file
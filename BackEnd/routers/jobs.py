@@ -0,0 +1,91 @@
+import asyncio
+import json
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database.models import User, Job
+from database.connection import get_db
+from services.auth_service import get_current_user
+from services import job_service
+
+router = APIRouter(prefix="/api/jobs", tags=["jobs"])
+
+# SSE comment sent while a job is quiet so proxies keep the connection open
+KEEPALIVE_SECONDS = 15
+
+
+class JobCreate(BaseModel):
+    kind: str  # backtest, portfolio, sweep or adjust
+    payload: dict
+    priority: int = 0  # clamped to job_service.USER_PRIORITY_MIN..USER_PRIORITY_MAX
+
+    class Config:
+        extra = "forbid"
+
+
+async def get_own_job(job_id: str, user: User):
+    state = await job_service.queue.get(job_id)
+    if state is None or state.user_id != user.id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return state
+
+
+@router.post("/", status_code=202)
+async def submit_job(job: JobCreate, user: User = Depends(get_current_user)):
+    try:
+        priority = min(max(job.priority, job_service.USER_PRIORITY_MIN), job_service.USER_PRIORITY_MAX)
+        state = await job_service.queue.submit(user.id, job.kind, job.payload, priority)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except job_service.JobLimitExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return state.snapshot()
+
+
+@router.get("/")
+async def read_jobs(limit: int = 50, db: AsyncSession = Depends(get_db), user: User = Depends(get_current_user)):
+    result = await db.execute(
+        select(Job).where(Job.user_id == user.id).order_by(Job.created_at.desc()).limit(min(limit, 500))
+    )
+    return [job_service.queue.state_of(row).snapshot() for row in result.scalars().all()]
+
+
+@router.get("/{job_id}")
+async def read_job(job_id: str, partial: bool = False, user: User = Depends(get_current_user)):
+    state = await get_own_job(job_id, user)
+    return state.snapshot(include_partial=partial)
+
+
+@router.get("/{job_id}/events")
+async def job_events(job_id: str, user: User = Depends(get_current_user)):
+    state = await get_own_job(job_id, user)
+
+    async def events():
+        yield f"event: snapshot\ndata: {json.dumps(state.snapshot(), default=str)}\n\n"
+        if state.status in job_service.TERMINAL:
+            return
+        listener = job_service.queue.subscribe(state)
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(listener.get(), KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {event['event']}\ndata: {json.dumps(event, default=str)}\n\n"
+                if event["event"] == "status" and event["status"] in job_service.TERMINAL:
+                    yield f"event: snapshot\ndata: {json.dumps(state.snapshot(), default=str)}\n\n"
+                    return
+        finally:
+            job_service.queue.unsubscribe(state, listener)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@router.delete("/{job_id}")
+async def cancel_job(job_id: str, user: User = Depends(get_current_user)):
+    state = await get_own_job(job_id, user)
+    await job_service.queue.cancel(state)
+    return state.snapshot()
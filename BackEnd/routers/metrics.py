@@ -0,0 +1,33 @@
+import os
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+from services import metrics
+
+router = APIRouter(prefix="/metrics", tags=["metrics"])
+
+# scrapers send it as a bearer token; unset leaves /metrics open, e.g. behind a private network, and turns
+# off /metrics/slow, which shows SQL statements
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def require_scraper(request: Request):
+    if METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+
+
+def require_token(request: Request):
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    require_scraper(request)
+
+
+@router.get("", dependencies=[Depends(require_scraper)])
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type=CONTENT_TYPE)
+
+
+@router.get("/slow", dependencies=[Depends(require_token)])
+async def get_slow_requests():
+    # newest first; statements carry their query plans
+    return list(reversed(metrics.samples))
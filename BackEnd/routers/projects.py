@@ -6,9 +6,12 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from database.models import User, Project, Strategy
 from database.connection import AsyncSessionLocal, get_db
 from services.auth_service import get_current_user
+from services.serialization import FastJSONResponse, keyset, page_response
 
 router = APIRouter(prefix="/api/projects", tags=["projects"])
 
+PROJECT_COLUMNS = ("id", "name", "owner_id", "created_at", "description")
+
 class ProjectCreate(BaseModel):
     name: str
     description: Optional[str] = None
@@ -16,12 +19,12 @@ class ProjectCreate(BaseModel):
     class Config:
         extra = "forbid"  # reject unexpected fields like created_at sent as string
         
-@router.get("/")
-async def read_projects(db: AsyncSession = Depends(get_db),
+@router.get("/", response_class=FastJSONResponse)
+async def read_projects(limit: Optional[int] = None, after: Optional[int] = None, db: AsyncSession = Depends(get_db),
                         user: User = Depends(get_current_user)):
-    result = await db.execute(select(Project).where(Project.owner_id == user.id))
-    projects = result.scalars().all()
-    return projects
+    stmt = select(*[getattr(Project, c) for c in PROJECT_COLUMNS]).where(Project.owner_id == user.id)
+    result = await db.execute(keyset(stmt, Project.id, after, limit))
+    return page_response(result.all(), PROJECT_COLUMNS, limit, "id")
 
 @router.post("/")
 async def create_project(project_data: ProjectCreate, db: AsyncSession = Depends(get_db),
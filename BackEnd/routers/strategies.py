@@ -1,53 +1,179 @@
-from typing import Optional
-from fastapi import APIRouter, Depends
+from datetime import datetime
+import json
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from database.models import User, Project, Strategy
 from database.connection import AsyncSessionLocal, get_db
 from services.auth_service import get_current_user
+from services import backtest_service, portfolio_service, strategy_runtime, strategy_service, sweep_service
+from services.strategy_service import get_visible_strategy
+from services.serialization import DEFAULT_PAGE_SIZE, FastJSONResponse, page_response
 
 router = APIRouter(prefix="/strategies", tags=["strategies"])
 
-router.get("/")
-async def read_strategies(db: AsyncSession = Depends(get_db),
-                        user: User = Depends(get_current_user)):
-    result = await db.execute(select(Strategy))
-    strategies = result.scalars().all()
-    return strategies
+@router.get("/", response_class=FastJSONResponse)
+async def read_strategies(limit: int = DEFAULT_PAGE_SIZE, after: Optional[int] = None, status: Optional[str] = None,
+                          project_id: Optional[int] = None, updated_since: Optional[datetime] = None,
+                          updated_until: Optional[datetime] = None, include: Optional[str] = None,
+                          db: AsyncSession = Depends(get_db), user: User = Depends(get_current_user)):
+    # strategies the caller can see, a page at a time (X-Next-Cursor holds the next `after`); pass
+    # include=parameters,code for the large text columns
+    try:
+        columns = strategy_service.listing_columns(include)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    rows = await strategy_service.list_visible_strategies(
+        db, user.id, columns, after, limit, status, project_id, updated_since, updated_until
+    )
+    return page_response(rows, columns, limit, "id")
 
-router.get("/{strategy_id}")
+@router.get("/{strategy_id}")
 async def read_strategy(strategy_id: int, db: AsyncSession = Depends(get_db),
                         user: User = Depends(get_current_user)):
-    result = await db.execute(
-        select(Strategy).where(Strategy.id == strategy_id)
-    )
-    strategy = result.scalars().first()
-    if strategy is None:
-        return {"error": "Strategy not found"}
+    return await get_visible_strategy(strategy_id, db, user.id)
+
+
+class StrategyCreate(BaseModel):
+    name: str
+    project_id: int
+    parameters: Optional[dict] = None
+    code: Optional[str] = None
+    status: Optional[str] = None
+    is_public: Optional[bool] = None
+
+    class Config:
+        extra = "forbid"
+
+
+class StrategyUpdate(BaseModel):
+    name: Optional[str] = None
+    project_id: Optional[int] = None
+    parameters: Optional[dict] = None
+    code: Optional[str] = None
+    status: Optional[str] = None
+    is_public: Optional[bool] = None
+
+    class Config:
+        extra = "forbid"
+
+
+def _strategy_fields(data: BaseModel) -> dict:
+    # only the fields the client sent with a value; parameters are stored as JSON text
+    fields = {key: value for key, value in data.dict(exclude_unset=True).items() if value is not None}
+    if "parameters" in fields:
+        fields["parameters"] = json.dumps(fields["parameters"])
+    return fields
+
+
+@router.post("/")
+async def create_strategy(strategy_data: StrategyCreate, db: AsyncSession = Depends(get_db),
+                          user: User = Depends(get_current_user)):
+    await strategy_service.check_project_owner(strategy_data.project_id, db, user.id)
+    db_strategy = Strategy(**_strategy_fields(strategy_data))
+    db.add(db_strategy)
+    await db.commit()
+    await db.refresh(db_strategy)
+    return db_strategy
+
+@router.put("/{strategy_id}")
+async def update_strategy(strategy_id: int, strategy_data: StrategyUpdate, db: AsyncSession = Depends(get_db),
+                          user: User = Depends(get_current_user)):
+    strategy = await strategy_service.get_owned_strategy(strategy_id, db, user.id)
+    fields = _strategy_fields(strategy_data)
+    if "project_id" in fields:
+        await strategy_service.check_project_owner(fields["project_id"], db, user.id)
+    for key, value in fields.items():
+        setattr(strategy, key, value)
+    await db.commit()
+    await db.refresh(strategy)
     return strategy
 
-router.post("/")
-async def create_strategy(strategy_data: dict, db: AsyncSession = Depends(get_db),
-                            user: User = Depends(get_current_user)):
-        db_strategy = Strategy(**strategy_data)
-        db.add(db_strategy)
-        await db.commit()
-        await db.refresh(db_strategy)
-        return db_strategy
-
-router.put("/{strategy_id}")
-async def update_strategy(strategy_id: int, strategy_data: dict, db: AsyncSession = Depends(get_db),
-                            user: User = Depends(get_current_user)):
-        result = await db.execute(
-            select(Strategy).where(Strategy.id == strategy_id)
-        )
-        strategy = result.scalars().first()
-        if strategy is None:
-            return {"error": "Strategy not found"}
-        for key, value in strategy_data.items():
-            setattr(strategy, key, value)
-        db.add(strategy)
-        await db.commit()
-        await db.refresh(strategy)
-        return strategy
+
+class BacktestRequest(BaseModel):
+    ticker: str
+    start_date: Optional[datetime] = None
+    end_date: Optional[datetime] = None
+    parameters: Optional[dict] = None  # overrides merged over Strategy.parameters
+
+    class Config:
+        extra = "forbid"
+
+
+@router.post("/{strategy_id}/backtest")
+async def run_backtest(strategy_id: int, request: BacktestRequest, db: AsyncSession = Depends(get_db),
+                       user: User = Depends(get_current_user)):
+    strategy = await strategy_service.get_owned_strategy(strategy_id, db, user.id)
+    result = await backtest_service.run_strategy_backtest(
+        db, strategy, request.ticker.upper(), request.start_date, request.end_date, request.parameters
+    )
+    return {
+        "id": result.id,
+        "strategy_id": result.strategy_id,
+        "ticker": result.ticker,
+        "start_date": result.start_date,
+        "end_date": result.end_date,
+        "results": result.results,
+    }
+
+
+class PortfolioBacktestRequest(BaseModel):
+    tickers: List[str]
+    start_date: Optional[datetime] = None
+    end_date: Optional[datetime] = None
+    parameters: Optional[dict] = None  # overrides for the portfolio settings
+
+    class Config:
+        extra = "forbid"
+
+
+@router.post("/{strategy_id}/portfolio-backtest")
+async def run_portfolio_backtest(strategy_id: int, request: PortfolioBacktestRequest, db: AsyncSession = Depends(get_db),
+                                 user: User = Depends(get_current_user)):
+    strategy = await strategy_service.get_owned_strategy(strategy_id, db, user.id)
+    result = await portfolio_service.run_portfolio_backtest(
+        db, strategy, request.tickers, request.start_date, request.end_date, request.parameters
+    )
+    return {
+        "id": result.id,
+        "strategy_id": result.strategy_id,
+        "start_date": result.start_date,
+        "end_date": result.end_date,
+        "results": result.results,
+    }
+
+
+class SweepRequest(BaseModel):
+    tickers: List[str]
+    grid: dict  # parameter name -> list of values
+    start_date: Optional[datetime] = None
+    end_date: Optional[datetime] = None
+    store_trades: bool = False
+
+    class Config:
+        extra = "forbid"
+
+
+@router.post("/{strategy_id}/sweep")
+async def run_sweep(strategy_id: int, request: SweepRequest, db: AsyncSession = Depends(get_db),
+                    user: User = Depends(get_current_user)):
+    strategy = await strategy_service.get_owned_strategy(strategy_id, db, user.id)
+    if strategy_runtime.runs_code(strategy.code):
+        raise HTTPException(status_code=400, detail=sweep_service.CODE_STRATEGY_ERROR)
+    try:
+        sweep_service.expand_grid(request.grid)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    tickers = [t.upper() for t in request.tickers]
+
+    # results are streamed as NDJSON while the sweep runs; the stream owns its session
+    async def results():
+        async with AsyncSessionLocal() as session:
+            async for record in sweep_service.run_sweep(session, strategy, tickers, request.grid,
+                                                        request.start_date, request.end_date, request.store_trades):
+                yield json.dumps(record, default=str) + "\n"
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
@@ -7,6 +7,7 @@ from typing import Optional, List
 from database.models import User, Project
 from database.connection import AsyncSessionLocal, get_db
 from services.auth_service import get_current_user
+from services.serialization import FastJSONResponse, keyset, page_response
 from passlib.context import CryptContext
 from datetime import datetime
 
@@ -26,7 +27,15 @@ class ProjectOut(BaseModel):
     description: Optional[str] = None
     created_at: Optional[datetime] = None
     model_config = {"from_attributes": True}
-    
+
+PROJECT_OUT_COLUMNS = tuple(ProjectOut.model_fields)
+
+
+async def _project_page(db: AsyncSession, owner_id: int, after: Optional[int], limit: int):
+    stmt = select(*[getattr(Project, c) for c in PROJECT_OUT_COLUMNS]).where(Project.owner_id == owner_id)
+    result = await db.execute(keyset(stmt, Project.id, after, limit))
+    return page_response(result.all(), PROJECT_OUT_COLUMNS, limit, "id")
+
 @router.get("/me")
 async def read_current_user(db: AsyncSession = Depends(get_db),
                             current_user: User = Depends(get_current_user)):
@@ -42,20 +51,14 @@ async def read_user(user_id: int, db: AsyncSession = Depends(get_db), current_us
         return {"error": "User not found"}
     return UserOut.from_orm(user)
 
-@router.get("/me/projects/")
-async def read_my_projects(db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
-    result = await db.execute(
-        select(Project).where(Project.owner_id == current_user.id)
-    )
-    projects = result.scalars().all()
-    return [ProjectOut.from_orm(p) for p in projects]
+@router.get("/me/projects/", response_class=FastJSONResponse)
+async def read_my_projects(limit: Optional[int] = None, after: Optional[int] = None, db: AsyncSession = Depends(get_db),
+                           current_user: User = Depends(get_current_user)):
+    return await _project_page(db, current_user.id, after, limit)
 
-@router.get("/{user_id}/projects/")
-async def read_user_projects(user_id: int, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
-    result = await db.execute(
-        select(Project).where(Project.owner_id == user_id)
-    )
-    projects = result.scalars().all()
-    return [ProjectOut.from_orm(p) for p in projects]
+@router.get("/{user_id}/projects/", response_class=FastJSONResponse)
+async def read_user_projects(user_id: int, limit: Optional[int] = None, after: Optional[int] = None,
+                             db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    return await _project_page(db, user_id, after, limit)
 
 
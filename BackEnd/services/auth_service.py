@@ -1,17 +1,151 @@
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy import select
+from sqlalchemy import event, select
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, object_session
 from database.connection import get_db
 from database.models import User
 from jose import JWTError, jwt as jose_jwt
+from collections import OrderedDict
 import os
+import time
 
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "300"))
+# Trust verified token claims without looking the user up at all. A deleted user's token then
+# keeps working until it expires, so this is opt-in.
+AUTH_STATELESS = os.getenv("AUTH_STATELESS", "").lower() in ("1", "true", "yes")
+
 oauth2_bearer = OAuth2PasswordBearer(tokenUrl="api/auth/token")
 
+
+class AuthenticatedUser:
+    # the identity routes see for the caller; deliberately carries no password hash
+    __slots__ = ("id", "name", "email", "created_at")
+
+    def __init__(self, id, name, email, created_at=None):
+        self.id = id
+        self.name = name
+        self.email = email
+        self.created_at = created_at
+
+    @classmethod
+    def from_orm(cls, user: User):
+        return cls(user.id, user.name, user.email, user.created_at)
+
+
+class UserCache:
+    # LRU of identities by user id with a TTL, plus an email -> id index for old tokens without user_id
+    def __init__(self, max_size: int = AUTH_CACHE_SIZE, ttl: float = AUTH_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.emails = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.stateless = 0
+
+    def get(self, user_id: int = None, email: str = None):
+        if user_id is None:
+            user_id = self.emails.get(email)
+        entry = self.entries.get(user_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires, identity = entry
+        if expires < time.monotonic():
+            self._remove(user_id)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self.entries.move_to_end(user_id)
+        self.hits += 1
+        return identity
+
+    def put(self, identity: AuthenticatedUser):
+        self._remove(identity.id)
+        self.entries[identity.id] = (time.monotonic() + self.ttl, identity)
+        self.emails[identity.email] = identity.id
+        while len(self.entries) > self.max_size:
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def invalidate(self, user_id: int = None, email: str = None):
+        if user_id is None:
+            user_id = self.emails.get(email)
+        if user_id is not None and user_id in self.entries:
+            self._remove(user_id)
+            self.invalidations += 1
+        if email is not None:
+            self.emails.pop(email, None)
+
+    def clear(self):
+        self.entries.clear()
+        self.emails.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "stateless": self.stateless,
+        }
+
+    def _remove(self, user_id):
+        entry = self.entries.pop(user_id, None)
+        if entry is not None and self.emails.get(entry[1].email) == user_id:
+            del self.emails[entry[1].email]
+
+
+user_cache = UserCache()
+
+
+def invalidate_user(user_id: int = None, email: str = None):
+    user_cache.invalidate(user_id, email)
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_changed_user(mapper, connection, target):
+    # covers every ORM update/delete of a user, whichever route performs it. This runs at flush; a request
+    # reading the user before the commit can cache the old row again, so it is invalidated once more then
+    invalidate_user(target.id, target.email)
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault("changed_users", set()).add((target.id, target.email))
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed_users(session):
+    for user_id, email in session.info.pop("changed_users", ()):
+        invalidate_user(user_id, email)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_changed_users(session):
+    session.info.pop("changed_users", None)
+
+
+def user_id_from_token(token: str):
+    # verified user id for request keying (e.g. rate limits); None when the token is not valid
+    try:
+        payload = jose_jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    return payload.get("user_id")
+
+
 async def get_current_user(token: str = Depends(oauth2_bearer), db: AsyncSession = Depends(get_db)):
     credentials_exception = HTTPException(
         status_code=401,
@@ -25,10 +159,24 @@ async def get_current_user(token: str = Depends(oauth2_bearer), db: AsyncSession
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    result = await db.execute(
-        select(User).where(User.email == username)
-    )
+    user_id = payload.get("user_id")
+
+    # tokens issued before the name claim existed fall through to the lookup
+    if AUTH_STATELESS and user_id is not None and payload.get("name") is not None:
+        user_cache.stateless += 1
+        return AuthenticatedUser(user_id, payload.get("name"), username)
+
+    identity = user_cache.get(user_id, username)
+    if identity is not None and identity.email == username:
+        return identity
+
+    if user_id is not None:
+        result = await db.execute(select(User).where(User.id == user_id))
+    else:
+        result = await db.execute(select(User).where(User.email == username))
     user = result.scalars().first()
-    if user is None:
+    if user is None or user.email != username:
         raise credentials_exception
-    return user
+    identity = AuthenticatedUser.from_orm(user)
+    user_cache.put(identity)
+    return identity
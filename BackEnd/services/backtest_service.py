@@ -1,3 +1,7 @@
+import asyncio
+import json
+from datetime import datetime
+import numpy as np
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy import select
@@ -6,4 +10,383 @@ from database.connection import get_db
 from database.models import User, Project, Strategy, MarketData, BacktestResult
 from jose import JWTError, jwt as jose_jwt
 from services.auth_service import get_current_user
+from services import bar_cache, corporate_actions, data_service, indicator_service, result_cache, result_service, strategy_runtime
 
+DEFAULT_PARAMETERS = {
+    "signal": "sma_crossover",
+    "fast": 10,
+    "slow": 50,
+    "lookback": 20,
+    "threshold": 0.0,
+    "entry_z": 2.0,
+    "exit_z": 0.5,
+    "rsi_window": 14,
+    "oversold": 30.0,
+    "overbought": 70.0,
+    "signal_span": 9,
+    "allow_short": False,
+    "initial_capital": 100000.0,
+    "commission": 0.0005,  # fraction of traded notional
+    "slippage": 0.0005,    # fraction of traded notional
+    "periods_per_year": 252,
+}
+BAR_COLUMNS = ("date", "open", "high", "low", "close", "volume")
+
+
+def parse_parameters(raw, overrides: dict = None) -> dict:
+    # Strategy.parameters is stored as JSON text, but older rows may hold a dict
+    if isinstance(raw, str):
+        raw = json.loads(raw) if raw.strip() else {}
+    params = dict(DEFAULT_PARAMETERS)
+    params.update(raw or {})
+    params.update(overrides or {})
+    return params
+
+
+def forward_fill(values: np.ndarray, fill: float = 0.0) -> np.ndarray:
+    # carries the last non-NaN value forward; leading NaNs become `fill`
+    index = np.where(np.isnan(values), -1, np.arange(len(values)))
+    np.maximum.accumulate(index, out=index)
+    return np.where(index >= 0, values[np.maximum(index, 0)], fill)
+
+
+def _sma_crossover(bars, params):
+    close = bars["close"]
+    fast = indicator_service.sma(close, int(params["fast"]))
+    slow = indicator_service.sma(close, int(params["slow"]))
+    short = -1.0 if params["allow_short"] else 0.0
+    signal = np.where(fast > slow, 1.0, short)
+    signal[np.isnan(slow) | np.isnan(fast)] = 0.0
+    return signal
+
+
+def _momentum(bars, params):
+    close = bars["close"]
+    lookback = int(params["lookback"])
+    change = np.full(len(close), np.nan)
+    change[lookback:] = close[lookback:] / close[:-lookback] - 1.0
+    short = -1.0 if params["allow_short"] else 0.0
+    signal = np.where(change > params["threshold"], 1.0, short)
+    signal[np.isnan(change)] = 0.0
+    return signal
+
+
+def _mean_reversion(bars, params):
+    # enter when the z-score stretches past entry_z, hold until it comes back inside exit_z
+    close = bars["close"]
+    lookback = int(params["lookback"])
+    mean = indicator_service.sma(close, lookback)
+    std = indicator_service.rolling_std(close, lookback)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        z = (close - mean) / std
+    events = np.full(len(close), np.nan)
+    events[np.abs(z) < params["exit_z"]] = 0.0
+    events[z < -params["entry_z"]] = 1.0
+    if params["allow_short"]:
+        events[z > params["entry_z"]] = -1.0
+    return forward_fill(events)
+
+
+def _rsi(bars, params):
+    # long from oversold until rsi recovers past the midline; short from overbought when allowed
+    values = indicator_service.rsi(bars["close"], int(params["rsi_window"]))
+    events = np.full(len(values), np.nan)
+    events[np.abs(values - 50.0) < 5.0] = 0.0
+    events[values < params["oversold"]] = 1.0
+    if params["allow_short"]:
+        events[values > params["overbought"]] = -1.0
+    return forward_fill(events)
+
+
+def _macd(bars, params):
+    lines = indicator_service.macd(bars["close"], int(params["fast"]), int(params["slow"]), int(params["signal_span"]))
+    short = -1.0 if params["allow_short"] else 0.0
+    signal = np.where(lines["histogram"] > 0, 1.0, short)
+    # the slow ema needs about `slow` bars before the crossover means anything
+    signal[:int(params["slow"])] = 0.0
+    return signal
+
+
+def _buy_and_hold(bars, params):
+    return np.ones(len(bars["close"]))
+
+
+SIGNALS = {
+    "sma_crossover": _sma_crossover,
+    "momentum": _momentum,
+    "mean_reversion": _mean_reversion,
+    "rsi": _rsi,
+    "macd": _macd,
+    "buy_and_hold": _buy_and_hold,
+}
+
+
+def generate_positions(bars: dict, params: dict) -> np.ndarray:
+    signal = SIGNALS.get(params["signal"])
+    if signal is None:
+        raise ValueError(f"unknown signal '{params['signal']}', expected one of {', '.join(SIGNALS)}")
+    return np.clip(signal(bars, params).astype(np.float64), -1.0, 1.0)
+
+
+def extract_trades(positions: np.ndarray, close: np.ndarray, equity: np.ndarray, slippage: float) -> dict:
+    # a trade is a run of constant non-zero target position; runs still open at the end are closed on the last bar
+    n = len(positions)
+    padded = np.concatenate(([0.0], positions, [0.0]))
+    changes = np.flatnonzero(padded[1:] != padded[:-1])
+    entries = changes[padded[changes + 1] != 0]
+    exits = changes[padded[changes] != 0]
+    exits = np.minimum(exits, n - 1)
+
+    side = np.sign(positions[entries])
+    size = np.abs(positions[entries])
+    entry_price = close[entries] * (1.0 + side * slippage)
+    exit_price = close[exits] * (1.0 - side * slippage)
+    equity_before = np.where(entries > 0, equity[np.maximum(entries - 1, 0)], equity[0])
+    return {
+        "entry_index": entries,
+        "exit_index": exits,
+        "side": side,
+        "size": size,
+        "entry_price": entry_price,
+        "exit_price": exit_price,
+        "return": side * (exit_price / entry_price - 1.0) * size,
+        "pnl": equity[exits] - equity_before,
+    }
+
+
+def _max_drawdown(equity: np.ndarray) -> float:
+    peak = np.maximum.accumulate(equity)
+    return float(np.min(equity / peak - 1.0)) if len(equity) else 0.0
+
+
+def compute_metrics(dates, strategy_returns, equity, held_bars, turnover, trade_returns, params) -> dict:
+    n = len(equity)
+    capital = float(params["initial_capital"])
+    periods = float(params["periods_per_year"])
+    final = float(equity[-1]) if n else capital
+    mean = float(np.mean(strategy_returns)) if n else 0.0
+    std = float(np.std(strategy_returns)) if n else 0.0
+    downside = strategy_returns[strategy_returns < 0]
+    downside_std = float(np.sqrt(np.mean(downside * downside))) if len(downside) else 0.0
+    years = (dates[-1] - dates[0]) / np.timedelta64(365 * 24 * 3600, "s") if n > 1 else 0.0
+    trade_count = len(trade_returns)
+    return {
+        "bars": n,
+        "initial_capital": capital,
+        "final_equity": final,
+        "total_return": final / capital - 1.0,
+        "cagr": float((final / capital) ** (1.0 / years) - 1.0) if years > 0 and final > 0 else None,
+        "volatility": float(std * np.sqrt(periods)),
+        "sharpe": float(mean / std * np.sqrt(periods)) if std > 0 else None,
+        "sortino": float(mean / downside_std * np.sqrt(periods)) if downside_std > 0 else None,
+        "max_drawdown": _max_drawdown(equity),
+        "exposure": held_bars / n if n else 0.0,
+        "turnover": float(turnover),
+        "trades": trade_count,
+        "win_rate": float(np.mean(trade_returns > 0)) if trade_count else None,
+        "avg_trade_return": float(np.mean(trade_returns)) if trade_count else None,
+    }
+
+
+def run_backtest(bars: dict, params: dict, positions: np.ndarray = None) -> dict:
+    # positions[t] is the target decided at the close of bar t; it is held over bar t + 1
+    close = bars["close"]
+    n = len(close)
+    if positions is None:
+        positions = generate_positions(bars, params)
+
+    held = np.zeros(n)
+    held[1:] = positions[:-1]
+    returns = np.zeros(n)
+    returns[1:] = close[1:] / close[:-1] - 1.0
+    traded = np.abs(np.diff(positions, prepend=0.0))
+    costs = traded * (params["commission"] + params["slippage"])
+    strategy_returns = held * returns - costs
+    equity = params["initial_capital"] * np.cumprod(1.0 + strategy_returns)
+
+    trades = extract_trades(positions, close, equity, params["slippage"])
+    # everything needed to carry the run on over later bars without replaying it
+    state = {
+        "position": float(positions[-1]),
+        "held": float(held[-1]),
+        "held_bars": int(np.count_nonzero(held)),
+        "turnover": float(np.sum(np.abs(np.diff(held, prepend=0.0)))),
+        "equity": float(equity[-1]),
+    }
+    return {
+        "metrics": compute_metrics(bars["date"], strategy_returns, equity, state["held_bars"], state["turnover"],
+                                   trades["return"], params),
+        "equity": equity,
+        "positions": positions,
+        "trades": trades,
+        "state": state,
+    }
+
+
+def warmup_bars(params: dict):
+    # bars of history a signal looks back over; None when it carries state from arbitrarily far back
+    # (ema, wilder smoothing, held entries), in which case a run can only be recomputed from the start
+    signal = params["signal"]
+    if signal == "sma_crossover":
+        return max(int(params["fast"]), int(params["slow"]))
+    if signal == "momentum":
+        return int(params["lookback"])
+    if signal == "buy_and_hold":
+        return 0
+    return None
+
+
+def extend_backtest(bars: dict, params: dict, positions: np.ndarray, state: dict) -> dict:
+    # carries a finished run on: bars[0] is the last bar of that run and positions[0] its final target
+    close = bars["close"]
+    held = positions[:-1]
+    returns = close[1:] / close[:-1] - 1.0
+    costs = np.abs(np.diff(positions)) * (params["commission"] + params["slippage"])
+    strategy_returns = held * returns - costs
+    equity = state["equity"] * np.cumprod(np.r_[1.0, 1.0 + strategy_returns])
+    return {
+        "equity": equity,
+        "strategy_returns": strategy_returns,
+        "trades": extract_trades(positions, close, equity, params["slippage"]),
+        "state": {
+            "position": float(positions[-1]),
+            "held": float(held[-1]),
+            "held_bars": state["held_bars"] + int(np.count_nonzero(held)),
+            "turnover": state["turnover"] + float(np.sum(np.abs(np.diff(held, prepend=state["held"])))),
+            "equity": float(equity[-1]),
+        },
+    }
+
+
+def to_datetime(value: np.datetime64) -> datetime:
+    return value.astype("datetime64[us]").astype(datetime)
+
+
+def build_result(strategy_id: int, ticker: str, bars: dict, params: dict, outcome: dict) -> BacktestResult:
+    # trades are written separately to backtest_trades once the result has an id
+    dates = bars["date"]
+    return BacktestResult(
+        strategy_id=strategy_id,
+        ticker=ticker,
+        start_date=to_datetime(dates[0]),
+        end_date=to_datetime(dates[-1]),
+        results={"metrics": outcome["metrics"], "parameters": params},
+        trade_count=len(outcome["trades"]["entry_index"]),
+        equity_curve=result_service.encode_series(dates, outcome["equity"]),
+        logs="",
+    )
+
+
+async def resume_backtest(db: AsyncSession, strategy: Strategy, ticker: str, start, end, params: dict,
+                          key: str, stamp: str):
+    # carries a cached run that stops short of `end` on over the newer bars instead of replaying it all;
+    # None when there is nothing to resume from or the signal's state cannot be rebuilt from a window
+    warmup = warmup_bars(params)
+    if warmup is None or strategy_runtime.runs_code(strategy.code):
+        return None
+    cached = await result_cache.resume_candidate(db, key, ticker, start, end)
+    if cached is None:
+        return None
+    state = cached.cache_state
+    stmt = data_service.bar_query(ticker, start, cached.end_date, BAR_COLUMNS).where(MarketData.date < cached.end_date)
+    rows = (await db.execute(stmt.order_by(None).order_by(MarketData.date.desc()).limit(warmup))).all()
+    history = data_service.rows_to_arrays(rows[::-1], BAR_COLUMNS)
+    tail = await bar_cache.fetch_bars(db, ticker, cached.end_date, end, BAR_COLUMNS)
+    if len(tail["close"]) < 2:
+        return None
+    window = {name: np.concatenate((history[name], tail[name])) for name in BAR_COLUMNS}
+    window = await corporate_actions.adjust_bars(db, ticker, window)
+    tail = {name: values[len(history["close"]):] for name, values in window.items()}
+    positions = (await asyncio.to_thread(generate_positions, window, params))[len(history["close"]):]
+    if positions[0] != state["position"]:
+        return None
+    outcome = await asyncio.to_thread(extend_backtest, tail, params, positions, state)
+
+    trades = result_service.compact_trades(outcome["trades"], tail["date"])
+    carried = await result_cache.open_trade(db, cached.id) if state["position"] != 0 else None
+    if carried is not None:
+        # the first trade continues the one still open when the cached run ended
+        trades["entry_date"][0] = np.datetime64(carried.entry_date, "us")
+        trades["entry_price"][0] = carried.entry_price
+        trades["return"][0] = trades["side"][0] * (trades["exit_price"][0] / carried.entry_price - 1.0) * trades["size"][0]
+        trades["pnl"][0] += carried.pnl
+    exclude_id = carried.id if carried is not None else None
+    returns = np.concatenate((await result_cache.trade_returns(db, cached.id, exclude_id), trades["return"]))
+
+    previous_dates, previous_equity = result_service.decode_series(cached.equity_curve)
+    dates = np.concatenate((previous_dates, tail["date"][1:].astype("datetime64[us]")))
+    equity = np.concatenate((previous_equity, outcome["equity"][1:]))
+    strategy_returns = np.concatenate((
+        previous_equity / np.r_[params["initial_capital"], previous_equity[:-1]] - 1.0, outcome["strategy_returns"]
+    ))
+    next_state = outcome["state"]
+    result = BacktestResult(
+        strategy_id=strategy.id,
+        ticker=ticker,
+        start_date=cached.start_date,
+        end_date=to_datetime(tail["date"][-1]),
+        results={
+            "metrics": compute_metrics(dates, strategy_returns, equity, next_state["held_bars"],
+                                       next_state["turnover"], returns, params),
+            "parameters": params,
+        },
+        trade_count=len(returns),
+        equity_curve=result_service.encode_series(dates, equity),
+        cache_key=key,
+        data_stamp=stamp,
+        cache_state=next_state,
+        logs=f"resumed from backtest {cached.id}",
+    )
+    db.add(result)
+    await db.flush()
+    await result_cache.copy_trades(db, cached.id, result.id, exclude_id)
+    await result_service.save_trades(db, result_service.trade_rows(result.id, trades, ticker))
+    await db.commit()
+    await db.refresh(result)
+    return result
+
+
+async def run_strategy_backtest(db: AsyncSession, strategy: Strategy, ticker: str, start=None, end=None,
+                                overrides: dict = None) -> BacktestResult:
+    params = parse_parameters(strategy.parameters, overrides)
+    key = stamp = None
+    if result_cache.ENABLED:
+        key = result_cache.cache_key(strategy.code, params, ticker, start)
+        stamp = await result_cache.data_stamp(db, ticker, start, end)
+        cached = await result_cache.lookup(db, key, stamp, strategy.id)
+        if cached is not None:
+            result_cache.stats.hits += 1
+            return cached
+        try:
+            resumed = await resume_backtest(db, strategy, ticker, start, end, params, key, stamp)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if resumed is not None:
+            result_cache.stats.resumed += 1
+            return resumed
+        result_cache.stats.misses += 1
+
+    # raw bars are shared with the cache; splits and dividends are applied to this run's copy
+    bars = await corporate_actions.adjust_bars(db, ticker, await bar_cache.fetch_bars(db, ticker, start, end, BAR_COLUMNS))
+    if len(bars["close"]) < 2:
+        raise HTTPException(status_code=404, detail="Not enough market data for backtest")
+    try:
+        positions = None
+        if strategy_runtime.runs_code(strategy.code):
+            # user code gets the whole arrays once and returns the positions
+            positions = await strategy_runtime.generate_positions(strategy.code, bars, params)
+        # numpy releases the GIL for the heavy array work, so keep it off the event loop
+        outcome = await asyncio.to_thread(run_backtest, bars, params, positions)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    result = build_result(strategy.id, ticker, bars, params, outcome)
+    result.cache_key = key
+    result.data_stamp = stamp
+    result.cache_state = outcome["state"] if key is not None else None
+    db.add(result)
+    await db.flush()
+    trades = result_service.compact_trades(outcome["trades"], bars["date"])
+    await result_service.save_trades(db, result_service.trade_rows(result.id, trades, ticker))
+    await db.commit()
+    await db.refresh(result)
+    return result
@@ -0,0 +1,263 @@
+import asyncio
+import os
+import time
+from collections import Counter, OrderedDict
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database.models import MarketData
+from services import data_events, data_service
+
+# Process-wide cache of the bars of frequently read tickers as contiguous arrays, shared by the historical
+# endpoint, backtests, sweeps, indicators and resampling. A ticker is loaded once it has been read
+# ADMIT_AFTER times and the least recently used tickers are evicted past the byte budget. Writes published
+# on data_events that land after the cached bars are appended in place; any other write or delete drops
+# the ticker. Writes made by other worker processes are picked up by a cheap count/max check every
+# REVALIDATE_SECONDS.
+
+CACHE_BYTES = int(os.getenv("BAR_CACHE_BYTES", str(256 * 1024 * 1024)))
+ADMIT_AFTER = int(os.getenv("BAR_CACHE_ADMIT_AFTER", "2"))
+# keep only the latest N bars of a ticker (a ring of at most 2N); 0 keeps the whole history
+MAX_BARS = int(os.getenv("BAR_CACHE_MAX_BARS", "0"))
+# 0 turns the cross-process check off, e.g. with a single worker
+REVALIDATE_SECONDS = float(os.getenv("BAR_CACHE_REVALIDATE_SECONDS", "30"))
+COLUMNS = data_service.BAR_COLUMNS
+
+
+class TickerBars:
+    # all columns of one ticker in arrays with spare capacity. Appends only write past `length` and every
+    # reallocation makes new arrays, so views handed out earlier never change underneath their readers.
+    def __init__(self, arrays: dict, complete: bool, version: int):
+        self.length = len(arrays["date"])
+        capacity = max(16, self.length + self.length // 8)
+        self.columns = {}
+        for name in COLUMNS:
+            column = np.empty(capacity, dtype=data_service.COLUMN_DTYPES[name])
+            column[:self.length] = arrays[name]
+            self.columns[name] = column
+        self.complete = complete  # False when older bars than the first one cached exist
+        self.version = version
+        self.checked_at = time.monotonic()
+
+    @property
+    def first_date(self):
+        return self.columns["date"][0] if self.length else None
+
+    @property
+    def last_date(self):
+        return self.columns["date"][self.length - 1].item() if self.length else None
+
+    @property
+    def nbytes(self) -> int:
+        return sum(column.nbytes for column in self.columns.values())
+
+    def covers(self, start=None) -> bool:
+        return self.complete or (start is not None and self.length and np.datetime64(start, "us") >= self.first_date)
+
+    def append(self, rows: list):
+        # rows must be sorted and all later than the last cached bar
+        if self.length + len(rows) > len(self.columns["date"]):
+            capacity = max(len(self.columns["date"]) * 2, self.length + len(rows))
+            self.columns = {name: np.resize(column, capacity) for name, column in self.columns.items()}
+        for name, column in self.columns.items():
+            if name == "date":
+                values = np.array([row["date"] for row in rows], dtype="datetime64[us]")
+            else:
+                values = [np.nan if row.get(name) is None else row[name] for row in rows]
+            column[self.length:self.length + len(rows)] = values
+        self.length += len(rows)
+        if MAX_BARS and self.length >= 2 * MAX_BARS:
+            self.columns = {name: column[self.length - MAX_BARS:self.length].copy() for name, column in self.columns.items()}
+            self.length = MAX_BARS
+            self.complete = False
+
+    def view(self, start=None, end=None, columns=COLUMNS) -> dict:
+        dates = self.columns["date"][:self.length]
+        lo = np.searchsorted(dates, np.datetime64(start, "us")) if start is not None else 0
+        hi = np.searchsorted(dates, np.datetime64(end, "us"), side="right") if end is not None else self.length
+        bars = {}
+        for name in columns:
+            values = self.columns[name][lo:hi]
+            values.flags.writeable = False
+            bars[name] = values
+        return bars
+
+
+class BarCache:
+    def __init__(self, max_bytes: int = CACHE_BYTES, admit_after: int = ADMIT_AFTER):
+        self.max_bytes = max_bytes
+        self.admit_after = admit_after
+        self.entries = OrderedDict()
+        self.reads = Counter()
+        self.locks = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.appended_bars = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.revalidations = 0
+
+    def put(self, ticker: str, entry: TickerBars):
+        self.drop(ticker)
+        if entry.nbytes > self.max_bytes:
+            return
+        self.entries[ticker] = entry
+        self.bytes += entry.nbytes
+        self._evict()
+
+    def _evict(self):
+        while self.bytes > self.max_bytes and len(self.entries) > 1:
+            self.drop(next(iter(self.entries)))
+            self.evictions += 1
+
+    def drop(self, ticker: str):
+        entry = self.entries.pop(ticker, None)
+        if entry is not None:
+            self.bytes -= entry.nbytes
+
+    def _append(self, ticker: str, entry: TickerBars, rows: list, version: int):
+        before = entry.nbytes
+        entry.append(rows)
+        entry.version = version
+        self.appended_bars += len(rows)
+        self.bytes += entry.nbytes - before
+        self._evict()
+
+    def on_event(self, event):
+        entry = self.entries.get(event.ticker)
+        if entry is None:
+            return
+        if event.kind == "write" and event.rows and entry.last_date is not None and event.start > entry.last_date:
+            rows = sorted(event.rows, key=lambda row: row["date"])
+            if all(a["date"] < b["date"] for a, b in zip(rows, rows[1:])):
+                self._append(event.ticker, entry, rows, event.version)
+                return
+        self.drop(event.ticker)
+        self.invalidations += 1
+
+    async def _load(self, db: AsyncSession, ticker: str):
+        version = data_events.version(ticker)
+        if MAX_BARS:
+            stmt = data_service.bar_query(ticker, columns=COLUMNS).order_by(None).order_by(MarketData.date.desc())
+            rows = (await db.execute(stmt.limit(MAX_BARS))).all()[::-1]
+            complete = len(rows) < MAX_BARS
+        else:
+            rows = (await db.execute(data_service.bar_query(ticker, columns=COLUMNS))).all()
+            complete = True
+        self.loads += 1
+        # a write published while loading may be missing from the rows; cache only a consistent copy
+        if rows and data_events.version(ticker) == version:
+            self.put(ticker, TickerBars(data_service.rows_to_arrays(rows, COLUMNS), complete, version))
+
+    async def _revalidate(self, db: AsyncSession, ticker: str, entry: TickerBars):
+        # catches writes from other processes: same count and last date means nothing changed. A change is
+        # published on data_events like a local write, so the version moves and every cache sees it; bars
+        # that only extend the series come with the event and are appended
+        self.revalidations += 1
+        version = data_events.version(ticker)
+        count, last = await watermark(db, ticker, None if entry.complete else entry.first_date.item())
+        if self.entries.get(ticker) is not entry or data_events.version(ticker) != version:
+            return
+        if count == entry.length and last == entry.last_date:
+            entry.checked_at = time.monotonic()
+            return
+        if last is not None and entry.last_date is not None and last > entry.last_date:
+            stmt = data_service.bar_query(ticker, columns=COLUMNS).where(MarketData.date > entry.last_date)
+            rows = [dict(zip(COLUMNS, row)) for row in (await db.execute(stmt)).all()]
+            if (self.entries.get(ticker) is entry and data_events.version(ticker) == version
+                    and entry.length + len(rows) == count):
+                data_events.publish("write", ticker, rows[0]["date"], rows[-1]["date"], rows)
+                entry.checked_at = time.monotonic()
+                return
+        if data_events.version(ticker) == version:
+            data_events.publish("write", ticker, data_events.MIN_DATE, data_events.MAX_DATE)
+
+    async def lookup(self, db: AsyncSession, ticker: str, start=None):
+        # the cached bars of `ticker` when they reach back to `start`, loading the ticker once it is read
+        # often enough; None means read from the database
+        entry = self.entries.get(ticker)
+        if entry is not None and REVALIDATE_SECONDS and time.monotonic() - entry.checked_at > REVALIDATE_SECONDS:
+            await self._revalidate(db, ticker, entry)
+            entry = self.entries.get(ticker)
+        if entry is None:
+            self.reads[ticker] += 1
+            if self.reads[ticker] >= self.admit_after:
+                lock = self.locks.setdefault(ticker, asyncio.Lock())
+                async with lock:
+                    if ticker not in self.entries:
+                        await self._load(db, ticker)
+                self.locks.pop(ticker, None)
+                entry = self.entries.get(ticker)
+        if entry is not None and entry.covers(start):
+            self.entries.move_to_end(ticker)
+            self.hits += 1
+            return entry
+        self.misses += 1
+        return None
+
+    async def fetch_bars(self, db: AsyncSession, ticker: str, start=None, end=None, columns=COLUMNS) -> dict:
+        # same arrays as data_service.fetch_bars; cached ones are read-only views
+        entry = await self.lookup(db, ticker, start)
+        if entry is None:
+            return await data_service.fetch_bars(db, ticker, start, end, columns)
+        return entry.view(start, end, columns)
+
+    def clear(self):
+        self.entries.clear()
+        self.reads.clear()
+        self.bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None,
+            "loads": self.loads,
+            "appended_bars": self.appended_bars,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "revalidations": self.revalidations,
+        }
+
+
+async def watermark(db: AsyncSession, ticker: str, since=None):
+    # (bar count, last bar date) of a ticker, from `since` on; equal watermarks mean the bars are unchanged
+    stmt = select(func.count(), func.max(MarketData.date)).where(MarketData.ticker == ticker)
+    if since is not None:
+        stmt = stmt.where(MarketData.date >= since)
+    return (await db.execute(stmt)).one()
+
+
+bar_cache = BarCache()
+data_events.subscribe(bar_cache.on_event)
+
+
+async def fetch_bars(db: AsyncSession, ticker: str, start=None, end=None, columns=COLUMNS) -> dict:
+    return await bar_cache.fetch_bars(db, ticker, start, end, columns)
+
+
+def chunk_arrays(bars: dict, chunk_rows: int = data_service.FETCH_CHUNK_ROWS):
+    # cached arrays in the batches the arrow and parquet encoders take; sized from whichever columns were
+    # asked for, since a view only holds those
+    length = len(next(iter(bars.values()))) if bars else 0
+    for offset in range(0, length, chunk_rows):
+        yield {name: values[offset:offset + chunk_rows] for name, values in bars.items()}
+
+
+def chunk_rows(bars: dict, columns, chunk_rows: int = data_service.FETCH_CHUNK_ROWS):
+    # row tuples from cached arrays, in the chunks the JSON encoder takes; missing adj_close becomes null
+    for chunk in chunk_arrays(bars, chunk_rows):
+        lists = []
+        for name in columns:
+            values = chunk[name]
+            if values.dtype.kind == "f" and np.isnan(values).any():
+                lists.append([None if value != value else value for value in values.tolist()])
+            else:
+                lists.append(values.tolist())
+        yield list(zip(*lists))
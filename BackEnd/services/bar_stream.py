@@ -0,0 +1,110 @@
+import asyncio
+import os
+from datetime import timedelta
+from services import bar_cache, data_events, data_service, serialization
+
+# Pushes written bars to WebSocket subscribers (routers/data.py::stream_bars). Each data event is encoded
+# to JSON once and the same text is queued for every subscriber of the ticker. Queues are bounded: a
+# subscriber that falls BUFFER_MESSAGES behind is cut off instead of holding memory, and can reconnect with
+# `since` to replay what it missed.
+
+BUFFER_MESSAGES = int(os.getenv("BAR_STREAM_BUFFER", "256"))
+REPLAY_LIMIT = int(os.getenv("BAR_STREAM_REPLAY_LIMIT", "10000"))
+REPLAY_CHUNK = 1000
+COLUMNS = data_service.BAR_COLUMNS
+
+
+class Subscriber:
+    __slots__ = ("queue", "dropped")
+
+    def __init__(self, size: int):
+        self.queue = asyncio.Queue(size)
+        self.dropped = False
+
+    def offer(self, message) -> bool:
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            self.dropped = True
+            return False
+
+
+def bars_message(ticker: str, records: list) -> str:
+    return serialization.dumps({"event": "bars", "ticker": ticker, "bars": records}).decode("utf-8")
+
+
+def encode_event(event):
+    # (date of the newest bar or None, message text)
+    if event.kind == "write" and event.rows:
+        rows = sorted(event.rows, key=lambda row: row["date"])
+        records = [{name: row.get(name) for name in COLUMNS} for row in rows]
+        return rows[-1]["date"], bars_message(event.ticker, records)
+    # no rows to send (deletes, rewrites without rows): clients re-read the range
+    message = {"event": "invalidate", "kind": event.kind, "ticker": event.ticker, "start": event.start, "end": event.end}
+    return None, serialization.dumps(message).decode("utf-8")
+
+
+class BarBroadcaster:
+    def __init__(self, buffer: int = BUFFER_MESSAGES):
+        self.buffer = buffer
+        self.subscribers = {}
+        self.messages = 0
+        self.deliveries = 0
+        self.dropped = 0
+
+    def subscribe(self, ticker: str) -> Subscriber:
+        subscriber = Subscriber(self.buffer)
+        self.subscribers.setdefault(ticker, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, ticker: str, subscriber: Subscriber):
+        listeners = self.subscribers.get(ticker)
+        if listeners is not None:
+            listeners.discard(subscriber)
+            if not listeners:
+                del self.subscribers[ticker]
+
+    def on_event(self, event):
+        listeners = self.subscribers.get(event.ticker)
+        if not listeners:
+            return
+        message = encode_event(event)
+        self.messages += 1
+        for subscriber in list(listeners):
+            if subscriber.offer(message):
+                self.deliveries += 1
+            else:
+                self.dropped += 1
+                listeners.discard(subscriber)
+        if not listeners:
+            del self.subscribers[event.ticker]
+
+    def stats(self) -> dict:
+        return {
+            "tickers": len(self.subscribers),
+            "subscribers": sum(len(listeners) for listeners in self.subscribers.values()),
+            "messages": self.messages,
+            "deliveries": self.deliveries,
+            "dropped": self.dropped,
+        }
+
+
+broadcaster = BarBroadcaster()
+data_events.subscribe(broadcaster.on_event)
+
+
+async def replay(db, ticker: str, since):
+    # bars after `since` as message texts, at most REPLAY_LIMIT of them; returns (messages, last date sent,
+    # whether everything was sent). The limit is part of the query, so an old `since` costs no more than a
+    # recent one; one extra row tells whether there is more
+    stmt = data_service.bar_query(ticker, since + timedelta(microseconds=1), None, COLUMNS).limit(REPLAY_LIMIT + 1)
+    rows = (await db.execute(stmt)).all()
+    complete = len(rows) <= REPLAY_LIMIT
+    bars = data_service.rows_to_arrays(rows[:REPLAY_LIMIT], COLUMNS)
+    messages = [
+        bars_message(ticker, [dict(zip(COLUMNS, row)) for row in rows])
+        for rows in bar_cache.chunk_rows(bars, COLUMNS, REPLAY_CHUNK)
+    ]
+    last = bars["date"][-1].item() if len(bars["date"]) else None
+    return messages, last, complete
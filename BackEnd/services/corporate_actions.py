@@ -0,0 +1,304 @@
+import asyncio
+import os
+import sys
+from collections import Counter
+from datetime import timedelta
+import numpy as np
+from sqlalchemy import bindparam, delete, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from database.models import CorporateAction, DataQualityIssue, MarketData
+from services import data_events, data_service, result_cache
+
+# Split and dividend adjusted OHLCV. Each action gets a price factor when it is first applied (1/ratio for
+# a split, 1 - amount/previous close for a cash dividend) and every bar is scaled by the product of the
+# factors of the actions after it. That product only changes at ex-dates, so a ticker's history is
+# rewritten with one set-based UPDATE per segment between ex-dates, and a new action only rewrites the bars
+# before its ex-date. The same pass checks those bars for gaps, repeated bars, outliers and invalid bars.
+#
+# Backtests, sweeps and portfolios read raw bars (shared with the bar cache) and scale them in memory with
+# the same factors; written bars get their adjusted columns at insert time (fill_adjusted).
+
+KINDS = ("split", "dividend")
+PRICE_COLUMNS = ("open", "high", "low", "close")
+ADJUSTED = {"open": "adj_open", "high": "adj_high", "low": "adj_low", "close": "adj_close", "volume": "adj_volume"}
+QUALITY_COLUMNS = ("date", "open", "high", "low", "close", "volume")
+# a gap is a step this many times the ticker's median bar spacing; intraday data only within a day
+GAP_MULTIPLE = float(os.getenv("DATA_QUALITY_GAP_MULTIPLE", "5"))
+# robust z-score (median/MAD) of an adjusted log return beyond which a bar is an outlier
+OUTLIER_Z = float(os.getenv("DATA_QUALITY_OUTLIER_Z", "12"))
+MAX_ISSUES = 10_000  # per pass
+MIN_DATE = data_events.MIN_DATE
+MAX_DATE = data_events.MAX_DATE
+
+
+def normalize_action(record: dict) -> dict:
+    kind = record.get("kind")
+    if kind not in KINDS:
+        raise ValueError(f"kind must be one of {', '.join(KINDS)}")
+    row = {"ex_date": record["ex_date"], "kind": kind, "ratio": None, "amount": None}
+    if kind == "split":
+        if not record.get("ratio") or record["ratio"] <= 0:
+            raise ValueError("a split needs a positive ratio (new shares per old share)")
+        row["ratio"] = float(record["ratio"])
+    else:
+        if not record.get("amount") or record["amount"] <= 0:
+            raise ValueError("a dividend needs a positive amount")
+        row["amount"] = float(record["amount"])
+    return row
+
+
+async def store_actions(db: AsyncSession, ticker: str, records: list) -> int:
+    # inserts new actions; a changed action is reset so the next pass recomputes its factor
+    existing = {
+        (action.ex_date, action.kind): action
+        for action in (await db.scalars(select(CorporateAction).where(CorporateAction.ticker == ticker))).all()
+    }
+    changed = 0
+    for record in records:
+        action = existing.get((record["ex_date"], record["kind"]))
+        if action is None:
+            action = CorporateAction(ticker=ticker, **record)
+            db.add(action)
+            existing[(record["ex_date"], record["kind"])] = action
+        elif (action.ratio, action.amount) == (record["ratio"], record["amount"]):
+            continue
+        else:
+            action.ratio, action.amount, action.factor = record["ratio"], record["amount"], None
+        changed += 1
+    await db.commit()
+    return changed
+
+
+# --- factors --------------------------------------------------------------------------------------
+
+def cumulative_factors(price_factors: np.ndarray, volume_factors: np.ndarray):
+    # entry k scales the bars between ex-dates k-1 and k (the last entry, after every action, is 1)
+    price = np.append(np.cumprod(price_factors[::-1])[::-1], 1.0)
+    volume = np.append(np.cumprod(volume_factors[::-1])[::-1], 1.0)
+    return price, volume
+
+
+async def load_factors(db: AsyncSession, ticker: str):
+    # (ex-dates, cumulative price factors, cumulative volume factors) of the applied actions
+    rows = (await db.execute(
+        select(CorporateAction.ex_date, CorporateAction.kind, CorporateAction.ratio, CorporateAction.factor)
+        .where(CorporateAction.ticker == ticker, CorporateAction.factor.isnot(None))
+        .order_by(CorporateAction.ex_date)
+    )).all()
+    ex_dates = np.array([row.ex_date for row in rows], dtype="datetime64[us]")
+    price_factors = np.array([row.factor for row in rows], dtype=np.float64)
+    volume_factors = np.array([row.ratio if row.kind == "split" else 1.0 for row in rows], dtype=np.float64)
+    return (ex_dates,) + cumulative_factors(price_factors, volume_factors)
+
+
+def bar_factors(dates: np.ndarray, ex_dates: np.ndarray, price: np.ndarray, volume: np.ndarray):
+    # a bar on the ex-date already trades ex, so it takes the factors of the actions after it
+    index = np.searchsorted(ex_dates, dates.astype("datetime64[us]"), side="right")
+    return price[index], volume[index]
+
+
+async def adjust_bars(db: AsyncSession, ticker: str, bars: dict) -> dict:
+    # bars from bar_cache/data_service with prices and volume adjusted; unchanged without actions
+    ex_dates, price, volume = await load_factors(db, ticker)
+    if not len(ex_dates):
+        return bars
+    f, v = bar_factors(bars["date"], ex_dates, price, volume)
+    adjusted = dict(bars)
+    for name in PRICE_COLUMNS:
+        if name in bars:
+            adjusted[name] = bars[name] * f
+    if "adj_close" in bars and "close" in bars:
+        adjusted["adj_close"] = adjusted["close"]
+    if "volume" in bars:
+        adjusted["volume"] = bars["volume"] * v
+    return adjusted
+
+
+async def price_factor_table(db: AsyncSession, tickers: list) -> list:
+    # per ticker (ex-dates, cumulative price factors), or None without applied actions
+    table = []
+    for ticker in tickers:
+        ex_dates, price, _ = await load_factors(db, ticker)
+        table.append((ex_dates, price) if len(ex_dates) else None)
+    return table
+
+
+def scale_prices(table: list, codes: np.ndarray, dates: np.ndarray, values: np.ndarray) -> np.ndarray:
+    # long (ticker code, date, price) rows as used by portfolio panels
+    if not any(table):
+        return values
+    values = values.copy()
+    for code in np.unique(codes):
+        if table[code] is None:
+            continue
+        ex_dates, price = table[code]
+        rows = codes == code
+        values[rows] *= price[np.searchsorted(ex_dates, dates[rows], side="right")]
+    return values
+
+
+async def fill_adjusted(db: AsyncSession, rows: list):
+    # sets the adjusted columns of bar rows about to be written
+    by_ticker = {}
+    for row in rows:
+        by_ticker.setdefault(row["ticker"], []).append(row)
+    for ticker, ticker_rows in by_ticker.items():
+        ex_dates, price, volume = await load_factors(db, ticker)
+        dates = np.array([row["date"] for row in ticker_rows], dtype="datetime64[us]")
+        f, v = bar_factors(dates, ex_dates, price, volume)
+        for row, row_price, row_volume in zip(ticker_rows, f.tolist(), v.tolist()):
+            for name in PRICE_COLUMNS:
+                row[ADJUSTED[name]] = row[name] * row_price
+            row["adj_volume"] = row["volume"] * row_volume
+
+
+# --- data quality ---------------------------------------------------------------------------------
+
+def quality_issues(bars: dict, price_factors: np.ndarray) -> list:
+    # (date, kind, detail) for the bars in date order
+    dates = bars["date"]
+    n = len(dates)
+    if n == 0:
+        return []
+    o, h, l, c, vol = (bars[name] for name in ("open", "high", "low", "close", "volume"))
+    found = []
+
+    invalid = (np.minimum.reduce([o, h, l, c]) <= 0) | (h < np.maximum(o, c)) | (l > np.minimum(o, c)) | (vol < 0)
+    found += [(i, "invalid", "non-positive price or high/low outside open/close") for i in np.flatnonzero(invalid)]
+
+    if n > 1:
+        # (ticker, date) is unique, so a duplicate is the same bar printed again at the next timestamp
+        repeated = (o[1:] == o[:-1]) & (h[1:] == h[:-1]) & (l[1:] == l[:-1]) & (c[1:] == c[:-1]) & (vol[1:] == vol[:-1])
+        found += [(i + 1, "duplicate", "same OHLCV as the previous bar") for i in np.flatnonzero(repeated)]
+
+        steps = np.diff(dates).astype("timedelta64[s]").astype(np.float64)
+        spacing = float(np.median(steps))
+        if spacing > 0:
+            wide = steps > GAP_MULTIPLE * spacing
+            if spacing < 86400:
+                # intraday bars: overnight and weekend breaks are not gaps
+                days = dates.astype("datetime64[D]")
+                wide &= days[1:] == days[:-1]
+            found += [(i + 1, "gap", f"{timedelta(seconds=steps[i])} since the previous bar") for i in np.flatnonzero(wide)]
+
+        adjusted = c * price_factors
+        valid = adjusted > 0
+        if valid.all():
+            returns = np.diff(np.log(adjusted))
+            center = np.median(returns)
+            mad = np.median(np.abs(returns - center)) * 1.4826
+            if mad > 0:
+                z = np.abs(returns - center) / mad
+                found += [(i + 1, "outlier", f"adjusted return {returns[i]:+.4f} (z {z[i]:.0f})")
+                          for i in np.flatnonzero(z > OUTLIER_Z)]
+
+    found.sort(key=lambda issue: issue[0])
+    return [(dates[i].item(), kind, detail) for i, kind, detail in found[:MAX_ISSUES]]
+
+
+# --- pipeline -------------------------------------------------------------------------------------
+
+async def _apply_pending(db: AsyncSession, ticker: str) -> list:
+    pending = (await db.scalars(
+        select(CorporateAction).where(CorporateAction.ticker == ticker, CorporateAction.factor.is_(None))
+        .order_by(CorporateAction.ex_date)
+    )).all()
+    for action in pending:
+        if action.kind == "split":
+            action.factor = 1.0 / action.ratio
+            continue
+        previous = await db.scalar(
+            select(MarketData.close).where(MarketData.ticker == ticker, MarketData.date < action.ex_date)
+            .order_by(MarketData.date.desc()).limit(1)
+        )
+        if previous is None or action.amount >= previous:
+            raise ValueError(f"dividend of {action.amount} on {action.ex_date:%Y-%m-%d} needs an earlier close above it")
+        action.factor = 1.0 - action.amount / previous
+    await db.flush()
+    return pending
+
+
+def segment_params(ticker: str, ex_dates: np.ndarray, price: np.ndarray, volume: np.ndarray, until=None) -> list:
+    # one UPDATE per stretch of bars with the same factors, up to `until` (exclusive)
+    bounds = [MIN_DATE] + [d.item() for d in ex_dates] + [MAX_DATE]
+    params = []
+    for k in range(len(price)):
+        lo, hi = bounds[k], bounds[k + 1]
+        if until is not None:
+            if lo >= until:
+                break
+            hi = min(hi, until)
+        params.append({"b_ticker": ticker, "b_lo": lo, "b_hi": hi, "b_price": float(price[k]),
+                       "b_volume": float(volume[k])})
+    return params
+
+
+ADJUST_SEGMENT = (
+    update(MarketData.__table__)
+    .where(
+        MarketData.__table__.c.ticker == bindparam("b_ticker"),
+        MarketData.__table__.c.date >= bindparam("b_lo"),
+        MarketData.__table__.c.date < bindparam("b_hi"),
+    )
+    .values({
+        **{ADJUSTED[name]: MarketData.__table__.c[name] * bindparam("b_price") for name in PRICE_COLUMNS},
+        "adj_volume": MarketData.__table__.c.volume * bindparam("b_volume"),
+    })
+)
+
+
+async def process_ticker(db: AsyncSession, ticker: str, full: bool = False) -> dict:
+    # applies the ticker's new actions, rewriting the adjusted columns of the bars before the earliest
+    # one and checking those bars; full=True redoes the whole history
+    pending = await _apply_pending(db, ticker)
+    if not pending and not full:
+        return {"ticker": ticker, "applied": 0, "bars": 0, "issues": {}}
+    until = None if full else pending[0].ex_date
+
+    ex_dates, price, volume = await load_factors(db, ticker)
+    params = segment_params(ticker, ex_dates, price, volume, until)
+    await db.execute(ADJUST_SEGMENT, params)
+
+    bars = await data_service.fetch_bars(db, ticker, None, until, QUALITY_COLUMNS)
+    if until is not None:
+        keep = bars["date"] < np.datetime64(until, "us")
+        bars = {name: values[keep] for name, values in bars.items()}
+    f, _ = bar_factors(bars["date"], ex_dates, price, volume)
+    issues = quality_issues(bars, f)
+    stale = delete(DataQualityIssue).where(DataQualityIssue.ticker == ticker)
+    if until is not None:
+        stale = stale.where(DataQualityIssue.date < until)
+    await db.execute(stale)
+    if issues:
+        await db.execute(insert(DataQualityIssue), [
+            {"ticker": ticker, "date": date, "kind": kind, "detail": detail} for date, kind, detail in issues
+        ])
+
+    # cached backtests over the rewritten bars were computed with the old factors
+    await result_cache.invalidate(db, ticker, MIN_DATE, until or MAX_DATE)
+    await db.commit()
+    data_events.publish("write", ticker, MIN_DATE, until or MAX_DATE)
+    return {
+        "ticker": ticker,
+        "applied": len(pending),
+        "bars": len(bars["date"]),
+        "segments": len(params),
+        "issues": dict(Counter(kind for _, kind, _ in issues)),
+    }
+
+
+async def _main(argv):
+    # python -m services.corporate_actions [--full] [TICKER ...]; all tickers when none are given
+    from database.connection import AsyncSessionLocal, engine
+    full = "--full" in argv
+    tickers = [t.upper() for t in argv if not t.startswith("--")]
+    async with AsyncSessionLocal() as session:
+        if not tickers:
+            tickers = (await session.scalars(select(MarketData.ticker).distinct().order_by(MarketData.ticker))).all()
+        for ticker in tickers:
+            print(await process_ticker(session, ticker, full))
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main(sys.argv[1:]))
@@ -0,0 +1,66 @@
+from collections import Counter
+from datetime import datetime
+
+# In-process notifications about market data writes. Each ticker has a version number that is bumped
+# on every committed change, so caches can tell whether what they hold is still current. Versions are
+# per process; writes made by another worker process are only seen once bar_cache revalidates the ticker
+# and publishes them.
+
+# start/end of an event that may touch any bar of the ticker
+MIN_DATE = datetime(1900, 1, 1)
+MAX_DATE = datetime(9999, 12, 31)
+
+_listeners = []
+_versions = Counter()
+
+
+class DataEvent:
+    __slots__ = ("kind", "ticker", "start", "end", "version", "rows")
+
+    def __init__(self, kind: str, ticker: str, start, end, version: int, rows: list = None):
+        self.kind = kind  # "write" (insert or update) or "delete"
+        self.ticker = ticker
+        self.start = start
+        self.end = end
+        self.version = version
+        self.rows = rows  # the written bar rows when the publisher has them, else None
+
+
+def subscribe(listener):
+    # listener(event) is called synchronously on the event loop and must not block
+    _listeners.append(listener)
+
+
+def unsubscribe(listener):
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+def version(ticker: str) -> int:
+    return _versions[ticker]
+
+
+def publish(kind: str, ticker: str, start, end, rows: list = None):
+    _versions[ticker] += 1
+    event = DataEvent(kind, ticker, start, end, _versions[ticker], rows)
+    for listener in list(_listeners):
+        listener(event)
+    return event
+
+
+def ticker_ranges(rows: list) -> dict:
+    # ticker -> (first date, last date) over a batch of bar rows
+    ranges = {}
+    for row in rows:
+        low, high = ranges.get(row["ticker"], (row["date"], row["date"]))
+        ranges[row["ticker"]] = (min(low, row["date"]), max(high, row["date"]))
+    return ranges
+
+
+def publish_rows(rows: list, kind: str = "write"):
+    # one event per ticker covering the date range of the rows
+    by_ticker = {}
+    for row in rows:
+        by_ticker.setdefault(row["ticker"], []).append(row)
+    for ticker, (low, high) in ticker_ranges(rows).items():
+        publish(kind, ticker, low, high, by_ticker[ticker])
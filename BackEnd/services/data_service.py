@@ -1,3 +1,6 @@
+import json
+from datetime import datetime
+import numpy as np
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy import select
@@ -31,4 +34,143 @@ async def get_data_in_date_range(ticker: str, start_date: str, end_date: str, db
     if data:
         return data
     else:
-        raise HTTPException(status_code=404, detail="No market data found in the specified date range")
\ No newline at end of file
+        raise HTTPException(status_code=404, detail="No market data found in the specified date range")
+
+BAR_COLUMNS = ("date", "open", "high", "low", "close", "volume", "adj_close")
+COLUMN_DTYPES = {
+    "date": "datetime64[us]",
+    "open": "float64",
+    "high": "float64",
+    "low": "float64",
+    "close": "float64",
+    "volume": "int64",
+    "adj_close": "float64",
+}
+FETCH_CHUNK_ROWS = 50000
+
+
+def parse_columns(columns: str = None):
+    if not columns:
+        return BAR_COLUMNS
+    names = tuple(c.strip() for c in columns.split(",") if c.strip())
+    unknown = [c for c in names if c not in COLUMN_DTYPES]
+    if unknown:
+        raise ValueError(f"unknown columns: {', '.join(unknown)}")
+    return names
+
+
+def bar_query(ticker: str, start=None, end=None, columns=BAR_COLUMNS):
+    stmt = select(*[getattr(MarketData, c) for c in columns]).where(MarketData.ticker == ticker)
+    if start is not None:
+        stmt = stmt.where(MarketData.date >= start)
+    if end is not None:
+        stmt = stmt.where(MarketData.date <= end)
+    return stmt.order_by(MarketData.date)
+
+
+def rows_to_arrays(rows, columns=BAR_COLUMNS):
+    # one typed array per column, built straight from the row tuples
+    count = len(rows)
+    return {
+        name: np.fromiter((row[i] for row in rows), dtype=COLUMN_DTYPES[name], count=count)
+        for i, name in enumerate(columns)
+    }
+
+
+async def stream_bar_rows(db: AsyncSession, ticker: str, start=None, end=None, columns=BAR_COLUMNS,
+                          chunk_rows: int = FETCH_CHUNK_ROWS):
+    stmt = bar_query(ticker, start, end, columns).execution_options(yield_per=chunk_rows)
+    result = await db.stream(stmt)
+    async for rows in result.partitions(chunk_rows):
+        yield rows
+
+
+async def stream_bar_batches(db: AsyncSession, ticker: str, start=None, end=None, columns=BAR_COLUMNS,
+                             chunk_rows: int = FETCH_CHUNK_ROWS):
+    async for rows in stream_bar_rows(db, ticker, start, end, columns, chunk_rows):
+        yield rows_to_arrays(rows, columns)
+
+
+async def fetch_bars(db: AsyncSession, ticker: str, start=None, end=None, columns=BAR_COLUMNS):
+    result = await db.execute(bar_query(ticker, start, end, columns))
+    return rows_to_arrays(result.all(), columns)
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+async def encode_json(row_chunks, columns):
+    # a JSON array of records, written one chunk at a time
+    yield b"["
+    first = True
+    async for rows in row_chunks:
+        if not rows:
+            continue
+        body = json.dumps([dict(zip(columns, row)) for row in rows], default=_json_default)[1:-1]
+        yield (body if first else "," + body).encode("utf-8")
+        first = False
+    yield b"]"
+
+
+class _ChunkSink:
+    # file-like target for pyarrow writers; bytes are drained after every batch
+    def __init__(self):
+        self.buffer = bytearray()
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.buffer += data
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+def _arrow_schema(columns):
+    import pyarrow as pa
+    types = {"date": pa.timestamp("us"), "volume": pa.int64()}
+    return pa.schema([(name, types.get(name, pa.float64())) for name in columns])
+
+
+def _record_batch(arrays, schema):
+    import pyarrow as pa
+    return pa.record_batch([pa.array(arrays[name]) for name in schema.names], schema=schema)
+
+
+async def encode_arrow(batches, columns):
+    import pyarrow as pa
+    schema = _arrow_schema(columns)
+    sink = _ChunkSink()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        async for arrays in batches:
+            writer.write_batch(_record_batch(arrays, schema))
+            yield sink.drain()
+    yield sink.drain()
+
+
+async def encode_parquet(batches, columns):
+    import pyarrow.parquet as pq
+    schema = _arrow_schema(columns)
+    sink = _ChunkSink()
+    # each batch becomes its own row group so it can be flushed immediately
+    with pq.ParquetWriter(sink, schema) as writer:
+        async for arrays in batches:
+            writer.write_batch(_record_batch(arrays, schema))
+            yield sink.drain()
+    yield sink.drain()
@@ -0,0 +1,552 @@
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from datetime import timedelta
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession
+from services import bar_cache, data_events
+
+CACHE_BYTES = int(os.getenv("INDICATOR_CACHE_MB", "256")) * 1024 * 1024
+# ema-style recursions are evaluated in closed form over blocks short enough that decay ** -block stays finite
+MAX_BLOCK_GROWTH = 230.0  # ln(1e100)
+
+
+# --- vectorized indicators ------------------------------------------------------------------------
+# ema is seeded with the first value (no warm-up gap); rsi and atr use Wilder's smoothing seeded with
+# the simple mean of their first `window` inputs, and are NaN until then.
+
+def sma(values: np.ndarray, window: int) -> np.ndarray:
+    out = np.full(len(values), np.nan)
+    if window <= 0 or window > len(values):
+        return out
+    csum = np.cumsum(np.insert(values, 0, 0.0))
+    out[window - 1:] = (csum[window:] - csum[:-window]) / window
+    return out
+
+
+def rolling_std(values: np.ndarray, window: int) -> np.ndarray:
+    # shifting by the first value leaves the std unchanged but keeps the running sums small
+    if len(values):
+        values = values - values[0]
+    mean = sma(values, window)
+    mean_sq = sma(values * values, window)
+    return np.sqrt(np.maximum(mean_sq - mean * mean, 0.0))
+
+
+def ema_recursive(values: np.ndarray, alpha: float, initial: float) -> np.ndarray:
+    # y[t] = y[t-1] + alpha * (x[t] - y[t-1]) starting from y[-1] = initial
+    n = len(values)
+    out = np.empty(n)
+    decay = 1.0 - alpha
+    if decay <= 0.0 or n == 0:
+        out[:] = values
+        return out
+    block = int(min(n, max(1.0, MAX_BLOCK_GROWTH / -math.log(decay))))
+    weights = decay ** np.arange(1, block + 1)
+    previous = initial
+    for start in range(0, n, block):
+        chunk = values[start:start + block]
+        w = weights[:len(chunk)]
+        out[start:start + len(chunk)] = w * (previous + alpha * np.cumsum(chunk / w))
+        previous = out[start + len(chunk) - 1]
+    return out
+
+
+def ema(values: np.ndarray, span: int) -> np.ndarray:
+    if not len(values):
+        return np.empty(0)
+    return ema_recursive(values, 2.0 / (span + 1.0), values[0])
+
+
+def _wilder(values: np.ndarray, window: int) -> np.ndarray:
+    # Wilder's moving average, aligned so out[i] belongs to values[i]; NaN before the seed
+    out = np.full(len(values), np.nan)
+    if window <= 0 or len(values) < window:
+        return out
+    seed = float(np.mean(values[:window]))
+    out[window - 1] = seed
+    out[window:] = ema_recursive(values[window:], 1.0 / window, seed)
+    return out
+
+
+def _rsi_from_averages(gain, loss):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(loss == 0.0, 100.0, 100.0 - 100.0 / (1.0 + gain / loss))
+
+
+def rsi_parts(close: np.ndarray, window: int = 14):
+    # rsi plus the smoothed gain/loss it was built from, aligned with close
+    n = len(close)
+    gain = np.full(n, np.nan)
+    loss = np.full(n, np.nan)
+    if n > 1:
+        change = np.diff(close)
+        gain[1:] = _wilder(np.maximum(change, 0.0), window)
+        loss[1:] = _wilder(np.maximum(-change, 0.0), window)
+    values = _rsi_from_averages(gain, loss)
+    values[np.isnan(gain)] = np.nan
+    return values, gain, loss
+
+
+def rsi(close: np.ndarray, window: int = 14) -> np.ndarray:
+    return rsi_parts(close, window)[0]
+
+
+def macd(close: np.ndarray, fast: int = 12, slow: int = 26, signal: int = 9) -> dict:
+    fast_ema = ema(close, fast)
+    slow_ema = ema(close, slow)
+    line = fast_ema - slow_ema
+    signal_line = ema(line, signal)
+    return {"macd": line, "signal": signal_line, "histogram": line - signal_line,
+            "fast_ema": fast_ema, "slow_ema": slow_ema}
+
+
+def bollinger(close: np.ndarray, window: int = 20, k: float = 2.0) -> dict:
+    middle = sma(close, window)
+    width = k * rolling_std(close, window)
+    return {"middle": middle, "upper": middle + width, "lower": middle - width}
+
+
+def true_range(high: np.ndarray, low: np.ndarray, close: np.ndarray) -> np.ndarray:
+    tr = high - low
+    if len(tr) > 1:
+        previous = close[:-1]
+        tr[1:] = np.maximum(tr[1:], np.maximum(np.abs(high[1:] - previous), np.abs(low[1:] - previous)))
+    return tr
+
+
+def atr(high: np.ndarray, low: np.ndarray, close: np.ndarray, window: int = 14) -> np.ndarray:
+    return _wilder(true_range(high, low, close), window)
+
+
+# --- incremental state ----------------------------------------------------------------------------
+# Each state continues a series from where the vectorized computation stopped, one bar at a time.
+
+class RollingWindow:
+    # running sum and sum of squares over the last `size` values; re-summed once per window to stop drift
+    def __init__(self, size: int, tail=()):
+        self.size = size
+        self.values = deque(map(float, tail[-size:]), maxlen=size)
+        self.total = math.fsum(self.values)
+        self.total_sq = math.fsum(v * v for v in self.values)
+        self.since_resum = 0
+
+    def push(self, value: float):
+        if len(self.values) == self.size:
+            old = self.values[0]
+            self.total -= old
+            self.total_sq -= old * old
+        self.values.append(value)
+        self.total += value
+        self.total_sq += value * value
+        self.since_resum += 1
+        if self.since_resum >= self.size:
+            self.total = math.fsum(self.values)
+            self.total_sq = math.fsum(v * v for v in self.values)
+            self.since_resum = 0
+
+    @property
+    def full(self) -> bool:
+        return self.size > 0 and len(self.values) == self.size
+
+    def mean(self) -> float:
+        return self.total / self.size if self.full else math.nan
+
+    def std(self) -> float:
+        if not self.full:
+            return math.nan
+        mean = self.total / self.size
+        return math.sqrt(max(self.total_sq / self.size - mean * mean, 0.0))
+
+
+class EMAState:
+    def __init__(self, span: int = None, last: float = None, alpha: float = None):
+        self.alpha = alpha if alpha is not None else 2.0 / (span + 1.0)
+        self.last = last
+
+    def push(self, value: float) -> float:
+        self.last = value if self.last is None else self.last + self.alpha * (value - self.last)
+        return self.last
+
+
+class WilderState:
+    # seeded with the mean of the first `window` inputs, then smoothed with alpha = 1 / window
+    def __init__(self, window: int, history: np.ndarray = None, smoothed: float = math.nan):
+        self.window = window
+        self.count = 0 if history is None else len(history)
+        self.seed_total = 0.0
+        self.value = math.nan
+        if self.count >= window:
+            self.value = float(smoothed)
+        elif self.count:
+            self.seed_total = math.fsum(history)
+
+    def push(self, value: float) -> float:
+        self.count += 1
+        if self.count < self.window:
+            self.seed_total += value
+            return math.nan
+        if self.count == self.window:
+            self.value = (self.seed_total + value) / self.window
+        else:
+            self.value += (value - self.value) / self.window
+        return self.value
+
+
+class SMAState:
+    outputs = ("sma",)
+
+    def __init__(self, bars: dict, outputs: dict, params: dict):
+        self.window = RollingWindow(int(params["window"]), bars["close"])
+
+    def update(self, bar: dict) -> tuple:
+        self.window.push(bar["close"])
+        return (self.window.mean(),)
+
+
+class EMAIndicatorState:
+    outputs = ("ema",)
+
+    def __init__(self, bars: dict, outputs: dict, params: dict):
+        values = outputs["ema"]
+        self.ema = EMAState(int(params["span"]), float(values[-1]) if len(values) else None)
+
+    def update(self, bar: dict) -> tuple:
+        return (self.ema.push(bar["close"]),)
+
+
+class RSIState:
+    outputs = ("rsi",)
+
+    def __init__(self, bars: dict, outputs: dict, params: dict):
+        window = int(params["window"])
+        close = bars["close"]
+        change = np.diff(close)
+        self.previous = float(close[-1]) if len(close) else None
+        self.gain = WilderState(window, np.maximum(change, 0.0), outputs["_gain"][-1] if len(close) else math.nan)
+        self.loss = WilderState(window, np.maximum(-change, 0.0), outputs["_loss"][-1] if len(close) else math.nan)
+
+    def update(self, bar: dict) -> tuple:
+        close = bar["close"]
+        previous, self.previous = self.previous, close
+        if previous is None:
+            return (math.nan,)
+        change = close - previous
+        gain = self.gain.push(max(change, 0.0))
+        loss = self.loss.push(max(-change, 0.0))
+        if math.isnan(gain):
+            return (math.nan,)
+        return (100.0 if loss == 0.0 else 100.0 - 100.0 / (1.0 + gain / loss),)
+
+
+class MACDState:
+    outputs = ("macd", "signal", "histogram")
+
+    def __init__(self, bars: dict, outputs: dict, params: dict):
+        def last(name):
+            return float(outputs[name][-1]) if len(outputs[name]) else None
+        self.fast = EMAState(int(params["fast"]), last("fast_ema"))
+        self.slow = EMAState(int(params["slow"]), last("slow_ema"))
+        self.signal = EMAState(int(params["signal"]), last("signal"))
+
+    def update(self, bar: dict) -> tuple:
+        line = self.fast.push(bar["close"]) - self.slow.push(bar["close"])
+        signal = self.signal.push(line)
+        return (line, signal, line - signal)
+
+
+class BollingerState:
+    outputs = ("middle", "upper", "lower")
+
+    def __init__(self, bars: dict, outputs: dict, params: dict):
+        self.window = RollingWindow(int(params["window"]), bars["close"])
+        self.k = float(params["k"])
+
+    def update(self, bar: dict) -> tuple:
+        self.window.push(bar["close"])
+        middle = self.window.mean()
+        width = self.k * self.window.std()
+        return (middle, middle + width, middle - width)
+
+
+class ATRState:
+    outputs = ("atr",)
+
+    def __init__(self, bars: dict, outputs: dict, params: dict):
+        close = bars["close"]
+        self.previous = float(close[-1]) if len(close) else None
+        tr = true_range(bars["high"], bars["low"], close)
+        self.atr = WilderState(int(params["window"]), tr, outputs["atr"][-1] if len(close) else math.nan)
+
+    def update(self, bar: dict) -> tuple:
+        tr = bar["high"] - bar["low"]
+        if self.previous is not None:
+            tr = max(tr, abs(bar["high"] - self.previous), abs(bar["low"] - self.previous))
+        self.previous = bar["close"]
+        return (self.atr.push(tr),)
+
+
+def _rsi_outputs(bars, params):
+    values, gain, loss = rsi_parts(bars["close"], int(params["window"]))
+    return {"rsi": values, "_gain": gain, "_loss": loss}
+
+
+class IndicatorSpec:
+    def __init__(self, name: str, defaults: dict, inputs: tuple, compute, state):
+        self.name = name
+        self.defaults = defaults
+        self.inputs = inputs
+        self.compute = compute  # (bars, params) -> dict of arrays; names starting with _ are internal
+        self.state = state      # resumes the series after the computed history
+        self.outputs = state.outputs
+
+
+INDICATORS = {
+    "sma": IndicatorSpec("sma", {"window": 20}, ("date", "close"),
+                         lambda bars, p: {"sma": sma(bars["close"], int(p["window"]))}, SMAState),
+    "ema": IndicatorSpec("ema", {"span": 20}, ("date", "close"),
+                         lambda bars, p: {"ema": ema(bars["close"], int(p["span"]))}, EMAIndicatorState),
+    "rsi": IndicatorSpec("rsi", {"window": 14}, ("date", "close"), _rsi_outputs, RSIState),
+    "macd": IndicatorSpec("macd", {"fast": 12, "slow": 26, "signal": 9}, ("date", "close"),
+                          lambda bars, p: macd(bars["close"], int(p["fast"]), int(p["slow"]), int(p["signal"])),
+                          MACDState),
+    "bollinger": IndicatorSpec("bollinger", {"window": 20, "k": 2.0}, ("date", "close"),
+                               lambda bars, p: bollinger(bars["close"], int(p["window"]), float(p["k"])),
+                               BollingerState),
+    "atr": IndicatorSpec("atr", {"window": 14}, ("date", "high", "low", "close"),
+                         lambda bars, p: {"atr": atr(bars["high"], bars["low"], bars["close"], int(p["window"]))},
+                         ATRState),
+}
+
+
+def get_spec(name: str) -> IndicatorSpec:
+    spec = INDICATORS.get(name)
+    if spec is None:
+        raise ValueError(f"unknown indicator '{name}', expected one of {', '.join(INDICATORS)}")
+    return spec
+
+
+def parse_params(spec: IndicatorSpec, raw: dict = None) -> dict:
+    params = dict(spec.defaults)
+    for key, value in (raw or {}).items():
+        if key not in spec.defaults:
+            raise ValueError(f"unknown parameter '{key}' for {spec.name}")
+        kind = type(spec.defaults[key])
+        try:
+            params[key] = kind(float(value)) if kind is int else kind(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{key} must be a {kind.__name__}")
+        if kind is int and params[key] <= 0:
+            raise ValueError(f"{key} must be positive")
+    return params
+
+
+def compute(bars: dict, name: str, params: dict = None) -> dict:
+    # uncached, for arrays the caller already holds (e.g. backtests)
+    spec = get_spec(name)
+    outputs = spec.compute(bars, parse_params(spec, params))
+    return {key: outputs[key] for key in spec.outputs}
+
+
+# --- cache ----------------------------------------------------------------------------------------
+
+class SeriesBuffer:
+    # dates and outputs in arrays with spare capacity, so appending a bar is amortised O(1)
+    def __init__(self, dates: np.ndarray, outputs: dict, state, version: int):
+        self.length = len(dates)
+        capacity = max(16, self.length + self.length // 8)
+        self.dates = np.empty(capacity, dtype="datetime64[us]")
+        self.dates[:self.length] = dates
+        self.columns = {}
+        for name, values in outputs.items():
+            column = np.empty(capacity)
+            column[:self.length] = values
+            self.columns[name] = column
+        self.state = state
+        self.version = version
+        self.appendable = True
+        self.checked_at = time.monotonic()
+
+    @property
+    def last_date(self):
+        return self.dates[self.length - 1].item() if self.length else None
+
+    @property
+    def nbytes(self) -> int:
+        return self.dates.nbytes + sum(column.nbytes for column in self.columns.values())
+
+    def append(self, date, values: tuple):
+        if self.length == len(self.dates):
+            capacity = len(self.dates) * 2
+            self.dates = np.resize(self.dates, capacity)
+            self.columns = {name: np.resize(column, capacity) for name, column in self.columns.items()}
+        self.dates[self.length] = date
+        for column, value in zip(self.columns.values(), values):
+            column[self.length] = value
+        self.length += 1
+
+    def view(self, start=None, end=None):
+        dates = self.dates[:self.length]
+        lo = np.searchsorted(dates, np.datetime64(start, "us")) if start is not None else 0
+        hi = np.searchsorted(dates, np.datetime64(end, "us"), side="right") if end is not None else self.length
+        return dates[lo:hi], {name: column[lo:hi] for name, column in self.columns.items()}
+
+
+class IndicatorCache:
+    # LRU of computed series bounded by total array bytes, keyed by (ticker, indicator, params)
+    def __init__(self, max_bytes: int = CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.by_ticker = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.appended_bars = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.revalidations = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry: SeriesBuffer):
+        self.drop(key)
+        if entry.nbytes > self.max_bytes:
+            return
+        self.entries[key] = entry
+        self.by_ticker.setdefault(key[0], set()).add(key)
+        self.bytes += entry.nbytes
+        while self.bytes > self.max_bytes:
+            self.drop(next(iter(self.entries)))
+            self.evictions += 1
+
+    def resized(self, key, before: int):
+        # an append may have grown the buffers
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.bytes += entry.nbytes - before
+            while self.bytes > self.max_bytes and len(self.entries) > 1:
+                self.drop(next(iter(self.entries)))
+                self.evictions += 1
+
+    def drop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        self.bytes -= entry.nbytes
+        keys = self.by_ticker.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.by_ticker[key[0]]
+
+    def on_event(self, event):
+        # bars after everything cached can be appended incrementally; anything else invalidates
+        for key in list(self.by_ticker.get(event.ticker, ())):
+            entry = self.entries[key]
+            if event.kind == "write" and entry.appendable and entry.last_date is not None and event.start > entry.last_date:
+                continue
+            self.drop(key)
+            self.invalidations += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.by_ticker.clear()
+        self.bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None,
+            "appended_bars": self.appended_bars,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "revalidations": self.revalidations,
+        }
+
+
+indicator_cache = IndicatorCache()
+data_events.subscribe(indicator_cache.on_event)
+
+
+async def _extend(db: AsyncSession, ticker: str, spec: IndicatorSpec, entry: SeriesBuffer, version: int):
+    after = entry.last_date + timedelta(microseconds=1)
+    bars = await bar_cache.fetch_bars(db, ticker, after, None, spec.inputs)
+    # a concurrent request may have extended the entry while this one was fetching
+    last = np.datetime64(entry.last_date, "us")
+    columns = [name for name in spec.inputs if name != "date"]
+    appended = 0
+    for i, date in enumerate(bars["date"]):
+        if date <= last:
+            continue
+        entry.append(date, entry.state.update({name: float(bars[name][i]) for name in columns}))
+        appended += 1
+    entry.version = version
+    return appended
+
+
+async def _revalidate(db: AsyncSession, key, spec: IndicatorSpec, entry: SeriesBuffer, version: int):
+    # Versions only move with writes this process sees; other workers' writes are caught here on the bar
+    # cache's schedule. Unchanged bars keep the entry, new bars after it are appended and anything else
+    # drops it. Returns the entry still usable, if any.
+    indicator_cache.revalidations += 1
+    count, last = await bar_cache.watermark(db, key[0])
+    entry.checked_at = time.monotonic()
+    if count == entry.length and last == entry.last_date:
+        return entry
+    if last is not None and entry.last_date is not None and last > entry.last_date:
+        before = entry.nbytes
+        indicator_cache.appended_bars += await _extend(db, key[0], spec, entry, version)
+        indicator_cache.resized(key, before)
+        if entry.length == count:
+            return entry
+    indicator_cache.drop(key)
+    indicator_cache.invalidations += 1
+    return None
+
+
+async def get_indicator(db: AsyncSession, ticker: str, name: str, params: dict = None, start=None, end=None):
+    # returns (params, dates, outputs) for [start, end]; computed over the full history so seeds are stable
+    spec = get_spec(name)
+    params = parse_params(spec, params)
+    key = (ticker, name, tuple(sorted(params.items())))
+    version = data_events.version(ticker)
+    entry = indicator_cache.get(key)
+    revalidate = bar_cache.REVALIDATE_SECONDS
+    if entry is not None and revalidate and time.monotonic() - entry.checked_at > revalidate:
+        entry = await _revalidate(db, key, spec, entry, version)
+    if entry is not None and entry.version != version:
+        before = entry.nbytes
+        indicator_cache.appended_bars += await _extend(db, ticker, spec, entry, version)
+        indicator_cache.resized(key, before)
+    if entry is not None:
+        indicator_cache.hits += 1
+    else:
+        indicator_cache.misses += 1
+        bars = await bar_cache.fetch_bars(db, ticker, None, None, spec.inputs)
+        outputs = spec.compute(bars, params)
+        entry = SeriesBuffer(bars["date"], {key_: outputs[key_] for key_ in spec.outputs},
+                             spec.state(bars, outputs, params), version)
+        # a write that landed while computing may not be reflected; only cache a consistent result
+        if data_events.version(ticker) == version and entry.length:
+            indicator_cache.put(key, entry)
+    dates, outputs = entry.view(start, end)
+    return params, dates, outputs
+
+
+def to_records(dates: np.ndarray, outputs: dict) -> list:
+    names = list(outputs)
+    columns = [[None if v != v else v for v in outputs[n].tolist()] for n in names]
+    return [
+        {"date": date, **dict(zip(names, values))}
+        for date, *values in zip(np.datetime_as_string(dates, unit="s").tolist(), *columns)
+    ]
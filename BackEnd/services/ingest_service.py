@@ -0,0 +1,309 @@
+import csv
+import json
+import math
+import os
+import tempfile
+import time
+from datetime import datetime, timezone
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from database.models import MarketData
+from database.migrations import ensure_partitions
+from services import corporate_actions, data_events, resample_service, result_cache
+
+FORMATS = ("csv", "ndjson", "parquet")
+CONTENT_TYPES = {
+    "text/csv": "csv",
+    "application/csv": "csv",
+    "application/x-ndjson": "ndjson",
+    "application/ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+    "application/vnd.apache.parquet": "parquet",
+    "application/x-parquet": "parquet",
+}
+
+CHUNK_ROWS = int(os.getenv("INGEST_CHUNK_ROWS", "5000"))
+# parquet needs random access to its footer, so uploads are spooled to disk past this size
+PARQUET_SPOOL_BYTES = 16 * 1024 * 1024
+MAX_REJECT_SAMPLES = 20
+
+COLUMNS = ("ticker", "date", "open", "high", "low", "close", "volume", "adj_close")
+# what is written: the accepted columns plus the rest of the adjusted series, filled by corporate_actions
+WRITE_COLUMNS = COLUMNS + ("adj_open", "adj_high", "adj_low", "adj_volume")
+PRICE_COLUMNS = ("open", "high", "low", "close")
+ALIASES = {
+    "symbol": "ticker",
+    "timestamp": "date",
+    "datetime": "date",
+    "time": "date",
+    "adjclose": "adj_close",
+    "adj close": "adj_close",
+}
+
+
+class IngestStats:
+    def __init__(self):
+        self.rows_received = 0
+        self.rows_written = 0
+        self.rows_rejected = 0
+        self.chunks = 0
+        self.rejected_samples = []
+        self.started = time.perf_counter()
+
+    def reject(self, line: int, reason: str):
+        self.rows_rejected += 1
+        if len(self.rejected_samples) < MAX_REJECT_SAMPLES:
+            self.rejected_samples.append({"row": line, "error": reason})
+
+    def as_dict(self):
+        elapsed = time.perf_counter() - self.started
+        return {
+            "rows_received": self.rows_received,
+            "rows_written": self.rows_written,
+            "rows_rejected": self.rows_rejected,
+            "rows_skipped": self.rows_received - self.rows_rejected - self.rows_written,
+            "chunks": self.chunks,
+            "elapsed_seconds": round(elapsed, 3),
+            "rows_per_second": round(self.rows_received / elapsed, 1) if elapsed > 0 else None,
+            "rejected_samples": self.rejected_samples,
+        }
+
+
+def format_from_content_type(content_type: str):
+    if not content_type:
+        return None
+    return CONTENT_TYPES.get(content_type.split(";")[0].strip().lower())
+
+
+def _parse_date(value):
+    if isinstance(value, datetime):
+        dt = value
+    elif isinstance(value, (int, float)):
+        dt = datetime.fromtimestamp(value, tz=timezone.utc)
+    else:
+        dt = datetime.fromisoformat(str(value).strip())
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def _parse_float(value, name):
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(f"{name} is not a finite number")
+    return number
+
+
+def normalize_record(record: dict, ticker: str = None) -> dict:
+    row = {}
+    for key, value in record.items():
+        key = ALIASES.get(key.strip().lower(), key.strip().lower())
+        if key in COLUMNS and value not in (None, ""):
+            row[key] = value
+
+    row["ticker"] = str(row.get("ticker") or ticker or "").strip().upper()
+    if not row["ticker"]:
+        raise ValueError("missing ticker")
+    if "date" not in row:
+        raise ValueError("missing date")
+    row["date"] = _parse_date(row["date"])
+
+    for name in PRICE_COLUMNS + ("volume",):
+        if name not in row:
+            raise ValueError(f"missing {name}")
+        row[name] = _parse_float(row[name], name)
+    row["volume"] = int(round(row["volume"]))
+    row["adj_close"] = _parse_float(row["adj_close"], "adj_close") if "adj_close" in row else None
+
+    if min(row[name] for name in PRICE_COLUMNS) <= 0:
+        raise ValueError("prices must be positive")
+    if row["high"] < max(row["open"], row["close"], row["low"]) or row["low"] > min(row["open"], row["close"]):
+        raise ValueError("high/low do not bracket open/close")
+    if row["volume"] < 0:
+        raise ValueError("volume must be non-negative")
+    return row
+
+
+def _decode_line(line: bytes):
+    # an undecodable line is rejected like any other malformed record instead of failing the upload
+    try:
+        return line.decode("utf-8").rstrip("\r")
+    except UnicodeDecodeError as e:
+        return ValueError(f"invalid utf-8 at byte {e.start}: {e.reason}")
+
+
+async def _iter_lines(byte_stream):
+    # yields str lines, or a ValueError for a line that is not utf-8
+    pending = b""
+    async for chunk in byte_stream:
+        pending += chunk
+        lines = pending.split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            yield _decode_line(line)
+    if pending:
+        yield _decode_line(pending)
+
+
+async def iter_csv_records(byte_stream):
+    header = None
+    async for line in _iter_lines(byte_stream):
+        if isinstance(line, Exception):
+            yield line
+            continue
+        if not line.strip():
+            continue
+        values = next(csv.reader([line]))
+        if header is None:
+            header = values
+            continue
+        if len(values) != len(header):
+            yield ValueError(f"expected {len(header)} fields, got {len(values)}")
+            continue
+        yield dict(zip(header, values))
+
+
+async def iter_ndjson_records(byte_stream):
+    async for line in _iter_lines(byte_stream):
+        if isinstance(line, Exception):
+            yield line
+            continue
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield ValueError(f"invalid json: {e}")
+            continue
+        if not isinstance(record, dict):
+            yield ValueError("expected a json object per line")
+            continue
+        yield record
+
+
+async def iter_parquet_records(byte_stream):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("parquet ingest requires pyarrow")
+
+    with tempfile.SpooledTemporaryFile(max_size=PARQUET_SPOOL_BYTES) as spool:
+        async for chunk in byte_stream:
+            spool.write(chunk)
+        spool.seek(0)
+        parquet_file = pq.ParquetFile(spool)
+        for batch in parquet_file.iter_batches(batch_size=CHUNK_ROWS):
+            for record in batch.to_pylist():
+                yield record
+
+
+READERS = {
+    "csv": iter_csv_records,
+    "ndjson": iter_ndjson_records,
+    "parquet": iter_parquet_records,
+}
+
+
+async def _copy_chunk(db: AsyncSession, rows: list, on_conflict: str) -> int:
+    # COPY into a per-connection staging table, then one set-based upsert into market_data
+    conn = await db.connection()
+    raw = await conn.get_raw_connection()
+    driver = raw.driver_connection
+    columns = ", ".join(WRITE_COLUMNS)
+    await driver.execute(
+        f"CREATE TEMP TABLE IF NOT EXISTS market_data_staging AS "
+        f"SELECT {columns} FROM market_data WITH NO DATA"
+    )
+    await driver.execute("TRUNCATE market_data_staging")
+    await driver.copy_records_to_table(
+        "market_data_staging",
+        records=[tuple(row[c] for c in WRITE_COLUMNS) for row in rows],
+        columns=list(WRITE_COLUMNS),
+    )
+    if on_conflict == "skip":
+        conflict = "DO NOTHING"
+    else:
+        conflict = "DO UPDATE SET " + ", ".join(f"{c} = EXCLUDED.{c}" for c in WRITE_COLUMNS[2:])
+    status = await driver.execute(
+        f"INSERT INTO market_data ({columns}) SELECT {columns} FROM market_data_staging "
+        f"ON CONFLICT (ticker, date) {conflict}"
+    )
+    return int(status.split()[-1])
+
+
+_UPSERT_STATEMENTS = {}
+
+
+def _upsert_statement(dialect: str, on_conflict: str):
+    # built once per dialect and mode; run in executemany form, so the compiled statement is cached and
+    # reused instead of compiling a multi-row VALUES clause per batch. It targets the table, not the ORM class,
+    # so the session runs it as a plain executemany and reports a rowcount
+    key = (dialect, on_conflict)
+    stmt = _UPSERT_STATEMENTS.get(key)
+    if stmt is None:
+        if dialect == "postgresql":
+            insert = postgresql.insert
+        elif dialect == "sqlite":
+            insert = sqlite.insert
+        else:
+            raise RuntimeError(f"bulk ingest is not supported on {dialect}")
+        stmt = insert(MarketData.__table__)
+        if on_conflict == "skip":
+            stmt = stmt.on_conflict_do_nothing(index_elements=["ticker", "date"])
+        else:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["ticker", "date"],
+                set_={c: stmt.excluded[c] for c in WRITE_COLUMNS[2:]},
+            )
+        _UPSERT_STATEMENTS[key] = stmt
+    return stmt
+
+
+async def _upsert_chunk(db: AsyncSession, rows: list, on_conflict: str) -> int:
+    stmt = _upsert_statement(db.get_bind().dialect.name, on_conflict)
+    params = [{c: row[c] for c in WRITE_COLUMNS} for row in rows]
+    result = await db.execute(stmt, params)
+    # some drivers report no rowcount for executemany
+    return result.rowcount if result.rowcount >= 0 else len(rows)
+
+
+async def write_chunk(db: AsyncSession, rows: list, on_conflict: str = "update") -> int:
+    conn = await db.connection()
+    await ensure_partitions(conn, min(row["date"] for row in rows), max(row["date"] for row in rows))
+    await corporate_actions.fill_adjusted(db, rows)
+    bind = db.get_bind()
+    if bind.dialect.name == "postgresql" and bind.dialect.driver == "asyncpg":
+        written = await _copy_chunk(db, rows, on_conflict)
+    else:
+        written = await _upsert_chunk(db, rows, on_conflict)
+    await resample_service.refresh_rows(db, rows)
+    await result_cache.invalidate_rows(db, rows)
+    await db.commit()
+    data_events.publish_rows(rows)
+    return written
+
+
+async def ingest_stream(db: AsyncSession, byte_stream, fmt: str, on_conflict: str = "update",
+                        ticker: str = None) -> IngestStats:
+    stats = IngestStats()
+    # keyed by (ticker, date) so a chunk never upserts the same row twice; last one wins
+    pending = {}
+    async for record in READERS[fmt](byte_stream):
+        stats.rows_received += 1
+        if isinstance(record, Exception):
+            stats.reject(stats.rows_received, str(record))
+            continue
+        try:
+            row = normalize_record(record, ticker)
+        except (ValueError, TypeError, OverflowError) as e:
+            stats.reject(stats.rows_received, str(e))
+            continue
+        pending[(row["ticker"], row["date"])] = row
+        if len(pending) >= CHUNK_ROWS:
+            stats.rows_written += await write_chunk(db, list(pending.values()), on_conflict)
+            stats.chunks += 1
+            pending.clear()
+    if pending:
+        stats.rows_written += await write_chunk(db, list(pending.values()), on_conflict)
+        stats.chunks += 1
+    return stats
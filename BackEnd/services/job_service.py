@@ -0,0 +1,360 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+import uuid
+from collections import Counter, OrderedDict
+from datetime import datetime
+from sqlalchemy import select
+from database.connection import AsyncSessionLocal
+from database.models import Job
+from services import backtest_service, corporate_actions, portfolio_service, sweep_service
+from services.strategy_service import get_owned_strategy
+
+WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+PER_USER_LIMIT = int(os.getenv("JOB_USER_CONCURRENCY", "1"))
+PER_USER_QUEUE_LIMIT = int(os.getenv("JOB_USER_QUEUE_LIMIT", "100"))
+PROGRESS_PERSIST_SECONDS = 1.0
+PARTIAL_RESULTS_LIMIT = 1000
+FINISHED_CACHE_SIZE = 1000
+LISTENER_QUEUE_SIZE = 256
+TERMINAL = ("succeeded", "failed", "cancelled")
+# clients may only push their own jobs below the default; server-side submissions use the default
+USER_PRIORITY_MIN = -10
+USER_PRIORITY_MAX = 0
+
+logger = logging.getLogger(__name__)
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobLimitExceeded(Exception):
+    pass
+
+
+class JobState:
+    def __init__(self, id, user_id, kind, payload, priority=0, status="queued", progress=0.0,
+                 result=None, error=None, created_at=None, started_at=None, finished_at=None):
+        self.id = id
+        self.user_id = user_id
+        self.kind = kind
+        self.payload = payload or {}
+        self.priority = priority or 0
+        self.status = status
+        self.progress = progress or 0.0
+        self.result = result
+        self.error = error
+        self.created_at = created_at or datetime.utcnow()
+        self.started_at = started_at
+        self.finished_at = finished_at
+        self.partial = []
+        self.listeners = set()
+        self.cancel_requested = False
+        self.persisted_at = 0.0
+
+    @classmethod
+    def from_row(cls, row: Job):
+        return cls(row.id, row.user_id, row.kind, row.payload, row.priority, row.status, row.progress,
+                   row.result, row.error, row.created_at, row.started_at, row.finished_at)
+
+    def snapshot(self, include_partial: bool = False) -> dict:
+        data = {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "priority": self.priority,
+            "progress": round(self.progress, 4),
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if include_partial:
+            data["partial"] = self.partial
+        return data
+
+    def publish(self, event: dict):
+        terminal = event["event"] == "status" and event["status"] in TERMINAL
+        for listener in list(self.listeners):
+            try:
+                listener.put_nowait(event)
+            except asyncio.QueueFull:
+                # a listener that cannot keep up only misses intermediate progress events; the final status
+                # replaces whatever it has not read yet so its stream still ends
+                if terminal:
+                    while not listener.empty():
+                        listener.get_nowait()
+                    listener.put_nowait(event)
+
+
+class JobContext:
+    # handed to handlers so they can report progress and notice cancellation
+    def __init__(self, queue, state: JobState):
+        self.queue = queue
+        self.state = state
+        self.payload = state.payload
+        self.user_id = state.user_id
+
+    async def progress(self, fraction: float, partial: dict = None):
+        state = self.state
+        if state.cancel_requested:
+            raise JobCancelled()
+        state.progress = min(max(fraction, 0.0), 1.0)
+        if partial is not None and len(state.partial) < PARTIAL_RESULTS_LIMIT:
+            state.partial.append(partial)
+        state.publish({"event": "progress", "progress": state.progress, "partial": partial})
+        if time.monotonic() - state.persisted_at >= PROGRESS_PERSIST_SECONDS:
+            await self.queue._save(state)
+
+
+class JobQueue:
+    def __init__(self, handlers: dict = None, session_factory=AsyncSessionLocal, workers: int = WORKERS,
+                 per_user_limit: int = PER_USER_LIMIT, per_user_queue_limit: int = PER_USER_QUEUE_LIMIT):
+        self.handlers = dict(handlers or {})
+        self.session_factory = session_factory
+        self.worker_count = workers
+        self.per_user_limit = per_user_limit
+        self.per_user_queue_limit = per_user_queue_limit
+        self.active = {}
+        self.finished = OrderedDict()
+        self._heap = []
+        self._sequence = itertools.count()
+        self._running = Counter()
+        self._queued = Counter()
+        self._condition = asyncio.Condition()
+        self._workers = []
+
+    def register(self, kind: str, handler):
+        self.handlers[kind] = handler
+
+    async def start(self):
+        # jobs that were queued or interrupted mid-run go back on the queue
+        async with self.session_factory() as session:
+            result = await session.execute(
+                select(Job).where(Job.status.in_(("queued", "running"))).order_by(Job.created_at)
+            )
+            for row in result.scalars().all():
+                state = JobState.from_row(row)
+                state.status = "queued"
+                state.progress = 0.0
+                self._enqueue(state)
+                row.status = "queued"
+            await session.commit()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.worker_count)]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def submit(self, user_id: int, kind: str, payload: dict, priority: int = 0) -> JobState:
+        if kind not in self.handlers:
+            raise ValueError(f"unknown job kind '{kind}', expected one of {', '.join(self.handlers)}")
+        if self._queued[user_id] >= self.per_user_queue_limit:
+            raise JobLimitExceeded(f"at most {self.per_user_queue_limit} queued jobs per user")
+        state = JobState(uuid.uuid4().hex, user_id, kind, payload, priority)
+        async with self.session_factory() as session:
+            session.add(Job(id=state.id, user_id=user_id, kind=kind, payload=payload, priority=state.priority,
+                            status="queued", progress=0.0, created_at=state.created_at))
+            await session.commit()
+        state.persisted_at = time.monotonic()
+        self._enqueue(state)
+        async with self._condition:
+            self._condition.notify()
+        return state
+
+    async def get(self, job_id: str) -> JobState:
+        state = self.active.get(job_id) or self.finished.get(job_id)
+        if state is not None:
+            return state
+        async with self.session_factory() as session:
+            row = await session.get(Job, job_id)
+            return JobState.from_row(row) if row is not None else None
+
+    def state_of(self, row: Job) -> JobState:
+        # the live state when this process holds it, else the stored row
+        return self.active.get(row.id) or self.finished.get(row.id) or JobState.from_row(row)
+
+    async def cancel(self, state: JobState):
+        if state.status in TERMINAL:
+            return
+        state.cancel_requested = True
+        if state.status == "queued":
+            # dropped lazily when it reaches the top of the heap
+            self._queued[state.user_id] -= 1
+            await self._finish(state, "cancelled")
+
+    def subscribe(self, state: JobState) -> asyncio.Queue:
+        listener = asyncio.Queue(maxsize=LISTENER_QUEUE_SIZE)
+        state.listeners.add(listener)
+        return listener
+
+    def unsubscribe(self, state: JobState, listener: asyncio.Queue):
+        state.listeners.discard(listener)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.worker_count,
+            "queued": sum(self._queued.values()),
+            "running": sum(self._running.values()),
+        }
+
+    async def persist(self, state: JobState):
+        async with self.session_factory() as session:
+            row = await session.get(Job, state.id)
+            if row is not None:
+                row.status = state.status
+                row.progress = state.progress
+                row.result = state.result
+                row.error = state.error
+                row.started_at = state.started_at
+                row.finished_at = state.finished_at
+                await session.commit()
+        state.persisted_at = time.monotonic()
+
+    async def _save(self, state: JobState):
+        # status changes go on even when the database does not take them; the row catches up on the next save
+        try:
+            await self.persist(state)
+        except Exception:
+            logger.exception("could not persist job %s", state.id)
+
+    def _enqueue(self, state: JobState):
+        self.active[state.id] = state
+        self._queued[state.user_id] += 1
+        heapq.heappush(self._heap, (-state.priority, next(self._sequence), state))
+
+    def _pick(self):
+        # highest priority job whose owner is under the concurrency limit; others keep their place
+        deferred = []
+        chosen = None
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            state = entry[2]
+            if state.status != "queued":
+                continue
+            if self._running[state.user_id] < self.per_user_limit:
+                chosen = state
+                break
+            deferred.append(entry)
+        for entry in deferred:
+            heapq.heappush(self._heap, entry)
+        return chosen
+
+    async def _worker(self):
+        while True:
+            async with self._condition:
+                state = self._pick()
+                while state is None:
+                    await self._condition.wait()
+                    state = self._pick()
+                self._queued[state.user_id] -= 1
+                self._running[state.user_id] += 1
+            try:
+                await self._execute(state)
+            except Exception:
+                # _execute already records handler errors; anything else must not take the worker down
+                logger.exception("job %s failed outside its handler", state.id)
+            finally:
+                async with self._condition:
+                    self._running[state.user_id] -= 1
+                    self._condition.notify_all()
+
+    async def _execute(self, state: JobState):
+        state.status = "running"
+        state.started_at = datetime.utcnow()
+        await self._save(state)
+        state.publish({"event": "status", "status": state.status})
+        try:
+            result = await self.handlers[state.kind](JobContext(self, state))
+        except JobCancelled:
+            await self._finish(state, "cancelled")
+        except asyncio.CancelledError:
+            # shutting down: leave the job persisted as running so start() requeues it
+            raise
+        except Exception as e:
+            state.error = str(e) or type(e).__name__
+            await self._finish(state, "failed")
+        else:
+            state.result = result
+            state.progress = 1.0
+            await self._finish(state, "succeeded")
+
+    async def _finish(self, state: JobState, status: str):
+        state.status = status
+        state.finished_at = datetime.utcnow()
+        await self._save(state)
+        state.publish({"event": "status", "status": status})
+        self.active.pop(state.id, None)
+        self.finished[state.id] = state
+        if len(self.finished) > FINISHED_CACHE_SIZE:
+            self.finished.popitem(last=False)
+
+
+def _parse_date(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+async def run_backtest_job(ctx: JobContext):
+    payload = ctx.payload
+    async with ctx.queue.session_factory() as session:
+        strategy = await get_owned_strategy(payload["strategy_id"], session, ctx.user_id)
+        await ctx.progress(0.1)
+        result = await backtest_service.run_strategy_backtest(
+            session, strategy, payload["ticker"].upper(), _parse_date(payload.get("start_date")),
+            _parse_date(payload.get("end_date")), payload.get("parameters"),
+        )
+        return {"backtest_id": result.id, "metrics": result.results["metrics"]}
+
+
+async def run_portfolio_job(ctx: JobContext):
+    payload = ctx.payload
+    async with ctx.queue.session_factory() as session:
+        strategy = await get_owned_strategy(payload["strategy_id"], session, ctx.user_id)
+        await ctx.progress(0.1)
+        result = await portfolio_service.run_portfolio_backtest(
+            session, strategy, payload["tickers"], _parse_date(payload.get("start_date")),
+            _parse_date(payload.get("end_date")), payload.get("parameters"),
+        )
+        return {"backtest_id": result.id, "metrics": result.results["metrics"]}
+
+
+async def run_sweep_job(ctx: JobContext):
+    payload = ctx.payload
+    tickers = list(dict.fromkeys(t.upper() for t in payload["tickers"]))
+    total = len(tickers) * len(sweep_service.expand_grid(payload["grid"]))
+    done = 0
+    errors = 0
+    result_ids = []
+    async with ctx.queue.session_factory() as session:
+        strategy = await get_owned_strategy(payload["strategy_id"], session, ctx.user_id)
+        async for record in sweep_service.run_sweep(
+            session, strategy, tickers, payload["grid"], _parse_date(payload.get("start_date")),
+            _parse_date(payload.get("end_date")), payload.get("store_trades", False),
+        ):
+            if "error" in record:
+                errors += 1
+                # a ticker without data accounts for all of its combinations
+                done += 1 if "parameters" in record else total // len(tickers)
+            else:
+                done += 1
+                result_ids.append(record["id"])
+            await ctx.progress(done / total if total else 1.0, record)
+    return {"completed": len(result_ids), "errors": errors, "backtest_ids": result_ids}
+
+
+async def run_adjust_job(ctx: JobContext):
+    payload = ctx.payload
+    async with ctx.queue.session_factory() as session:
+        return await corporate_actions.process_ticker(session, payload["ticker"].upper(), payload.get("full", False))
+
+
+queue = JobQueue({
+    "backtest": run_backtest_job, "portfolio": run_portfolio_job, "sweep": run_sweep_job, "adjust": run_adjust_job,
+})
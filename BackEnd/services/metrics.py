@@ -0,0 +1,275 @@
+import asyncio
+import bisect
+import contextvars
+import os
+import time
+from collections import deque
+
+# Process-wide metrics in the Prometheus text format, served by routers/metrics.py. Requests are timed by
+# the middleware in app.py, which also hands each request a RequestStats through a context variable so the
+# SQLAlchemy cursor events can count the queries it runs and the time spent in them. Caches and pools are
+# read through the stats() functions registered with `register` when /metrics is scraped.
+#
+# Requests slower than SLOW_REQUEST_SECONDS are sampled: at most one every SLOW_SAMPLE_SECONDS has the
+# query plans of its slowest SELECTs captured with EXPLAIN, kept in the last SLOW_SAMPLES samples.
+
+SLOW_REQUEST_SECONDS = float(os.getenv("METRICS_SLOW_REQUEST_SECONDS", "1"))
+SLOW_SAMPLE_SECONDS = float(os.getenv("METRICS_SLOW_SAMPLE_SECONDS", "60"))
+SLOW_SAMPLES = 20
+EXPLAINED_STATEMENTS = 3
+# statements remembered per request for slow-request sampling
+CAPTURED_STATEMENTS = 50
+LOOP_LAG_INTERVAL = float(os.getenv("METRICS_LOOP_LAG_INTERVAL", "0.5"))
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500)
+PREFIX = "quanttrade"
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{str(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = f"{PREFIX}_{name}"
+        self.help = help
+        self.label_names = labels
+        self.series = {}
+
+    def inc(self, amount=1, *labels):
+        self.series[labels] = self.series.get(labels, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in self.series.items():
+            lines.append(f"{self.name}{_labels(self.label_names, labels)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = f"{PREFIX}_{name}"
+        self.help = help
+        self.label_names = labels
+        self.buckets = buckets
+        # label values -> per-bucket counts (not cumulative) followed by the overflow count, sum and count
+        self.series = {}
+
+    def observe(self, value, *labels):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.label_names + ("le",)
+        for labels, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(names, labels + (_number(bound),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {_number(series[-2])}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {series[-1]}")
+        return lines
+
+
+request_seconds = Histogram("http_request_duration_seconds", "Request latency by route", ("method", "route", "status"))
+request_queries = Histogram("http_request_db_queries", "SQL statements run per request", ("route",),
+                            QUERY_COUNT_BUCKETS)
+request_query_seconds = Histogram("http_request_db_seconds", "Time per request spent in SQL", ("route",))
+query_seconds = Histogram("db_query_duration_seconds", "Duration of single SQL statements")
+pool_wait_seconds = Histogram("db_pool_wait_seconds", "Time spent waiting for a pooled connection")
+loop_lag_seconds = Histogram("event_loop_lag_seconds", "How late the event loop ran a timer")
+slow_requests = Counter("http_slow_requests_total", "Requests slower than the slow-request threshold", ("route",))
+HISTOGRAMS = (request_seconds, request_queries, request_query_seconds, query_seconds, pool_wait_seconds,
+              loop_lag_seconds)
+
+
+class RequestStats:
+    __slots__ = ("queries", "query_seconds", "pool_wait", "statements")
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.pool_wait = 0.0
+        self.statements = []
+
+
+current_request = contextvars.ContextVar("metrics_request", default=None)
+
+
+# --- SQL -------------------------------------------------------------------------------------------
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["metrics_started"].pop()
+    query_seconds.observe(elapsed)
+    stats = current_request.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.query_seconds += elapsed
+        if not executemany and len(stats.statements) < CAPTURED_STATEMENTS:
+            stats.statements.append((elapsed, statement, parameters))
+
+
+def handle_error(context):
+    # a failed statement never reaches after_cursor_execute; drop its start time so the stack stays aligned
+    conn = context.connection
+    if conn is not None and context.statement is not None and conn.info.get("metrics_started"):
+        conn.info["metrics_started"].pop()
+
+
+def on_pool_wait(waited: float):
+    pool_wait_seconds.observe(waited)
+    stats = current_request.get()
+    if stats is not None:
+        stats.pool_wait += waited
+
+
+def instrument(engine, pool_metrics):
+    from sqlalchemy import event
+    event.listen(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine.sync_engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(engine.sync_engine, "handle_error", handle_error)
+    pool_metrics.wait_listeners.append(on_pool_wait)
+
+
+# --- requests --------------------------------------------------------------------------------------
+
+samples = deque(maxlen=SLOW_SAMPLES)
+_last_sample = 0.0
+_sampling = set()
+
+
+def record_request(method: str, route: str, status: int, elapsed: float, stats: RequestStats):
+    global _last_sample
+    request_seconds.observe(elapsed, method, route, status)
+    request_queries.observe(stats.queries, route)
+    request_query_seconds.observe(stats.query_seconds, route)
+    if elapsed < SLOW_REQUEST_SECONDS:
+        return
+    slow_requests.inc(1, route)
+    now = time.monotonic()
+    if now - _last_sample < SLOW_SAMPLE_SECONDS:
+        return
+    _last_sample = now
+    task = asyncio.get_running_loop().create_task(_sample(method, route, status, elapsed, stats))
+    _sampling.add(task)
+    task.add_done_callback(_sampling.discard)
+
+
+async def explain(statement: str, parameters) -> list:
+    from database.connection import engine
+    prefix = "EXPLAIN QUERY PLAN " if engine.dialect.name == "sqlite" else "EXPLAIN "
+    async with engine.connect() as conn:
+        rows = (await conn.exec_driver_sql(prefix + statement, parameters)).all()
+    return [" ".join(str(value) for value in row) for row in rows]
+
+
+async def _sample(method: str, route: str, status: int, elapsed: float, stats: RequestStats):
+    sample = {
+        "at": time.time(),
+        "method": method,
+        "route": route,
+        "status": status,
+        "seconds": elapsed,
+        "queries": stats.queries,
+        "query_seconds": stats.query_seconds,
+        "pool_wait_seconds": stats.pool_wait,
+        "statements": [],
+    }
+    selects = [s for s in stats.statements if s[1].lstrip()[:6].upper() == "SELECT"]
+    for seconds, statement, parameters in sorted(selects, key=lambda s: s[0], reverse=True)[:EXPLAINED_STATEMENTS]:
+        entry = {"seconds": seconds, "statement": statement}
+        try:
+            entry["plan"] = await explain(statement, parameters)
+        except Exception as e:
+            entry["plan_error"] = str(e)
+        sample["statements"].append(entry)
+    samples.append(sample)
+
+
+# --- event loop ------------------------------------------------------------------------------------
+
+class LoopLagMonitor:
+    # a timer that should fire every LOOP_LAG_INTERVAL; whatever it is late by, the loop was busy
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self.task = None
+        self.last = 0.0
+        self.max = 0.0
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - started - self.interval, 0.0)
+            loop_lag_seconds.observe(lag)
+            self.last = lag
+            self.max = max(self.max, lag)
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def stats(self) -> dict:
+        return {"last_seconds": self.last, "max_seconds": self.max}
+
+
+loop_monitor = LoopLagMonitor()
+
+
+# --- exposition ------------------------------------------------------------------------------------
+
+collectors = {}
+
+
+def register(name: str, stats):
+    # stats() returns a dict of numbers, possibly nested; each number becomes a gauge
+    collectors[name] = stats
+
+
+def _flatten(prefix: str, data: dict):
+    for key, value in data.items():
+        name = f"{prefix}_{key}"
+        if isinstance(value, dict):
+            yield from _flatten(name, value)
+        elif isinstance(value, (int, float)):
+            yield name, float(value) if isinstance(value, bool) else value
+
+
+def render() -> str:
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    lines.extend(slow_requests.render())
+    for collector, stats in collectors.items():
+        for name, value in _flatten(f"{PREFIX}_{collector}", stats()):
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {_number(value)}")
+    return "\n".join(lines) + "\n"
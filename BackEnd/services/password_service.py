@@ -0,0 +1,113 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import bcrypt
+from fastapi import HTTPException
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# bcrypt releases the GIL, so threads hash in parallel without blocking the event loop
+HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "0")) or min(4, os.cpu_count() or 1)
+# running + waiting hashes; beyond this requests are turned away instead of piling up. Unset, it is derived
+# from the workers and how long a request may wait: workers * (1 + wait budget / time per hash)
+HASH_QUEUE_LIMIT = int(os.getenv("PASSWORD_HASH_QUEUE_LIMIT", "0"))
+HASH_WAIT_BUDGET_SECONDS = float(os.getenv("PASSWORD_HASH_WAIT_SECONDS", "0.5"))
+# time per hash before any has been measured; about 0.25 s at 12 rounds, doubling with each round
+ESTIMATED_HASH_SECONDS = 0.25 * 2 ** (BCRYPT_ROUNDS - 12)
+RETRY_AFTER_SECONDS = "1"
+
+
+class OperationTimings:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.wait_total = 0.0
+
+    def record(self, waited: float, elapsed: float):
+        self.count += 1
+        self.total += elapsed
+        self.wait_total += waited
+        self.max = max(self.max, elapsed)
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "avg_ms": self.total / self.count * 1000 if self.count else None,
+            "avg_wait_ms": self.wait_total / self.count * 1000 if self.count else None,
+            "max_ms": self.max * 1000,
+        }
+
+
+_executor = None
+_in_flight = 0
+_rejected = 0
+_timings = {"hash": OperationTimings(), "verify": OperationTimings()}
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="bcrypt")
+    return _executor
+
+
+def queue_limit() -> int:
+    if HASH_QUEUE_LIMIT:
+        return HASH_QUEUE_LIMIT
+    timings = [t for t in _timings.values() if t.count]
+    seconds = sum(t.total for t in timings) / sum(t.count for t in timings) if timings else ESTIMATED_HASH_SECONDS
+    return HASH_WORKERS + int(HASH_WORKERS * HASH_WAIT_BUDGET_SECONDS / max(seconds, 1e-3))
+
+
+def _timed(fn, queued_at, *args):
+    started = time.perf_counter()
+    return fn(*args), started - queued_at, time.perf_counter() - started
+
+
+async def _run(operation: str, fn, *args):
+    global _in_flight, _rejected
+    if _in_flight >= queue_limit():
+        _rejected += 1
+        raise HTTPException(status_code=503, detail="Authentication is busy, please retry",
+                            headers={"Retry-After": RETRY_AFTER_SECONDS})
+    _in_flight += 1
+    try:
+        loop = asyncio.get_running_loop()
+        result, waited, elapsed = await loop.run_in_executor(_get_executor(), _timed, fn, time.perf_counter(), *args)
+    finally:
+        _in_flight -= 1
+    _timings[operation].record(waited, elapsed)
+    return result
+
+
+def _hash(password: bytes) -> bytes:
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds=BCRYPT_ROUNDS))
+
+
+async def hash_password(password: str) -> str:
+    hashed = await _run("hash", _hash, password.encode("utf-8"))
+    return hashed.decode("utf-8")
+
+
+async def verify_password(password: str, password_hash: str) -> bool:
+    return await _run("verify", bcrypt.checkpw, password.encode("utf-8"), password_hash.encode("utf-8"))
+
+
+def stats() -> dict:
+    return {
+        "workers": HASH_WORKERS,
+        "rounds": BCRYPT_ROUNDS,
+        "in_flight": _in_flight,
+        "queue_limit": queue_limit(),
+        "rejected": _rejected,
+        "hash": _timings["hash"].as_dict(),
+        "verify": _timings["verify"].as_dict(),
+    }
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
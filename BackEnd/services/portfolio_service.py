@@ -0,0 +1,406 @@
+import asyncio
+import json
+import math
+import os
+import numpy as np
+from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database.models import Strategy, MarketData, BacktestResult
+from services import backtest_service, corporate_actions, resample_service, result_service
+
+DEFAULT_PARAMETERS = {
+    "signal": "momentum",
+    "lookback": 126,
+    "skip": 0,              # most recent bars left out of the momentum window
+    "top": 0.2,             # fraction (< 1) or number of tickers held per side
+    "allow_short": False,
+    "weighting": "equal",   # or inverse_volatility
+    "vol_lookback": 60,
+    "rebalance": "monthly",
+    "max_stale": 5,         # bars without a print before a ticker stops being tradable
+    "initial_capital": 1000000.0,
+    "commission": 0.0005,
+    "slippage": 0.0005,
+    "periods_per_year": 252,
+}
+REBALANCE = ("daily", "weekly", "monthly", "quarterly", "yearly")
+# settings that mean the same thing for single-asset and portfolio backtests
+SHARED_KEYS = ("initial_capital", "commission", "slippage", "periods_per_year", "allow_short")
+MAX_TICKERS = int(os.getenv("PORTFOLIO_MAX_TICKERS", "5000"))
+# (dates x tickers) cells per simulated chunk; a chunk holds about ten float64 matrices of this size
+CHUNK_CELLS = int(os.getenv("PORTFOLIO_CHUNK_CELLS", "2000000"))
+FETCH_ROWS = 100_000
+
+
+def parse_parameters(raw, overrides: dict = None) -> dict:
+    # portfolio settings live under "portfolio" in Strategy.parameters, next to the single-asset ones
+    if isinstance(raw, str):
+        raw = json.loads(raw) if raw.strip() else {}
+    raw = raw or {}
+    params = dict(DEFAULT_PARAMETERS)
+    params.update({k: raw[k] for k in SHARED_KEYS if k in raw})
+    params.update(raw.get("portfolio") or {})
+    params.update(overrides or {})
+    if params["signal"] not in SIGNALS:
+        raise ValueError(f"unknown portfolio signal '{params['signal']}', expected one of {', '.join(SIGNALS)}")
+    if params["weighting"] not in ("equal", "inverse_volatility"):
+        raise ValueError("weighting must be 'equal' or 'inverse_volatility'")
+    if params["rebalance"] not in REBALANCE:
+        raise ValueError(f"rebalance must be one of {', '.join(REBALANCE)}")
+    return params
+
+
+def chunk_dates(width: int) -> int:
+    return max(1, CHUNK_CELLS // max(width, 1))
+
+
+def rebalance_periods(dates: np.ndarray, rebalance: str) -> np.ndarray:
+    # an integer per bar that changes at the first bar of each rebalance period
+    if rebalance == "quarterly":
+        return dates.astype("datetime64[M]").astype(np.int64) // 3
+    if rebalance == "yearly":
+        return dates.astype("datetime64[Y]").astype(np.int64)
+    interval = {"daily": "1d", "weekly": "1w", "monthly": "1mo"}[rebalance]
+    return resample_service.bucket_floor(dates, interval).astype(np.int64)
+
+
+# --- panel ----------------------------------------------------------------------------------------
+
+def build_panel(dates: np.ndarray, codes: np.ndarray, values: np.ndarray, width: int):
+    # long (date, ticker code, value) rows -> (unique dates, dates x tickers matrix with NaN for missing bars)
+    calendar, rows = np.unique(dates, return_inverse=True)
+    panel = np.full((len(calendar), width), np.nan)
+    panel[rows, codes] = values
+    return calendar, panel
+
+
+async def iter_panel_chunks(db: AsyncSession, tickers: list, start=None, end=None, dates_per_chunk: int = None):
+    # One query for the whole universe, streamed in date order and cut into panels of at most
+    # dates_per_chunk dates. The calendar is the union of all tickers' dates.
+    dates_per_chunk = dates_per_chunk or chunk_dates(len(tickers))
+    index = {ticker: i for i, ticker in enumerate(tickers)}
+    # closes are split and dividend adjusted as they stream in
+    factors = await corporate_actions.price_factor_table(db, tickers)
+    stmt = select(MarketData.date, MarketData.ticker, MarketData.close).where(MarketData.ticker.in_(tickers))
+    if start is not None:
+        stmt = stmt.where(MarketData.date >= start)
+    if end is not None:
+        stmt = stmt.where(MarketData.date <= end)
+    stmt = stmt.order_by(MarketData.date).execution_options(yield_per=FETCH_ROWS)
+    result = await db.stream(stmt)
+
+    pending = []
+    async for rows in result.partitions(FETCH_ROWS):
+        count = len(rows)
+        dates = np.fromiter((row[0] for row in rows), dtype="datetime64[us]", count=count)
+        codes = np.fromiter((index[row[1]] for row in rows), dtype=np.int64, count=count)
+        values = np.fromiter((row[2] for row in rows), dtype=np.float64, count=count)
+        values = corporate_actions.scale_prices(factors, codes, dates, values)
+        pending.append((dates, codes, values))
+        buffered = np.concatenate([p[0] for p in pending])
+        distinct = np.unique(buffered)
+        # the newest date may continue in the next partition, so it is held back
+        while len(distinct) > dates_per_chunk:
+            cutoff = distinct[dates_per_chunk]
+            dates, codes, values = (np.concatenate([p[i] for p in pending]) for i in range(3))
+            head = dates < cutoff
+            yield build_panel(dates[head], codes[head], values[head], len(tickers))
+            pending = [(dates[~head], codes[~head], values[~head])]
+            distinct = distinct[dates_per_chunk:]
+    if pending:
+        dates, codes, values = (np.concatenate([p[i] for p in pending]) for i in range(3))
+        if len(dates):
+            yield build_panel(dates, codes, values, len(tickers))
+
+
+# --- signals --------------------------------------------------------------------------------------
+# Each signal scores tickers on the rebalance rows of `history` (rows x tickers, forward filled);
+# higher scores are preferred and NaN means not eligible.
+
+def _trailing_return(history, rows, lookback, skip=0):
+    scores = np.full((len(rows), history.shape[1]), np.nan)
+    valid = rows - lookback >= 0
+    r = rows[valid]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        scores[valid] = history[r - skip] / history[r - lookback] - 1.0
+    return scores
+
+
+def _trailing_volatility(history, rows, lookback):
+    # std of one-bar returns over the lookback window ending at each row
+    returns = np.full(history.shape, np.nan)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        returns[1:] = history[1:] / history[:-1] - 1.0
+    filled = np.where(np.isnan(returns), 0.0, returns)
+    observed = (~np.isnan(returns)).astype(np.float64)
+    zeros = np.zeros((1, history.shape[1]))
+    csum = np.concatenate([zeros, np.cumsum(filled, axis=0)])
+    csum_sq = np.concatenate([zeros, np.cumsum(filled * filled, axis=0)])
+    ccount = np.concatenate([zeros, np.cumsum(observed, axis=0)])
+    out = np.full((len(rows), history.shape[1]), np.nan)
+    valid = rows - lookback + 1 >= 1
+    hi = rows[valid] + 1
+    lo = hi - lookback
+    count = ccount[hi] - ccount[lo]
+    mean = (csum[hi] - csum[lo]) / lookback
+    var = (csum_sq[hi] - csum_sq[lo]) / lookback - mean * mean
+    out[valid] = np.where(count == lookback, np.sqrt(np.maximum(var, 0.0)), np.nan)
+    return out
+
+
+def _momentum(history, rows, params):
+    return _trailing_return(history, rows, int(params["lookback"]), int(params["skip"]))
+
+
+def _reversal(history, rows, params):
+    return -_trailing_return(history, rows, int(params["lookback"]))
+
+
+def _low_volatility(history, rows, params):
+    return -_trailing_volatility(history, rows, int(params["lookback"]))
+
+
+def _equal_weight(history, rows, params):
+    return np.where(np.isnan(history[rows]), np.nan, 0.0)
+
+
+SIGNALS = {
+    "momentum": _momentum,
+    "reversal": _reversal,
+    "low_volatility": _low_volatility,
+    "equal_weight": _equal_weight,
+}
+
+
+def target_weights(scores: np.ndarray, tradable: np.ndarray, params: dict, volatility: np.ndarray = None):
+    # rank each row, hold the top (and bottom, when shorting) names; every side sums to 1 (0.5 when long/short)
+    eligible = tradable & ~np.isnan(scores)
+    counts = eligible.sum(axis=1)
+    top = params["top"]
+    if params["signal"] == "equal_weight":
+        held = counts
+    elif top >= 1:
+        held = np.minimum(counts, int(top))
+    else:
+        held = np.ceil(counts * top).astype(np.int64)
+    if params["allow_short"]:
+        held = np.minimum(held, counts // 2)
+
+    keyed = np.where(eligible, scores, -np.inf)
+    order = np.argsort(-keyed, axis=1, kind="stable")
+    ranks = np.empty_like(order)
+    np.put_along_axis(ranks, order, np.arange(scores.shape[1])[None, :], axis=1)
+    longs = eligible & (ranks < held[:, None])
+    shorts = np.zeros_like(longs)
+    if params["allow_short"]:
+        shorts = eligible & (ranks >= (counts - held)[:, None])
+
+    if params["weighting"] == "inverse_volatility" and volatility is not None:
+        with np.errstate(divide="ignore"):
+            raw = np.where(volatility > 0, 1.0 / volatility, np.nan)
+        # names without a usable volatility get the average of the row's selected names
+        usable = (longs | shorts) & ~np.isnan(raw)
+        count = usable.sum(axis=1, keepdims=True)
+        average = np.where(count > 0, np.where(usable, raw, 0.0).sum(axis=1, keepdims=True) / np.maximum(count, 1), 1.0)
+        raw = np.where(np.isnan(raw), average, raw)
+    else:
+        raw = np.ones(scores.shape)
+    side = 0.5 if params["allow_short"] else 1.0
+    weights = np.zeros(scores.shape)
+    for mask, sign in ((longs, 1.0), (shorts, -1.0)):
+        total = np.where(mask, raw, 0.0).sum(axis=1, keepdims=True)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            weights += np.where(mask, sign * side * raw / total, 0.0)
+    return np.nan_to_num(weights)
+
+
+# --- simulation -----------------------------------------------------------------------------------
+
+class PortfolioSimulator:
+    # Consumes panel chunks in date order. Between rebalances the holdings drift with prices; a rebalance
+    # decided on a bar's close trades at that close. Everything a later chunk needs is carried over.
+    def __init__(self, width: int, params: dict):
+        self.params = params
+        self.width = width
+        self.cost_rate = params["commission"] + params["slippage"]
+        self.lookback = max(int(params["lookback"]), int(params["vol_lookback"])) + 1
+        self.last_price = np.full(width, np.nan)
+        self.last_seen = np.full(width, -(1 << 62), dtype=np.int64)
+        self.history = np.empty((0, width))
+        self.weights = np.zeros(width)
+        self.base_price = np.ones(width)
+        self.base_value = float(params["initial_capital"])
+        self.period = None
+        self.rows = 0
+        self.rebalances = 0
+        self.total_costs = 0.0
+        self.dates = []
+        self.equity = []
+        self.gross = []
+        self.net = []
+        self.turnover = []
+
+    def _forward_fill(self, raw: np.ndarray) -> np.ndarray:
+        observed = ~np.isnan(raw)
+        index = np.where(observed, np.arange(len(raw))[:, None], -1)
+        np.maximum.accumulate(index, axis=0, out=index)
+        filled = np.take_along_axis(raw, np.maximum(index, 0), axis=0)
+        return np.where(index >= 0, filled, self.last_price[None, :])
+
+    def run_chunk(self, dates: np.ndarray, raw: np.ndarray):
+        n = len(dates)
+        if n == 0:
+            return
+        params = self.params
+        global_rows = self.rows + np.arange(n)
+        prices = self._forward_fill(raw)
+        seen = np.where(~np.isnan(raw), global_rows[:, None], -(1 << 62))
+        seen = np.maximum(np.maximum.accumulate(seen, axis=0), self.last_seen[None, :])
+        tradable = ~np.isnan(prices) & (global_rows[:, None] - seen <= int(params["max_stale"]))
+
+        # the first bar of every calendar period is a rebalance bar
+        periods = rebalance_periods(dates, params["rebalance"])
+        previous = np.r_[self.period if self.period is not None else periods[0] - 1, periods[:-1]]
+        reb = np.flatnonzero(periods != previous)
+
+        history = np.concatenate([self.history, prices])
+        offset = len(self.history)
+        rows = reb + offset
+        scores = SIGNALS[params["signal"]](history, rows, params)
+        volatility = _trailing_volatility(history, rows, int(params["vol_lookback"])) \
+            if params["weighting"] == "inverse_volatility" else None
+        targets = target_weights(scores, tradable[reb], params, volatility)
+
+        # segment s covers the bars after rebalance s up to and including rebalance s + 1; -1 is the carried segment
+        segment = np.searchsorted(reb, np.arange(n), side="left") - 1
+        weights = np.vstack([self.weights[None, :], targets])
+        bases = np.vstack([self.base_price[None, :], prices[reb]])
+        w = weights[segment + 1]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            relative = np.nan_to_num(prices / bases[segment + 1], nan=1.0, posinf=1.0)
+        held = w * relative
+        growth = 1.0 + (held - w).sum(axis=1)
+
+        # value carried into each segment: chained over the rebalances, net of trading costs
+        drifted = held[reb] / growth[reb][:, None]
+        turnover = np.abs(targets - drifted).sum(axis=1)
+        factors = growth[reb] * (1.0 - turnover * self.cost_rate)
+        segment_values = self.base_value * np.cumprod(np.r_[1.0, factors])
+        equity = segment_values[segment + 1] * growth
+        equity[reb] = segment_values[1:]
+        self.total_costs += float(np.sum(segment_values[:-1] * growth[reb] * turnover * self.cost_rate))
+
+        exposure = held / growth[:, None]
+        exposure[reb] = targets
+        turnover_rows = np.zeros(n)
+        turnover_rows[reb] = turnover
+
+        self.dates.append(dates)
+        self.equity.append(equity)
+        self.gross.append(np.abs(exposure).sum(axis=1))
+        self.net.append(exposure.sum(axis=1))
+        self.turnover.append(turnover_rows)
+
+        if len(reb):
+            self.weights = targets[-1]
+            self.base_price = prices[reb[-1]]
+            self.rebalances += len(reb)
+        self.base_value = float(segment_values[-1])
+        self.last_price = prices[-1]
+        self.last_seen = seen[-1]
+        self.period = periods[-1]
+        self.history = history[-self.lookback:]
+        self.rows += n
+
+    def finish(self) -> dict:
+        dates = np.concatenate(self.dates) if self.dates else np.empty(0, dtype="datetime64[us]")
+        equity = np.concatenate(self.equity) if self.equity else np.empty(0)
+        gross = np.concatenate(self.gross) if self.gross else np.empty(0)
+        net = np.concatenate(self.net) if self.net else np.empty(0)
+        turnover = np.concatenate(self.turnover) if self.turnover else np.empty(0)
+        return {
+            "dates": dates,
+            "equity": equity,
+            "gross_exposure": gross,
+            "net_exposure": net,
+            "turnover": turnover,
+            "metrics": compute_metrics(dates, equity, gross, net, turnover, self.rebalances, self.total_costs,
+                                       self.params),
+        }
+
+
+def compute_metrics(dates, equity, gross, net, turnover, rebalances, costs, params) -> dict:
+    n = len(equity)
+    capital = float(params["initial_capital"])
+    periods = float(params["periods_per_year"])
+    returns = np.diff(np.r_[capital, equity]) / np.r_[capital, equity[:-1]] if n else np.empty(0)
+    final = float(equity[-1]) if n else capital
+    std = float(np.std(returns)) if n else 0.0
+    mean = float(np.mean(returns)) if n else 0.0
+    downside = returns[returns < 0]
+    downside_std = float(np.sqrt(np.mean(downside * downside))) if len(downside) else 0.0
+    years = (dates[-1] - dates[0]) / np.timedelta64(365 * 24 * 3600, "s") if n > 1 else 0.0
+    peak = np.maximum.accumulate(np.r_[capital, equity])
+    return {
+        "bars": n,
+        "initial_capital": capital,
+        "final_equity": final,
+        "total_return": final / capital - 1.0,
+        "cagr": float((final / capital) ** (1.0 / years) - 1.0) if years > 0 and final > 0 else None,
+        "volatility": float(std * math.sqrt(periods)),
+        "sharpe": float(mean / std * math.sqrt(periods)) if std > 0 else None,
+        "sortino": float(mean / downside_std * math.sqrt(periods)) if downside_std > 0 else None,
+        "max_drawdown": float(np.min(np.r_[capital, equity] / peak - 1.0)),
+        "avg_gross_exposure": float(np.mean(gross)) if n else 0.0,
+        "avg_net_exposure": float(np.mean(net)) if n else 0.0,
+        "turnover": float(np.sum(turnover)),
+        "annual_turnover": float(np.sum(turnover) / years) if years > 0 else None,
+        "rebalances": rebalances,
+        "costs": costs,
+    }
+
+
+def simulate(dates: np.ndarray, panel: np.ndarray, params: dict, dates_per_chunk: int = None) -> dict:
+    # in-memory entry point (benchmarks); the service streams chunks from the database
+    dates_per_chunk = dates_per_chunk or chunk_dates(panel.shape[1])
+    simulator = PortfolioSimulator(panel.shape[1], params)
+    for start in range(0, len(dates), dates_per_chunk):
+        simulator.run_chunk(dates[start:start + dates_per_chunk], panel[start:start + dates_per_chunk])
+    return simulator.finish()
+
+
+async def run_portfolio_backtest(db: AsyncSession, strategy: Strategy, tickers: list, start=None, end=None,
+                                 overrides: dict = None) -> BacktestResult:
+    tickers = list(dict.fromkeys(t.upper() for t in tickers))
+    if not tickers:
+        raise HTTPException(status_code=400, detail="tickers must not be empty")
+    if len(tickers) > MAX_TICKERS:
+        raise HTTPException(status_code=400, detail=f"at most {MAX_TICKERS} tickers per portfolio backtest")
+    try:
+        params = parse_parameters(strategy.parameters, overrides)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    simulator = PortfolioSimulator(len(tickers), params)
+    async for calendar, panel in iter_panel_chunks(db, tickers, start, end):
+        await asyncio.to_thread(simulator.run_chunk, calendar, panel)
+    if simulator.rows < 2:
+        raise HTTPException(status_code=404, detail="Not enough market data for backtest")
+    outcome = simulator.finish()
+
+    dates = outcome["dates"]
+    result = BacktestResult(
+        strategy_id=strategy.id,
+        ticker=None,
+        start_date=backtest_service.to_datetime(dates[0]),
+        end_date=backtest_service.to_datetime(dates[-1]),
+        results={"metrics": outcome["metrics"], "parameters": params, "tickers": tickers, "mode": "portfolio"},
+        trade_count=0,
+        equity_curve=result_service.encode_series(dates, outcome["equity"]),
+        logs="",
+    )
+    db.add(result)
+    await db.commit()
+    await db.refresh(result)
+    return result
@@ -1,33 +1,232 @@
-import threading
-import datetime
-
-class fixed_window:
-    def __init__(self,T, N):
-        self.limit = N
-        self.Tokens = 0
-        self.window_length = T
-        self.lock = threading.Lock()
-        tm = datetime.datetime.now()
-        self.start_time = self.time_floor(tm)
-
-    def is_allowed(self, route):
-        
-        with self.lock:
-            if self.Tokens < self.limit:
-                return True
-            elif datetime.datetime.now() - self.start_time > datetime.timedelta(seconds=self.window_length):
-                self.start_time = self.time_floor(datetime.datetime.now())
-                self.Tokens = 0
-                return True
-            return False
-
-    def time_floor(self, tm):
-        return tm - datetime.timedelta(minutes=tm.minute % 1,
-                                        seconds=tm.second,
-                                        microseconds=tm.microsecond)
-
-    def increment(self):
-        with self.lock:
-            if self.Tokens < self.limit:
-                self.Tokens += 1
-                
+import asyncio
+import math
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from services.auth_service import user_id_from_token
+
+# The memory backend is only touched from the event loop thread and never awaits between
+# reading and writing a key's state, so checks are atomic without any lock.
+
+
+class SlidingWindow:
+    # sliding-window counter: the previous window's count is weighted by how much of it still overlaps
+    def __init__(self, limit: int, window: float):
+        self.limit = limit
+        self.window = float(window)
+
+    def initial(self, now: float) -> list:
+        return [now, 0.0, 0.0]  # window start, previous count, current count
+
+    def check(self, state: list, now: float, cost: float = 1.0):
+        window = self.window
+        elapsed = now - state[0]
+        if elapsed >= window:
+            windows = int(elapsed // window)
+            state[1] = state[2] if windows == 1 else 0.0
+            state[2] = 0.0
+            state[0] += windows * window
+            elapsed = now - state[0]
+        overlap = 1.0 - elapsed / window
+        if state[1] * overlap + state[2] + cost <= self.limit:
+            state[2] += cost
+            return True, 0.0
+        # wait until enough of the previous window has slid out, or for the next window
+        room = self.limit - state[2] - cost
+        if room >= 0 and state[1] > 0:
+            retry_after = (1.0 - room / state[1]) * window - elapsed
+        else:
+            retry_after = window - elapsed
+        return False, max(retry_after, 0.0)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = float(rate)  # tokens per second
+        self.burst = float(burst)
+
+    def initial(self, now: float) -> list:
+        return [self.burst, now]  # tokens, last refill
+
+    def check(self, state: list, now: float, cost: float = 1.0):
+        tokens = min(self.burst, state[0] + (now - state[1]) * self.rate)
+        state[1] = now
+        if tokens >= cost:
+            state[0] = tokens - cost
+            return True, 0.0
+        state[0] = tokens
+        return False, (cost - tokens) / self.rate
+
+
+class Policy:
+    def __init__(self, name: str, prefix: str, algorithm, by: str = "user"):
+        self.name = name
+        self.prefix = prefix
+        self.algorithm = algorithm
+        self.by = by  # "user" (falls back to ip when unauthenticated) or "ip"
+
+
+class MemoryBackend:
+    # per-process store bounded by key count; keys idle for longer than idle_ttl are dropped
+    blocking = False
+    def __init__(self, max_keys: int = 100_000, idle_ttl: float = 3600.0, clock=time.monotonic):
+        self.max_keys = max_keys
+        self.idle_ttl = idle_ttl
+        self.clock = clock
+        self.entries = OrderedDict()  # key -> [last_seen, state], least recently used first
+        self.evictions = 0
+
+    def hit(self, key: str, algorithm, cost: float = 1.0):
+        now = self.clock()
+        entries = self.entries
+        entry = entries.get(key)
+        if entry is None:
+            entry = entries[key] = [now, algorithm.initial(now)]
+            if len(entries) > self.max_keys:
+                entries.popitem(last=False)
+                self.evictions += 1
+        else:
+            entry[0] = now
+            entries.move_to_end(key)
+        # LRU order is also last-seen order, so idle keys are always at the front
+        cutoff = now - self.idle_ttl
+        while True:
+            oldest = next(iter(entries.values()))
+            if oldest[0] >= cutoff:
+                break
+            entries.popitem(last=False)
+            self.evictions += 1
+        return algorithm.check(entry[1], now, cost)
+
+    def stats(self) -> dict:
+        return {"backend": "memory", "keys": len(self.entries), "evictions": self.evictions}
+
+
+class SQLiteBackend:
+    # Shares limits between the worker processes on one host through a local SQLite file,
+    # standing in for a networked store. Each check is one short IMMEDIATE transaction, which can wait
+    # up to busy_timeout for other processes, so RateLimiter.check_async runs it on the backend's own thread.
+    PURGE_EVERY = 1000
+    blocking = True
+
+    def __init__(self, path: str, idle_ttl: float = 3600.0, clock=time.time):
+        self.idle_ttl = idle_ttl
+        self.clock = clock
+        self.connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("PRAGMA busy_timeout=1000")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS rate_limits "
+            "(key TEXT PRIMARY KEY, s0 REAL, s1 REAL, s2 REAL, updated REAL)"
+        )
+        self.hits = 0
+        # one thread, so the shared connection never runs two transactions at once
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rate-limit")
+
+    def hit(self, key: str, algorithm, cost: float = 1.0):
+        now = self.clock()
+        db = self.connection
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute("SELECT s0, s1, s2 FROM rate_limits WHERE key = ?", (key,)).fetchone()
+            state = algorithm.initial(now)
+            if row is not None:
+                state = list(row[:len(state)])
+            allowed, retry_after = algorithm.check(state, now, cost)
+            state += [0.0] * (3 - len(state))
+            db.execute(
+                "INSERT INTO rate_limits (key, s0, s1, s2, updated) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET s0 = excluded.s0, s1 = excluded.s1, s2 = excluded.s2, "
+                "updated = excluded.updated",
+                (key, state[0], state[1], state[2], now),
+            )
+            self.hits += 1
+            if self.hits % self.PURGE_EVERY == 0:
+                db.execute("DELETE FROM rate_limits WHERE updated < ?", (now - self.idle_ttl,))
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        return allowed, retry_after
+
+    def stats(self) -> dict:
+        keys = self.connection.execute("SELECT count(*) FROM rate_limits").fetchone()[0]
+        return {"backend": "sqlite", "keys": keys}
+
+
+class RateLimiter:
+    def __init__(self, policies: list, backend):
+        # longest prefix wins
+        self.policies = sorted(policies, key=lambda p: len(p.prefix), reverse=True)
+        self.backend = backend
+        self.rejected = 0
+
+    def policy_for(self, path: str) -> Policy:
+        for policy in self.policies:
+            if path.startswith(policy.prefix):
+                return policy
+        return None
+
+    def check(self, path: str, client_key):
+        # client_key(by) is only called once a policy applies, so unlimited paths skip token decoding
+        policy = self.policy_for(path)
+        if policy is None:
+            return True, 0.0
+        allowed, retry_after = self.backend.hit(f"{policy.name}:{client_key(policy.by)}", policy.algorithm)
+        if not allowed:
+            self.rejected += 1
+        return allowed, retry_after
+
+    async def check_async(self, path: str, client_key):
+        # check() for the event loop: a blocking backend is hit on its own thread
+        if not self.backend.blocking:
+            return self.check(path, client_key)
+        policy = self.policy_for(path)
+        if policy is None:
+            return True, 0.0
+        key = f"{policy.name}:{client_key(policy.by)}"
+        allowed, retry_after = await asyncio.get_running_loop().run_in_executor(
+            self.backend.executor, self.backend.hit, key, policy.algorithm
+        )
+        if not allowed:
+            self.rejected += 1
+        return allowed, retry_after
+
+    def stats(self) -> dict:
+        data = self.backend.stats()
+        data["rejected"] = self.rejected
+        return data
+
+
+def client_key(request, by: str) -> str:
+    if by == "user":
+        authorization = request.headers.get("authorization", "")
+        if authorization[:7].lower() == "bearer ":
+            user_id = user_id_from_token(authorization[7:])
+            if user_id is not None:
+                return f"user:{user_id}"
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+
+def retry_after_header(retry_after: float) -> str:
+    return str(max(1, math.ceil(retry_after)))
+
+
+DEFAULT_POLICIES = [
+    Policy("default", "/", SlidingWindow(100, 60)),  # 100 requests per 60 seconds
+    Policy("login", "/api/auth/token", SlidingWindow(10, 60), by="ip"),
+    Policy("signup", "/api/auth", SlidingWindow(20, 3600), by="ip"),
+    Policy("bulk", "/api/data/bulk", TokenBucket(rate=1 / 6, burst=5)),
+]
+
+
+def build_limiter(policies: list = None) -> RateLimiter:
+    backend = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+    if backend == "sqlite":
+        store = SQLiteBackend(os.getenv("RATE_LIMIT_SQLITE_PATH", "rate_limits.sqlite3"))
+    else:
+        store = MemoryBackend(max_keys=int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000")))
+    return RateLimiter(policies or DEFAULT_POLICIES, store)
@@ -0,0 +1,338 @@
+import os
+from datetime import datetime
+import numpy as np
+from sqlalchemy import delete, func, insert, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from database.models import MarketData, MarketDataRollup
+from services import bar_cache, data_events, data_service
+
+# fixed-width intervals in seconds; weeks start on Monday and months on the 1st, both in UTC
+INTERVALS = {
+    "1m": 60,
+    "5m": 300,
+    "15m": 900,
+    "30m": 1800,
+    "1h": 3600,
+    "4h": 14400,
+    "1d": 86400,
+    "1w": "week",
+    "1mo": "month",
+}
+# bucket expressions for the SQL path; date_bin keeps sub-hour buckets aligned to the epoch like the numpy path
+PG_BUCKETS = {
+    "1m": "date_trunc('minute', date)",
+    "5m": "date_bin('5 minutes', date, TIMESTAMP '1970-01-01')",
+    "15m": "date_bin('15 minutes', date, TIMESTAMP '1970-01-01')",
+    "30m": "date_bin('30 minutes', date, TIMESTAMP '1970-01-01')",
+    "1h": "date_trunc('hour', date)",
+    "4h": "date_bin('4 hours', date, TIMESTAMP '1970-01-01')",
+    "1d": "date_trunc('day', date)",
+    "1w": "date_trunc('week', date)",
+    "1mo": "date_trunc('month', date)",
+}
+# intervals materialised in market_data_rollups and kept current on every write
+ROLLUP_INTERVALS = tuple(i.strip() for i in os.getenv("RESAMPLE_ROLLUPS", "1h,1d").split(",") if i.strip())
+OUTPUT_COLUMNS = ("date", "open", "high", "low", "close", "volume", "vwap", "bars")
+OUTPUT_DTYPES = dict(data_service.COLUMN_DTYPES, vwap="float64", bars="int64")
+INPUT_COLUMNS = ("date", "open", "high", "low", "close", "volume")
+MAX_FILL_BARS = 100_000
+ROLLUP_INSERT_ROWS = 1000
+
+ONE_MICROSECOND = np.timedelta64(1, "us")
+
+_PG_RESAMPLE = """
+SELECT {bucket} AS bucket,
+       (array_agg(open ORDER BY date))[1] AS open,
+       max(high) AS high,
+       min(low) AS low,
+       (array_agg(close ORDER BY date DESC))[1] AS close,
+       sum(volume)::bigint AS volume,
+       sum((high + low + close) / 3 * volume) / NULLIF(sum(volume), 0)::double precision AS vwap,
+       count(*) AS bars
+FROM market_data
+WHERE ticker = :ticker{range}
+GROUP BY 1
+ORDER BY 1
+"""
+
+
+def check_interval(interval: str):
+    if interval not in INTERVALS:
+        raise ValueError(f"interval must be one of {', '.join(INTERVALS)}")
+
+
+def bucket_floor(dates: np.ndarray, interval: str) -> np.ndarray:
+    step = INTERVALS[interval]
+    dates = dates.astype("datetime64[us]")
+    if step == "month":
+        return dates.astype("datetime64[M]").astype("datetime64[us]")
+    if step == "week":
+        days = dates.astype("datetime64[D]").astype(np.int64)
+        # 1970-01-01 was a Thursday, three days after a Monday
+        return (days - (days + 3) % 7).astype("datetime64[D]").astype("datetime64[us]")
+    seconds = dates.astype("datetime64[s]").astype(np.int64)
+    return (seconds - seconds % step).astype("datetime64[s]").astype("datetime64[us]")
+
+
+def bucket_after(buckets: np.ndarray, interval: str) -> np.ndarray:
+    step = INTERVALS[interval]
+    if step == "month":
+        return (buckets.astype("datetime64[M]") + 1).astype("datetime64[us]")
+    if step == "week":
+        return buckets + np.timedelta64(7, "D")
+    return buckets + np.timedelta64(step, "s")
+
+
+def bucket_range(first: np.datetime64, last: np.datetime64, interval: str) -> np.ndarray:
+    # every bucket start from first to last inclusive
+    step = INTERVALS[interval]
+    if step == "month":
+        return np.arange(first.astype("datetime64[M]"), last.astype("datetime64[M]") + 1).astype("datetime64[us]")
+    width = np.timedelta64(7, "D") if step == "week" else np.timedelta64(step, "s")
+    return np.arange(first, last + ONE_MICROSECOND, width).astype("datetime64[us]")
+
+
+def _floor_datetime(value: datetime, interval: str) -> datetime:
+    return bucket_floor(np.array([value], dtype="datetime64[us]"), interval)[0].item()
+
+
+def _next_datetime(bucket: datetime, interval: str) -> datetime:
+    return bucket_after(np.array([bucket], dtype="datetime64[us]"), interval)[0].item()
+
+
+def _before(value: datetime) -> datetime:
+    # inclusive upper bound for a range ending just before a bucket boundary
+    return (np.datetime64(value, "us") - ONE_MICROSECOND).item()
+
+
+def empty_bars() -> dict:
+    return {name: np.empty(0, dtype=OUTPUT_DTYPES[name]) for name in OUTPUT_COLUMNS}
+
+
+def resample_arrays(bars: dict, interval: str) -> dict:
+    # bars must be sorted by date; one reduceat pass per column over the bucket boundaries
+    dates = bars["date"]
+    if not len(dates):
+        return empty_bars()
+    buckets = bucket_floor(dates, interval)
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(dates)] - 1
+    high, low, close = bars["high"], bars["low"], bars["close"]
+    volume = bars["volume"]
+    volume_sum = np.add.reduceat(volume, starts)
+    notional = np.add.reduceat((high + low + close) / 3 * volume, starts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        vwap = np.where(volume_sum > 0, notional / volume_sum, np.nan)
+    return {
+        "date": buckets[starts],
+        "open": bars["open"][starts],
+        "high": np.maximum.reduceat(high, starts),
+        "low": np.minimum.reduceat(low, starts),
+        "close": close[ends],
+        "volume": volume_sum.astype(np.int64),
+        "vwap": vwap,
+        "bars": (ends - starts + 1).astype(np.int64),
+    }
+
+
+def fill_gaps(bars: dict, interval: str) -> dict:
+    # empty buckets become flat bars at the previous close with zero volume
+    dates = bars["date"]
+    if len(dates) < 2:
+        return bars
+    full = bucket_range(dates[0], dates[-1], interval)
+    if len(full) == len(dates):
+        return bars
+    if len(full) > MAX_FILL_BARS:
+        raise ValueError(f"gap filling would produce {len(full)} bars, the limit is {MAX_FILL_BARS}")
+    present = np.isin(full, dates, assume_unique=True)
+    last = np.cumsum(present) - 1  # index of the latest real bar at or before each bucket
+    previous_close = bars["close"][last]
+    return {
+        "date": full,
+        "open": np.where(present, bars["open"][last], previous_close),
+        "high": np.where(present, bars["high"][last], previous_close),
+        "low": np.where(present, bars["low"][last], previous_close),
+        "close": previous_close,
+        "volume": np.where(present, bars["volume"][last], 0),
+        "vwap": np.where(present, bars["vwap"][last], np.nan),
+        "bars": np.where(present, bars["bars"][last], 0),
+    }
+
+
+def concat_bars(parts: list) -> dict:
+    parts = [part for part in parts if len(part["date"])]
+    if not parts:
+        return empty_bars()
+    return {name: np.concatenate([part[name] for part in parts]) for name in OUTPUT_COLUMNS}
+
+
+def _rows_to_bars(rows) -> dict:
+    count = len(rows)
+    return {
+        name: np.fromiter(
+            (np.nan if row[i] is None else row[i] for row in rows) if name == "vwap" else (row[i] for row in rows),
+            dtype=OUTPUT_DTYPES[name], count=count,
+        )
+        for i, name in enumerate(OUTPUT_COLUMNS)
+    }
+
+
+async def resample_raw(db: AsyncSession, ticker: str, interval: str, start=None, end=None,
+                       cached: bool = True) -> dict:
+    # aggregates the raw bars in [start, end]; postgres does it in SQL so only output bars cross the wire.
+    # cached=False reads through the session, which sees the caller's uncommitted writes
+    if db.get_bind().dialect.name == "postgresql":
+        params = {"ticker": ticker}
+        where = ""
+        if start is not None:
+            where += " AND date >= :start"
+            params["start"] = start
+        if end is not None:
+            where += " AND date <= :end"
+            params["end"] = end
+        result = await db.execute(text(_PG_RESAMPLE.format(bucket=PG_BUCKETS[interval], range=where)), params)
+        return _rows_to_bars(result.all())
+    fetch = bar_cache.fetch_bars if cached else data_service.fetch_bars
+    bars = await fetch(db, ticker, start, end, INPUT_COLUMNS)
+    return resample_arrays(bars, interval)
+
+
+async def has_rollups(db: AsyncSession, ticker: str, interval: str) -> bool:
+    result = await db.execute(
+        select(MarketDataRollup.id)
+        .where(MarketDataRollup.ticker == ticker, MarketDataRollup.interval == interval)
+        .limit(1)
+    )
+    return result.scalar() is not None
+
+
+async def read_rollups(db: AsyncSession, ticker: str, interval: str, start=None, end=None) -> dict:
+    # buckets starting in [start, end)
+    stmt = select(*[getattr(MarketDataRollup, "bucket" if c == "date" else c) for c in OUTPUT_COLUMNS]).where(
+        MarketDataRollup.ticker == ticker, MarketDataRollup.interval == interval
+    )
+    if start is not None:
+        stmt = stmt.where(MarketDataRollup.bucket >= start)
+    if end is not None:
+        stmt = stmt.where(MarketDataRollup.bucket < end)
+    result = await db.execute(stmt.order_by(MarketDataRollup.bucket))
+    return _rows_to_bars(result.all())
+
+
+async def _resample_with_rollups(db: AsyncSession, ticker: str, interval: str, start=None, end=None) -> dict:
+    # whole buckets come from the rollup table; a partially covered bucket at either edge is computed from raw bars
+    if start is not None and end is not None and _floor_datetime(start, interval) == _floor_datetime(end, interval):
+        return await resample_raw(db, ticker, interval, start, end)
+    parts = []
+    lower = upper = None
+    if start is not None:
+        lower = _floor_datetime(start, interval)
+        if lower != start:
+            lower = _next_datetime(lower, interval)
+            parts.append(await resample_raw(db, ticker, interval, start, _before(lower)))
+    tail = None
+    if end is not None:
+        last = _floor_datetime(end, interval)
+        upper = _next_datetime(last, interval)
+        if _before(upper) != end:
+            upper = last
+            tail = await resample_raw(db, ticker, interval, last, end)
+    parts.append(await read_rollups(db, ticker, interval, lower, upper))
+    if tail is not None:
+        parts.append(tail)
+    return concat_bars(parts)
+
+
+async def resample(db: AsyncSession, ticker: str, interval: str, start=None, end=None, fill: bool = False,
+                   source: str = "auto"):
+    # returns (bars, source actually used)
+    check_interval(interval)
+    if source == "rollup" and interval not in ROLLUP_INTERVALS:
+        raise ValueError(f"rollups are kept for {', '.join(ROLLUP_INTERVALS) or 'no intervals'}")
+    use_rollups = source != "raw" and interval in ROLLUP_INTERVALS and await has_rollups(db, ticker, interval)
+    if use_rollups:
+        bars = await _resample_with_rollups(db, ticker, interval, start, end)
+    else:
+        bars = await resample_raw(db, ticker, interval, start, end)
+    if fill:
+        bars = fill_gaps(bars, interval)
+    return bars, "rollup" if use_rollups else "raw"
+
+
+def bars_to_records(bars: dict) -> list:
+    dates = np.datetime_as_string(bars["date"], unit="s").tolist()
+    vwap = [None if v != v else v for v in bars["vwap"].tolist()]
+    return [
+        {"date": d, "open": o, "high": h, "low": l, "close": c, "volume": v, "vwap": w, "bars": n}
+        for d, o, h, l, c, v, w, n in zip(
+            dates, bars["open"].tolist(), bars["high"].tolist(), bars["low"].tolist(), bars["close"].tolist(),
+            bars["volume"].tolist(), vwap, bars["bars"].tolist(),
+        )
+    ]
+
+
+async def refresh_rollups(db: AsyncSession, ticker: str, start: datetime, end: datetime):
+    # Recomputes every rollup bucket touching [start, end] from the raw bars. Called inside the
+    # writer's transaction, so the rollups commit (or roll back) together with the bars. The bar cache only
+    # learns of the write after the commit, so the bars are read through the transaction instead.
+    for interval in ROLLUP_INTERVALS:
+        lower = _floor_datetime(start, interval)
+        upper = _next_datetime(_floor_datetime(end, interval), interval)
+        bars = await resample_raw(db, ticker, interval, lower, _before(upper), cached=False)
+        await db.execute(
+            delete(MarketDataRollup).where(
+                MarketDataRollup.ticker == ticker,
+                MarketDataRollup.interval == interval,
+                MarketDataRollup.bucket >= lower,
+                MarketDataRollup.bucket < upper,
+            )
+        )
+        rows = [
+            dict(record, ticker=ticker, interval=interval, bucket=bucket)
+            for record, bucket in zip(_rollup_values(bars), bars["date"].tolist())
+        ]
+        for offset in range(0, len(rows), ROLLUP_INSERT_ROWS):
+            await db.execute(insert(MarketDataRollup), rows[offset:offset + ROLLUP_INSERT_ROWS])
+
+
+def _rollup_values(bars: dict) -> list:
+    vwap = [None if v != v else v for v in bars["vwap"].tolist()]
+    return [
+        {"open": o, "high": h, "low": l, "close": c, "volume": v, "vwap": w, "bars": n}
+        for o, h, l, c, v, w, n in zip(
+            bars["open"].tolist(), bars["high"].tolist(), bars["low"].tolist(), bars["close"].tolist(),
+            bars["volume"].tolist(), vwap, bars["bars"].tolist(),
+        )
+    ]
+
+
+async def refresh_rows(db: AsyncSession, rows: list):
+    # rollup refresh for a batch of written bars, one date range per ticker
+    for ticker, (low, high) in data_events.ticker_ranges(rows).items():
+        await refresh_rollups(db, ticker, low, high)
+
+
+async def rebuild_rollups(db: AsyncSession, ticker: str):
+    result = await db.execute(
+        select(func.min(MarketData.date), func.max(MarketData.date)).where(MarketData.ticker == ticker)
+    )
+    low, high = result.one()
+    await db.execute(delete(MarketDataRollup).where(MarketDataRollup.ticker == ticker))
+    if low is not None:
+        await refresh_rollups(db, ticker, low, high)
+    await db.commit()
+
+
+async def backfill_rollups(db: AsyncSession):
+    # tickers whose bars predate the rollup table (or a newly configured interval) are built once
+    tickers = set()
+    for interval in ROLLUP_INTERVALS:
+        missing = select(MarketData.ticker).distinct().except_(
+            select(MarketDataRollup.ticker).where(MarketDataRollup.interval == interval).distinct()
+        )
+        tickers.update((await db.execute(missing)).scalars().all())
+    tickers = sorted(tickers)
+    for ticker in tickers:
+        await rebuild_rollups(db, ticker)
+    return tickers
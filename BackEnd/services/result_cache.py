@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+import numpy as np
+from sqlalchemy import func, insert, literal, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import undefer
+from database.models import MarketData, BacktestResult, BacktestTrade
+from services import data_events
+
+# Stored backtest results double as a cache. A result is found again by a hash of everything that decides
+# its output (strategy code, parameters, ticker, start date, engine version) together with a stamp of the
+# bars it was computed from. The end date is deliberately left out of the key: a request whose range holds
+# exactly the same bars as a stored run gets that run back, and one that reaches further can carry the
+# stored run on from its last bar (see backtest_service.resume_backtest).
+
+ENABLED = os.getenv("BACKTEST_CACHE", "1") != "0"
+ENGINE_VERSION = 1  # bump whenever an engine change alters backtest output
+COPY_COLUMNS = ("ticker", "side", "size", "entry_date", "exit_date", "entry_price", "exit_price", "trade_return",
+                "pnl")
+RESULT_COPY_COLUMNS = ("ticker", "start_date", "end_date", "results", "trades", "trade_count", "equity_curve",
+                       "cache_key", "data_stamp", "cache_state")
+
+
+class CacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.resumed = 0
+        self.misses = 0
+        self.stale = 0  # resume candidates rejected because their bars changed
+        self.invalidated = 0
+
+    def as_dict(self) -> dict:
+        lookups = self.hits + self.resumed + self.misses
+        return {
+            "enabled": ENABLED,
+            "lookups": lookups,
+            "hits": self.hits,
+            "resumed": self.resumed,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None,
+            "reuse_rate": (self.hits + self.resumed) / lookups if lookups else None,
+            "stale": self.stale,
+            "invalidated": self.invalidated,
+        }
+
+
+stats = CacheStats()
+
+
+def cache_key(code, params: dict, ticker: str, start=None) -> str:
+    payload = json.dumps(
+        {"engine": ENGINE_VERSION, "code": code or "", "parameters": params, "ticker": ticker,
+         "start": start.isoformat() if start is not None else None},
+        sort_keys=True, default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _round(value):
+    # float sums are rounded so a different summation order (e.g. a parallel aggregate) gives the same stamp
+    return None if value is None else f"{float(value):.12g}"
+
+
+async def data_stamp(db: AsyncSession, ticker: str, start=None, end=None) -> str:
+    # fingerprint of the bars in a range, one aggregate over the (ticker, date) index range
+    stmt = select(
+        func.count(), func.min(MarketData.date), func.max(MarketData.date),
+        func.sum(MarketData.open + MarketData.high + MarketData.low + MarketData.close),
+        func.sum(MarketData.volume), func.sum(MarketData.adj_close),
+    ).where(MarketData.ticker == ticker)
+    if start is not None:
+        stmt = stmt.where(MarketData.date >= start)
+    if end is not None:
+        stmt = stmt.where(MarketData.date <= end)
+    count, first, last, prices, volume, adjusted = (await db.execute(stmt)).one()
+    return f"{count}|{first}|{last}|{_round(prices)}|{volume}|{_round(adjusted)}"
+
+
+async def lookup(db: AsyncSession, key: str, stamp: str, strategy_id: int):
+    # the strategy's own stored run comes first; one stored for another strategy with the same code and
+    # parameters is copied onto this strategy, so every result stays owned by the strategy it was run for
+    result = await db.execute(
+        select(BacktestResult).where(BacktestResult.cache_key == key, BacktestResult.data_stamp == stamp)
+        .order_by((BacktestResult.strategy_id == strategy_id).desc(), BacktestResult.id.desc()).limit(1)
+    )
+    cached = result.scalars().first()
+    if cached is None or cached.strategy_id == strategy_id:
+        return cached
+    return await copy_result(db, cached, strategy_id)
+
+
+async def copy_result(db: AsyncSession, source: BacktestResult, strategy_id: int) -> BacktestResult:
+    await db.refresh(source, ["trades", "equity_curve", "cache_state"])
+    copy = BacktestResult(strategy_id=strategy_id, logs=f"copied from backtest {source.id}",
+                          **{c: getattr(source, c) for c in RESULT_COPY_COLUMNS})
+    db.add(copy)
+    await db.flush()
+    await copy_trades(db, source.id, copy.id)
+    await db.commit()
+    await db.refresh(copy)
+    return copy
+
+
+async def resume_candidate(db: AsyncSession, key: str, ticker: str, start=None, end=None):
+    # the longest cached run ending before `end` whose bars are all still unchanged
+    stmt = select(BacktestResult).options(
+        undefer(BacktestResult.cache_state), undefer(BacktestResult.equity_curve)
+    ).where(BacktestResult.cache_key == key, BacktestResult.cache_state.isnot(None))
+    if end is not None:
+        stmt = stmt.where(BacktestResult.end_date < end)
+    result = await db.execute(stmt.order_by(BacktestResult.end_date.desc(), BacktestResult.id.desc()).limit(1))
+    cached = result.scalars().first()
+    if cached is None or cached.equity_curve is None:
+        return None
+    if await data_stamp(db, ticker, start, cached.end_date) != cached.data_stamp:
+        stats.stale += 1
+        return None
+    return cached
+
+
+async def open_trade(db: AsyncSession, backtest_id: int):
+    # the run's last trade, which was closed on its last bar only because the data ended there
+    result = await db.execute(
+        select(BacktestTrade).where(BacktestTrade.backtest_id == backtest_id)
+        .order_by(BacktestTrade.entry_date.desc(), BacktestTrade.id.desc()).limit(1)
+    )
+    return result.scalars().first()
+
+
+async def trade_returns(db: AsyncSession, backtest_id: int, exclude_id: int = None) -> np.ndarray:
+    stmt = select(BacktestTrade.trade_return).where(BacktestTrade.backtest_id == backtest_id)
+    if exclude_id is not None:
+        stmt = stmt.where(BacktestTrade.id != exclude_id)
+    result = await db.execute(stmt.order_by(BacktestTrade.entry_date, BacktestTrade.id))
+    return np.fromiter(result.scalars(), dtype=np.float64)
+
+
+async def copy_trades(db: AsyncSession, source_id: int, target_id: int, exclude_id: int = None):
+    # server-side copy of a cached run's trades onto the run that continues it
+    source = select(literal(target_id), *[getattr(BacktestTrade, c) for c in COPY_COLUMNS]).where(
+        BacktestTrade.backtest_id == source_id
+    )
+    if exclude_id is not None:
+        source = source.where(BacktestTrade.id != exclude_id)
+    await db.execute(insert(BacktestTrade).from_select(
+        ("backtest_id",) + COPY_COLUMNS, source.order_by(BacktestTrade.entry_date, BacktestTrade.id)
+    ))
+
+
+async def invalidate(db: AsyncSession, ticker: str, start, end) -> int:
+    # runs in the writer's transaction, so other processes stop getting hits once the write commits
+    result = await db.execute(
+        update(BacktestResult).where(
+            BacktestResult.ticker == ticker,
+            BacktestResult.cache_key.isnot(None),
+            BacktestResult.start_date <= end,
+            BacktestResult.end_date >= start,
+        ).values(cache_key=None)
+    )
+    stats.invalidated += max(result.rowcount or 0, 0)
+    return result.rowcount
+
+
+async def invalidate_rows(db: AsyncSession, rows: list):
+    for ticker, (low, high) in data_events.ticker_ranges(rows).items():
+        await invalidate(db, ticker, low, high)
@@ -0,0 +1,204 @@
+import base64
+import struct
+import zlib
+from datetime import datetime
+import numpy as np
+from fastapi import HTTPException
+from sqlalchemy import and_, insert, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database.models import Project, Strategy, BacktestResult, BacktestTrade
+from services.serialization import clamp_limit
+
+TRADE_INSERT_ROWS = 1000
+SIDES = {"long": 1, "short": -1}
+SIDE_NAMES = {1: "long", -1: "short"}
+# magic + point count; payload is byte-shuffled delta dates followed by byte-shuffled values
+SERIES_HEADER = struct.Struct("<4sQ")
+SERIES_MAGIC = b"EQ01"
+
+SUMMARY_COLUMNS = (
+    BacktestResult.id, BacktestResult.strategy_id, BacktestResult.ticker, BacktestResult.start_date,
+    BacktestResult.end_date, BacktestResult.results, BacktestResult.trade_count, BacktestResult.created_at,
+)
+TRADE_COLUMNS = (
+    BacktestTrade.id, BacktestTrade.ticker, BacktestTrade.side, BacktestTrade.size, BacktestTrade.entry_date,
+    BacktestTrade.exit_date, BacktestTrade.entry_price, BacktestTrade.exit_price, BacktestTrade.trade_return,
+    BacktestTrade.pnl,
+)
+
+
+# --- equity series --------------------------------------------------------------------------------
+
+def _shuffle(values: np.ndarray) -> bytes:
+    # groups the n-th byte of every 8-byte value together, which compresses far better than raw doubles
+    return np.ascontiguousarray(values.view(np.uint8).reshape(-1, 8).T).tobytes()
+
+
+def _unshuffle(data: bytes, dtype) -> np.ndarray:
+    return np.frombuffer(data, dtype=np.uint8).reshape(8, -1).T.copy().view(dtype).ravel()
+
+
+def encode_series(dates: np.ndarray, values: np.ndarray) -> bytes:
+    stamps = dates.astype("datetime64[us]").astype(np.int64)
+    deltas = np.diff(stamps, prepend=np.int64(0))
+    payload = _shuffle(deltas) + _shuffle(np.ascontiguousarray(values, dtype=np.float64))
+    return SERIES_HEADER.pack(SERIES_MAGIC, len(stamps)) + zlib.compress(payload, 6)
+
+
+def decode_series(blob: bytes):
+    magic, count = SERIES_HEADER.unpack_from(blob)
+    if magic != SERIES_MAGIC:
+        raise ValueError("unrecognised equity series encoding")
+    payload = zlib.decompress(blob[SERIES_HEADER.size:])
+    size = count * 8
+    deltas = _unshuffle(payload[:size], np.int64)
+    values = _unshuffle(payload[size:], np.float64)
+    return np.cumsum(deltas).astype("datetime64[us]"), values
+
+
+def downsample(dates: np.ndarray, values: np.ndarray, points: int):
+    # evenly spaced points, always keeping the last one
+    if points is None or points <= 0 or len(dates) <= points:
+        return dates, values
+    index = np.unique(np.r_[np.linspace(0, len(dates) - 1, points).astype(np.int64), len(dates) - 1])
+    return dates[index], values[index]
+
+
+# --- trades ---------------------------------------------------------------------------------------
+
+def compact_trades(trades: dict, dates: np.ndarray) -> dict:
+    # engine trades (bar indexes) -> arrays with their own dates, small enough to send between processes
+    return {
+        "side": trades["side"].astype(np.int8),
+        "size": trades["size"],
+        "entry_date": dates[trades["entry_index"]].astype("datetime64[us]"),
+        "exit_date": dates[trades["exit_index"]].astype("datetime64[us]"),
+        "entry_price": trades["entry_price"],
+        "exit_price": trades["exit_price"],
+        "return": trades["return"],
+        "pnl": trades["pnl"],
+    }
+
+
+def trade_rows(backtest_id: int, trades: dict, ticker: str = None) -> list:
+    return [
+        {
+            "backtest_id": backtest_id,
+            "ticker": ticker,
+            "side": side,
+            "size": size,
+            "entry_date": entry_date,
+            "exit_date": exit_date,
+            "entry_price": entry_price,
+            "exit_price": exit_price,
+            "trade_return": ret,
+            "pnl": pnl,
+        }
+        for side, size, entry_date, exit_date, entry_price, exit_price, ret, pnl in zip(
+            trades["side"].tolist(), trades["size"].tolist(), trades["entry_date"].tolist(),
+            trades["exit_date"].tolist(), trades["entry_price"].tolist(), trades["exit_price"].tolist(),
+            trades["return"].tolist(), trades["pnl"].tolist(),
+        )
+    ]
+
+
+async def save_trades(db: AsyncSession, rows: list):
+    for offset in range(0, len(rows), TRADE_INSERT_ROWS):
+        await db.execute(insert(BacktestTrade), rows[offset:offset + TRADE_INSERT_ROWS])
+
+
+def trade_record(row) -> dict:
+    return {
+        "id": row.id,
+        "ticker": row.ticker,
+        "side": SIDE_NAMES.get(row.side, row.side),
+        "size": row.size,
+        "entry_date": row.entry_date,
+        "exit_date": row.exit_date,
+        "entry_price": row.entry_price,
+        "exit_price": row.exit_price,
+        "return": row.trade_return,
+        "pnl": row.pnl,
+    }
+
+
+def encode_cursor(entry_date: datetime, trade_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{entry_date.isoformat()}|{trade_id}".encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    try:
+        entry_date, trade_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(entry_date), int(trade_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("invalid cursor")
+
+
+async def query_trades(db: AsyncSession, backtest_id: int, start=None, end=None, side: str = None,
+                       ticker: str = None, limit: int = 100, cursor: str = None):
+    # one page in (entry_date, id) order; returns (records, cursor for the next page or None)
+    stmt = select(*TRADE_COLUMNS).where(BacktestTrade.backtest_id == backtest_id)
+    if start is not None:
+        stmt = stmt.where(BacktestTrade.entry_date >= start)
+    if end is not None:
+        stmt = stmt.where(BacktestTrade.entry_date <= end)
+    if side is not None:
+        if side not in SIDES:
+            raise ValueError("side must be 'long' or 'short'")
+        stmt = stmt.where(BacktestTrade.side == SIDES[side])
+    if ticker is not None:
+        stmt = stmt.where(BacktestTrade.ticker == ticker)
+    if cursor is not None:
+        after_date, after_id = decode_cursor(cursor)
+        stmt = stmt.where(or_(
+            BacktestTrade.entry_date > after_date,
+            and_(BacktestTrade.entry_date == after_date, BacktestTrade.id > after_id),
+        ))
+    limit = clamp_limit(limit)
+    result = await db.execute(stmt.order_by(BacktestTrade.entry_date, BacktestTrade.id).limit(limit + 1))
+    rows = result.all()
+    next_cursor = encode_cursor(rows[limit - 1].entry_date, rows[limit - 1].id) if len(rows) > limit else None
+    return [trade_record(row) for row in rows[:limit]], next_cursor
+
+
+# --- results --------------------------------------------------------------------------------------
+
+def _visible(stmt, user_id: int):
+    # results are visible wherever their strategy is
+    return stmt.join(Strategy, Strategy.id == BacktestResult.strategy_id).join(Project).where(
+        (Project.owner_id == user_id) | (Strategy.is_public == True)
+    )
+
+
+async def get_visible_summary(db: AsyncSession, backtest_id: int, user_id: int):
+    # summary columns only; trades and the equity blob are never loaded here
+    result = await db.execute(_visible(select(*SUMMARY_COLUMNS), user_id).where(BacktestResult.id == backtest_id))
+    row = result.first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Backtest not found")
+    return row
+
+
+async def get_visible_equity(db: AsyncSession, backtest_id: int, user_id: int):
+    result = await db.execute(
+        _visible(select(BacktestResult.equity_curve), user_id).where(BacktestResult.id == backtest_id)
+    )
+    row = result.first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Backtest not found")
+    if row.equity_curve is None:
+        raise HTTPException(status_code=404, detail="No equity curve stored for this backtest")
+    return decode_series(row.equity_curve)
+
+
+def summary_record(row) -> dict:
+    return {
+        "id": row.id,
+        "strategy_id": row.strategy_id,
+        "ticker": row.ticker,
+        "start_date": row.start_date,
+        "end_date": row.end_date,
+        "created_at": row.created_at,
+        "trade_count": row.trade_count,
+        "results": row.results,
+    }
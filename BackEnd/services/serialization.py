@@ -0,0 +1,77 @@
+import json
+import os
+from datetime import date, datetime
+from decimal import Decimal
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:  # optional; the stdlib encoder produces the same JSON, only slower
+    orjson = None
+
+# List endpoints select plain row tuples and encode them here directly, skipping ORM objects, per-row
+# pydantic models and FastAPI's jsonable_encoder pass over the result.
+
+# Paging contract shared by every list endpoint: `limit` and `after` query parameters, and when more rows
+# exist the value to pass back as `after` in the X-Next-Cursor header (object responses also carry it as
+# next_cursor). Lists that returned everything before paging existed still do when `limit` is omitted;
+# lists that can grow without bound, like strategies, default to DEFAULT_PAGE_SIZE instead.
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "100"))
+CURSOR_HEADER = "X-Next-Cursor"
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=_default, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def clamp_limit(limit: int) -> int:
+    # None (no limit given) stays None: everything
+    return None if limit is None else max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def fetch_limit(limit: int) -> int:
+    # rows to select for a page: one extra tells whether another page exists
+    limit = clamp_limit(limit)
+    return None if limit is None else limit + 1
+
+
+def keyset(stmt, column, after, limit: int):
+    # rows strictly after the cursor in key order
+    if after is not None:
+        stmt = stmt.where(column > after)
+    return stmt.order_by(column).limit(fetch_limit(limit))
+
+
+def page_response(rows, columns, limit: int, key=None) -> FastJSONResponse:
+    # a JSON array of records (or of bare values when columns is None); the key of the last row goes in
+    # X-Next-Cursor when there are more rows, to be passed back as `after`. `key` names the record field
+    # or, for composite keys, is a function building the cursor from the last record
+    limit = clamp_limit(limit)
+    more = limit is not None and len(rows) > limit
+    rows = rows[:limit]
+    if columns is None:
+        body = [row[0] for row in rows]
+        cursor = body[-1] if more else None
+    else:
+        body = [dict(zip(columns, row)) for row in rows]
+        cursor = (key(body[-1]) if callable(key) else body[-1][key]) if more else None
+    headers = {CURSOR_HEADER: str(cursor)} if cursor is not None else None
+    return FastJSONResponse(body, headers=headers)
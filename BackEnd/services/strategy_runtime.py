@@ -0,0 +1,365 @@
+import ast
+import asyncio
+import builtins
+import hashlib
+import math
+import multiprocessing
+import os
+import signal
+import traceback
+import types
+import warnings
+from collections import OrderedDict
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # not on Windows; workers then run without OS limits
+    resource = None
+
+# Runs user strategy code (Strategy.code) that defines
+#
+#     def generate_signals(bars, params):
+#         return positions  # one target position in [-1, 1] per bar
+#
+# `bars` holds whole read-only arrays (date, open, high, low, close, volume) and `params` the strategy
+# parameters, so the code is called once per backtest rather than once per bar. It runs in a small pool of
+# long-lived worker processes, each caching compiled code by hash, with a wall-clock limit enforced by the
+# parent and CPU, memory and file-size limits set inside the worker. Before compiling, check_code rejects
+# underscore attributes, dunder names and the introspection and file helpers in BLOCKED_NAMES; imports are
+# limited to ALLOWED_MODULES, which the code gets as copies of their public functions without submodules.
+# Workers clear their environment and, with STRATEGY_WORKER_UID set, drop to that user.
+# None of this is OS-level isolation (no network namespace, seccomp or nsjail), so running code is off
+# unless STRATEGY_CODE_ENABLED is set.
+
+ENABLED = os.getenv("STRATEGY_CODE_ENABLED", "").lower() in ("1", "true", "yes")
+ENTRY_POINT = "generate_signals"
+ALLOWED_MODULES = {"math", "numpy"}
+# numpy submodules strategy code may reach, e.g. np.linalg; the rest (lib, ctypeslib, testing, ...) are left out
+NUMPY_SUBMODULES = ("fft", "linalg", "random")
+WORKERS = int(os.getenv("STRATEGY_WORKERS", "2"))
+TIME_LIMIT_SECONDS = float(os.getenv("STRATEGY_TIME_LIMIT_SECONDS", "30"))
+CPU_LIMIT_SECONDS = int(os.getenv("STRATEGY_CPU_LIMIT_SECONDS", "30"))
+MEMORY_LIMIT_MB = int(os.getenv("STRATEGY_MEMORY_LIMIT_MB", "2048"))
+# workers are replaced after this many runs so anything leaked by user code does not pile up
+MAX_RUNS_PER_WORKER = int(os.getenv("STRATEGY_MAX_RUNS_PER_WORKER", "500"))
+# unprivileged user and group for workers started as root; unset keeps the server's
+WORKER_UID = int(os.getenv("STRATEGY_WORKER_UID", "-1"))
+WORKER_GID = int(os.getenv("STRATEGY_WORKER_GID", str(WORKER_UID)))
+COMPILED_CACHE_SIZE = 64
+STARTUP_SECONDS = 60
+SAFE_BUILTINS = (
+    "abs", "all", "any", "bool", "dict", "enumerate", "filter", "float", "int", "isinstance", "len", "list", "map",
+    "max", "min", "pow", "range", "reversed", "round", "set", "slice", "sorted", "str", "sum", "tuple", "zip",
+    "ArithmeticError", "Exception", "IndexError", "KeyError", "TypeError", "ValueError", "ZeroDivisionError",
+    "__build_class__",
+)
+# names and attributes that reach frames, globals, files or other ways around the restrictions
+BLOCKED_NAMES = {
+    "breakpoint", "compile", "delattr", "eval", "exec", "getattr", "globals", "help", "input", "locals",
+    "memoryview", "object", "open", "setattr", "super", "type", "vars",
+    "ag_frame", "cr_frame", "f_back", "f_builtins", "f_globals", "f_locals", "gi_code", "gi_frame", "tb_frame",
+    "tb_next", "format", "format_map", "ctypes", "dump", "tofile",
+}
+# numpy functions that read files or print source, left out of the copy strategy code gets
+NUMPY_EXCLUDED = {
+    "DataSource", "fromfile", "fromregex", "genfromtxt", "info", "load", "loadtxt", "lookfor", "memmap", "save",
+    "savetxt", "savez", "savez_compressed", "show_config", "show_runtime", "source",
+}
+
+
+class StrategyError(ValueError):
+    pass
+
+
+def runs_code(code) -> bool:
+    # strategies keep the built-in signals unless their code defines the entry point
+    return bool(code) and ENTRY_POINT in code
+
+
+def code_hash(code: str) -> str:
+    return hashlib.sha256(code.encode("utf-8")).hexdigest()
+
+
+def check_code(code: str):
+    # walks the whole tree, so f-string expressions are covered too
+    try:
+        tree = ast.parse(code)
+    except SyntaxError as e:
+        raise StrategyError(f"syntax error in strategy code, line {e.lineno}: {e.msg}")
+    for node in ast.walk(tree):
+        names = []
+        if isinstance(node, ast.Attribute):
+            names.append(node.attr)
+            if node.attr.startswith("_"):
+                raise StrategyError(f"line {node.lineno}: attribute '{node.attr}' is not allowed in strategy code")
+        elif isinstance(node, ast.Name):
+            names.append(node.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.append(node.name)
+        elif isinstance(node, ast.arg):
+            names.append(node.arg)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            modules = [node.module or ""] if isinstance(node, ast.ImportFrom) else [a.name for a in node.names]
+            for module in modules:
+                if getattr(node, "level", 0) or module.split(".")[0] not in ALLOWED_MODULES:
+                    raise StrategyError(f"line {node.lineno}: import of '{module}' is not allowed in strategy code")
+            for alias in node.names:
+                names.extend(alias.name.split("."))
+                if alias.asname:
+                    names.append(alias.asname)
+        for name in names:
+            if name.startswith("__") or name in BLOCKED_NAMES:
+                raise StrategyError(f"line {node.lineno}: '{name}' is not allowed in strategy code")
+
+
+# --- worker process -------------------------------------------------------------------------------
+
+class _CPULimitExceeded(Exception):
+    pass
+
+
+def _on_cpu_limit(signum, frame):
+    raise _CPULimitExceeded()
+
+
+def _public_copy(module) -> types.SimpleNamespace:
+    # public, non-module attributes only, so strategy code cannot walk from numpy into os or sys
+    namespace = types.SimpleNamespace()
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        for name in dir(module):
+            if name.startswith("_") or name in BLOCKED_NAMES or name in NUMPY_EXCLUDED:
+                continue
+            try:
+                value = getattr(module, name)
+            except AttributeError:
+                continue
+            if not isinstance(value, types.ModuleType):
+                setattr(namespace, name, value)
+    return namespace
+
+
+def _strategy_modules() -> dict:
+    numpy = _public_copy(np)
+    for name in NUMPY_SUBMODULES:
+        setattr(numpy, name, _public_copy(getattr(np, name)))
+    return {"math": _public_copy(math), "numpy": numpy}
+
+
+def _guarded_import(modules: dict):
+    def guarded_import(name, globals=None, locals=None, fromlist=(), level=0):
+        top, _, rest = name.partition(".")
+        if level != 0 or top not in modules or (rest and not hasattr(modules[top], rest)):
+            raise ImportError(f"import of '{name}' is not allowed in strategy code")
+        return getattr(modules[top], rest) if rest and fromlist else modules[top]
+    return guarded_import
+
+
+def _drop_privileges(uid: int, gid: int):
+    if uid < 0 or not hasattr(os, "setuid") or os.getuid() != 0:
+        return
+    os.setgroups([])
+    os.setgid(gid if gid >= 0 else uid)
+    os.setuid(uid)
+
+
+def _apply_limits(memory_mb: int):
+    if resource is None:
+        return
+    if memory_mb:
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    resource.setrlimit(resource.RLIMIT_FSIZE, (0, 0))
+    signal.signal(signal.SIGXCPU, _on_cpu_limit)
+
+
+def _set_cpu_budget(seconds: int):
+    # RLIMIT_CPU counts the whole life of the process, so each run gets the time used so far plus its budget
+    if resource is None or not seconds:
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = math.ceil(usage.ru_utime + usage.ru_stime) + seconds
+    resource.setrlimit(resource.RLIMIT_CPU, (soft if hard == resource.RLIM_INFINITY else min(soft, hard), hard))
+
+
+def _run(compiled: OrderedDict, modules: dict, key: str, code: str, bars: dict, params: dict, cpu_seconds: int):
+    program = compiled.get(key)
+    if program is None:
+        check_code(code)
+        program = compile(code, f"<strategy {key[:12]}>", "exec")
+        compiled[key] = program
+        while len(compiled) > COMPILED_CACHE_SIZE:
+            compiled.popitem(last=False)
+    compiled.move_to_end(key)
+    safe_builtins = {name: getattr(builtins, name) for name in SAFE_BUILTINS}
+    safe_builtins["__import__"] = _guarded_import(modules)
+    # a fresh namespace per run, so nothing carries over between runs or strategies
+    namespace = {"__builtins__": safe_builtins, "__name__": "strategy", "np": modules["numpy"], "math": modules["math"]}
+    for values in bars.values():
+        values.flags.writeable = False
+    _set_cpu_budget(cpu_seconds)
+    exec(program, namespace)
+    entry = namespace.get(ENTRY_POINT)
+    if not callable(entry):
+        raise StrategyError(f"strategy code must define {ENTRY_POINT}(bars, params)")
+    return np.asarray(entry(bars, dict(params)), dtype=np.float64)
+
+
+def _serve(conn, memory_mb: int, cpu_seconds: int, uid: int, gid: int):
+    # spawned workers inherit the server's environment (database URL, secret key); none of it is needed here
+    os.environ.clear()
+    _apply_limits(memory_mb)
+    _drop_privileges(uid, gid)
+    modules = _strategy_modules()
+    compiled = OrderedDict()
+    conn.send("ready")
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+        key, code, bars, params = message
+        try:
+            reply = ("ok", _run(compiled, modules, key, code, bars, params, cpu_seconds))
+        except _CPULimitExceeded:
+            reply = ("error", f"strategy exceeded its CPU limit of {cpu_seconds}s")
+        except MemoryError:
+            reply = ("error", f"strategy exceeded its memory limit of {memory_mb} MB")
+        except StrategyError as e:
+            reply = ("error", str(e))
+        except SyntaxError as e:
+            reply = ("error", f"syntax error in strategy code, line {e.lineno}: {e.msg}")
+        except Exception as e:
+            # the last frame inside the strategy code is the useful part of the traceback
+            frames = [f for f in traceback.extract_tb(e.__traceback__) if f.filename.startswith("<strategy")]
+            where = f" (line {frames[-1].lineno})" if frames else ""
+            reply = ("error", f"{type(e).__name__}: {e}{where}")
+        conn.send(reply)
+
+
+# --- parent side ----------------------------------------------------------------------------------
+
+class WorkerProcess:
+    def __init__(self, context):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(
+            target=_serve,
+            args=(child, MEMORY_LIMIT_MB, CPU_LIMIT_SECONDS, WORKER_UID, WORKER_GID),
+            daemon=True,
+            name="strategy-runtime",
+        )
+        self.process.start()
+        child.close()
+        self.runs = 0
+
+    def wait_ready(self, timeout: float):
+        # blocking; a spawned worker is usable once it has imported numpy and set its limits
+        if not self.conn.poll(timeout) or self.conn.recv() != "ready":
+            self.kill()
+            raise StrategyError("strategy worker failed to start")
+
+    def call(self, message, timeout: float):
+        # blocking; run in a thread
+        self.conn.send(message)
+        if not self.conn.poll(timeout):
+            raise TimeoutError()
+        return self.conn.recv()
+
+    def alive(self) -> bool:
+        return self.process.is_alive()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class StrategyRuntime:
+    # warm pool of worker processes; a run borrows one and returns it afterwards
+    def __init__(self, workers: int = WORKERS):
+        self.workers = max(1, workers)
+        self.context = multiprocessing.get_context("spawn")
+        self.idle = []
+        self.slots = None
+        self.runs = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.spawned = 0
+
+    async def _spawn(self) -> WorkerProcess:
+        self.spawned += 1
+        worker = WorkerProcess(self.context)
+        try:
+            await asyncio.to_thread(worker.wait_ready, STARTUP_SECONDS)
+        except EOFError:
+            await asyncio.to_thread(worker.kill)
+            raise StrategyError("strategy worker failed to start")
+        return worker
+
+    async def start(self):
+        # booting a worker takes a while (a fresh interpreter importing numpy); do it before the first run
+        if not ENABLED:
+            return
+        missing = self.workers - len(self.idle)
+        self.idle.extend(await asyncio.gather(*(self._spawn() for _ in range(missing))))
+
+    async def generate_positions(self, code: str, bars: dict, params: dict) -> np.ndarray:
+        if not ENABLED:
+            raise StrategyError("running strategy code is disabled on this server")
+        check_code(code)
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.workers)
+        n = len(bars["close"])
+        async with self.slots:
+            worker = self.idle.pop() if self.idle else await self._spawn()
+            self.runs += 1
+            try:
+                status, value = await asyncio.to_thread(
+                    worker.call, (code_hash(code), code, dict(bars), params), TIME_LIMIT_SECONDS
+                )
+            except TimeoutError:
+                self.timeouts += 1
+                await asyncio.to_thread(worker.kill)
+                raise StrategyError(f"strategy did not finish within {TIME_LIMIT_SECONDS:g}s")
+            except (EOFError, OSError):
+                # the worker died, e.g. killed for exceeding a hard limit
+                self.failures += 1
+                await asyncio.to_thread(worker.kill)
+                raise StrategyError("strategy worker stopped unexpectedly")
+            worker.runs += 1
+            if worker.runs >= MAX_RUNS_PER_WORKER or not worker.alive():
+                await asyncio.to_thread(worker.kill)
+            else:
+                self.idle.append(worker)
+        if status == "error":
+            self.failures += 1
+            raise StrategyError(value)
+        if value.shape != (n,):
+            self.failures += 1
+            raise StrategyError(f"{ENTRY_POINT} returned shape {value.shape}, expected one value per bar ({n})")
+        return np.clip(np.nan_to_num(value, nan=0.0, posinf=0.0, neginf=0.0), -1.0, 1.0)
+
+    def shutdown(self):
+        while self.idle:
+            self.idle.pop().kill()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": ENABLED,
+            "workers": self.workers,
+            "idle": len(self.idle),
+            "spawned": self.spawned,
+            "runs": self.runs,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+        }
+
+
+runtime = StrategyRuntime()
+
+
+async def generate_positions(code: str, bars: dict, params: dict) -> np.ndarray:
+    return await runtime.generate_positions(code, bars, params)
@@ -1,9 +1,84 @@
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy import select
+from sqlalchemy import select, union_all
 from sqlalchemy.ext.asyncio import AsyncSession
 from database.connection import get_db
-from database.models import User
+from database.models import User, Project, Strategy
 from jose import JWTError, jwt as jose_jwt
 from services.auth_service import get_current_user
+from services.serialization import DEFAULT_PAGE_SIZE, fetch_limit
 
+LIST_COLUMNS = ("id", "name", "project_id", "status", "is_public", "created_at", "updated_at")
+# large text columns, only selected when asked for
+OPTIONAL_COLUMNS = ("parameters", "code")
+
+
+async def get_visible_strategy(strategy_id: int, db: AsyncSession, user_id: int) -> Strategy:
+    # strategies are visible to the owner of their project, or to everyone when public
+    result = await db.execute(
+        select(Strategy).join(Project).where(
+            Strategy.id == strategy_id,
+            (Project.owner_id == user_id) | (Strategy.is_public == True),
+        )
+    )
+    strategy = result.scalars().first()
+    if strategy is None:
+        raise HTTPException(status_code=404, detail="Strategy not found")
+    return strategy
+
+
+async def get_owned_strategy(strategy_id: int, db: AsyncSession, user_id: int) -> Strategy:
+    # only the owner of the strategy's project may change it or run it; runs are stored under the strategy
+    result = await db.execute(
+        select(Strategy).join(Project).where(Strategy.id == strategy_id, Project.owner_id == user_id)
+    )
+    strategy = result.scalars().first()
+    if strategy is None:
+        raise HTTPException(status_code=404, detail="Strategy not found")
+    return strategy
+
+
+async def check_project_owner(project_id: int, db: AsyncSession, user_id: int):
+    owned = await db.scalar(select(Project.id).where(Project.id == project_id, Project.owner_id == user_id))
+    if owned is None:
+        raise HTTPException(status_code=404, detail="Project not found")
+
+
+def listing_columns(include: str = None) -> tuple:
+    requested = [name.strip() for name in (include or "").split(",") if name.strip()]
+    unknown = set(requested) - set(OPTIONAL_COLUMNS)
+    if unknown:
+        raise ValueError(f"include must be drawn from {', '.join(OPTIONAL_COLUMNS)}")
+    return LIST_COLUMNS + tuple(name for name in OPTIONAL_COLUMNS if name in requested)
+
+
+async def list_visible_strategies(db: AsyncSession, user_id: int, columns: tuple = LIST_COLUMNS, after: int = None,
+                                  limit: int = DEFAULT_PAGE_SIZE, status: str = None, project_id: int = None,
+                                  updated_since=None, updated_until=None) -> list:
+    # one page in id order. The caller's private strategies and public ones are read as two separate
+    # index walks (idx_strategies_project, idx_strategies_public) of at most one page each and merged,
+    # so a page costs the same however large the table is; an OR across the join would not use either index.
+    limit = fetch_limit(limit)
+    selected = [getattr(Strategy, name) for name in columns]
+
+    def page(stmt):
+        if after is not None:
+            stmt = stmt.where(Strategy.id > after)
+        if status is not None:
+            stmt = stmt.where(Strategy.status == status)
+        if project_id is not None:
+            stmt = stmt.where(Strategy.project_id == project_id)
+        if updated_since is not None:
+            stmt = stmt.where(Strategy.updated_at >= updated_since)
+        if updated_until is not None:
+            stmt = stmt.where(Strategy.updated_at <= updated_until)
+        return select(stmt.order_by(Strategy.id).limit(limit).subquery())
+
+    owned = select(*selected).where(
+        Strategy.project_id.in_(select(Project.id).where(Project.owner_id == user_id)),
+        Strategy.is_public.isnot(True),
+    )
+    public = select(*selected).where(Strategy.is_public == True)
+    merged = union_all(page(owned), page(public)).subquery()
+    result = await db.execute(select(merged).order_by(merged.c.id).limit(limit))
+    return result.all()
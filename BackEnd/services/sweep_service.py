@@ -0,0 +1,191 @@
+import asyncio
+import itertools
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession
+from database.models import Strategy, BacktestResult
+from services import backtest_service, bar_cache, corporate_actions, result_service, strategy_runtime
+
+MAX_COMBINATIONS = int(os.getenv("SWEEP_MAX_COMBINATIONS", "10000"))
+WORKERS = int(os.getenv("SWEEP_WORKERS", "0")) or os.cpu_count() or 1
+WRITE_BATCH_ROWS = 100
+# tasks per worker, so stragglers even out without paying per-combination overhead
+TASKS_PER_WORKER = 4
+# grids vary the built-in signal parameters, which code strategies do not necessarily read
+CODE_STRATEGY_ERROR = "sweeps run the built-in signals only; backtest strategies with code one at a time"
+
+_executor = None
+
+
+def get_executor() -> Executor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=WORKERS)
+    return _executor
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+        _executor = None
+
+
+def expand_grid(grid: dict) -> list:
+    keys = sorted(grid)
+    values = [v if isinstance(v, (list, tuple)) else [v] for v in (grid[k] for k in keys)]
+    total = 1
+    for v in values:
+        total *= len(v)
+    if total > MAX_COMBINATIONS:
+        raise ValueError(f"grid expands to {total} combinations, the limit is {MAX_COMBINATIONS}")
+    return [dict(zip(keys, combo)) for combo in itertools.product(*values)]
+
+
+def publish_bars(bars: dict, directory: str) -> dict:
+    # one .npy per column; workers map them read-only instead of receiving pickled copies
+    paths = {}
+    for name, values in bars.items():
+        if values.dtype.kind == "M":
+            values = values.astype("datetime64[us]")
+        path = os.path.join(directory, f"{name}.npy")
+        np.save(path, values)
+        paths[name] = path
+    return paths
+
+
+# per-worker cache of mapped bar sets, keyed by the published directory
+_mapped = OrderedDict()
+MAPPED_CACHE_SIZE = 8
+
+
+def map_bars(paths: dict) -> dict:
+    key = os.path.dirname(next(iter(paths.values())))
+    bars = _mapped.get(key)
+    if bars is None:
+        bars = {name: np.load(path, mmap_mode="r") for name, path in paths.items()}
+        _mapped[key] = bars
+        if len(_mapped) > MAPPED_CACHE_SIZE:
+            _mapped.popitem(last=False)
+    else:
+        _mapped.move_to_end(key)
+    return bars
+
+
+def run_combinations(paths: dict, base_parameters: dict, combinations: list, store_trades: bool) -> list:
+    # runs in a worker process
+    bars = map_bars(paths)
+    outcomes = []
+    for combination in combinations:
+        params = dict(base_parameters)
+        params.update(combination)
+        try:
+            outcome = backtest_service.run_backtest(bars, params)
+        except (ValueError, TypeError, KeyError) as e:
+            outcomes.append({"parameters": combination, "error": str(e)})
+            continue
+        record = {"parameters": combination, "metrics": outcome["metrics"],
+                  "trade_count": len(outcome["trades"]["entry_index"])}
+        if store_trades:
+            # compacted and compressed here so only small arrays and bytes travel back to the parent
+            record["trades"] = result_service.compact_trades(outcome["trades"], bars["date"])
+            record["equity"] = result_service.encode_series(bars["date"], outcome["equity"])
+        outcomes.append(record)
+    return outcomes
+
+
+def _chunks(items: list, workers: int) -> list:
+    size = max(1, -(-len(items) // (workers * TASKS_PER_WORKER)))
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+async def _write_batch(db: AsyncSession, strategy_id: int, batch: list):
+    rows = []
+    for ticker, bars_range, params, outcome in batch:
+        row = BacktestResult(
+            strategy_id=strategy_id,
+            ticker=ticker,
+            start_date=bars_range[0],
+            end_date=bars_range[1],
+            results={"metrics": outcome["metrics"], "parameters": params, "sweep": outcome["parameters"]},
+            trade_count=outcome["trade_count"],
+            equity_curve=outcome.get("equity"),
+            logs="",
+        )
+        rows.append(row)
+    db.add_all(rows)
+    await db.flush()
+    trades = []
+    for row, (ticker, _, _, outcome) in zip(rows, batch):
+        if "trades" in outcome:
+            trades.extend(result_service.trade_rows(row.id, outcome["trades"], ticker))
+    await result_service.save_trades(db, trades)
+    await db.commit()
+    return rows
+
+
+async def _tagged(future, tag):
+    return tag, await future
+
+
+def _summary(row) -> dict:
+    return {"id": row.id, "ticker": row.ticker, "parameters": row.results["sweep"], "metrics": row.results["metrics"]}
+
+
+async def run_sweep(db: AsyncSession, strategy: Strategy, tickers: list, grid: dict, start=None, end=None,
+                    store_trades: bool = False, executor: Executor = None):
+    # yields one record per (ticker, combination) as results are written
+    if strategy_runtime.runs_code(strategy.code):
+        raise ValueError(CODE_STRATEGY_ERROR)
+    combinations = expand_grid(grid)
+    base_parameters = backtest_service.parse_parameters(strategy.parameters)
+    executor = executor or get_executor()
+    workers = getattr(executor, "_max_workers", WORKERS)
+    loop = asyncio.get_running_loop()
+    directory = tempfile.mkdtemp(prefix="sweep-")
+    submitted = []
+    try:
+        tasks = []
+        for index, ticker in enumerate(dict.fromkeys(t.upper() for t in tickers)):
+            bars = await bar_cache.fetch_bars(db, ticker, start, end, backtest_service.BAR_COLUMNS)
+            bars = await corporate_actions.adjust_bars(db, ticker, bars)
+            if len(bars["close"]) < 2:
+                yield {"ticker": ticker, "error": "Not enough market data for backtest"}
+                continue
+            # named by position; tickers are user input and may not be valid directory names
+            ticker_directory = os.path.join(directory, str(index))
+            os.mkdir(ticker_directory)
+            paths = await loop.run_in_executor(None, publish_bars, bars, ticker_directory)
+            bars_range = (backtest_service.to_datetime(bars["date"][0]), backtest_service.to_datetime(bars["date"][-1]))
+            del bars
+            for chunk in _chunks(combinations, workers):
+                future = executor.submit(run_combinations, paths, base_parameters, chunk, store_trades)
+                submitted.append(future)
+                tasks.append(_tagged(asyncio.wrap_future(future), (ticker, bars_range)))
+
+        pending = []
+        for completed in asyncio.as_completed(tasks):
+            (ticker, bars_range), outcomes = await completed
+            for outcome in outcomes:
+                if "error" in outcome:
+                    yield {"ticker": ticker, "parameters": outcome["parameters"], "error": outcome["error"]}
+                    continue
+                params = dict(base_parameters)
+                params.update(outcome["parameters"])
+                pending.append((ticker, bars_range, params, outcome))
+            if len(pending) >= WRITE_BATCH_ROWS:
+                for row in await _write_batch(db, strategy.id, pending):
+                    yield _summary(row)
+                pending = []
+        if pending:
+            for row in await _write_batch(db, strategy.id, pending):
+                yield _summary(row)
+    finally:
+        # stop queued work if the consumer went away early
+        for future in submitted:
+            future.cancel()
+        shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,65 @@
+import os
+import sys
+
+# the app reads its configuration at import time, so point it at sqlite before anything imports it
+os.environ["DATABASE_URL"] = "sqlite+aiosqlite://"
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+from database.models import Base, User
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def engine():
+    # one in-memory database per test, shared by every session through a single connection
+    engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    yield engine
+    await engine.dispose()
+
+
+@pytest.fixture
+def session_factory(engine):
+    return async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+
+
+@pytest.fixture
+async def user(session_factory):
+    async with session_factory() as db:
+        user = User(email="trader@example.com", name="trader", password_hash="x")
+        db.add(user)
+        await db.commit()
+        return user
+
+
+@pytest.fixture
+async def client(session_factory, user, monkeypatch):
+    # the app with its database swapped for the test one and every request signed in as `user`
+    import app as app_module
+    from database.connection import get_db
+    from services.auth_service import get_current_user
+
+    async def test_db():
+        async with session_factory() as db:
+            yield db
+
+    for name, module in list(sys.modules.items()):
+        if name.split(".")[0] in ("routers", "services") and hasattr(module, "AsyncSessionLocal"):
+            monkeypatch.setattr(module, "AsyncSessionLocal", session_factory)
+    app_module.app.dependency_overrides[get_db] = test_db
+    app_module.app.dependency_overrides[get_current_user] = lambda: user
+    transport = httpx.ASGITransport(app=app_module.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+    app_module.app.dependency_overrides.clear()
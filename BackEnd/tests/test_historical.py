@@ -0,0 +1,40 @@
+import pyarrow as pa
+import pytest
+from services import bar_cache
+
+pytestmark = pytest.mark.anyio
+
+CSV = "ticker,date,open,high,low,close,volume\n" + "".join(
+    f"AAA,2024-01-{day:02d},10,12,9,{10 + day / 10},100\n" for day in range(1, 11)
+)
+CLOSES = [10 + day / 10 for day in range(1, 11)]
+
+
+@pytest.fixture
+def cache():
+    bar_cache.bar_cache.clear()
+    yield bar_cache.bar_cache
+    bar_cache.bar_cache.clear()
+
+
+async def historical(client, fmt: str, columns: str) -> dict:
+    response = await client.get("/api/data/AAA/historical", params={"columns": columns, "format": fmt})
+    assert response.status_code == 200
+    if fmt == "json":
+        records = response.json()
+        return {name: [record[name] for record in records] for name in columns.split(",")}
+    return pa.ipc.open_stream(response.content).read_all().to_pydict()
+
+
+@pytest.mark.parametrize("fmt", ["json", "arrow"])
+@pytest.mark.parametrize("cached", [True, False], ids=["cache-hit", "cache-miss"])
+async def test_projected_columns_without_date(client, cache, monkeypatch, fmt, cached):
+    # the cache serves only the requested columns, so nothing may assume `date` is among them
+    monkeypatch.setattr(cache, "admit_after", 1 if cached else 1000)
+    response = await client.post("/api/data/bulk", content=CSV, headers={"content-type": "text/csv"})
+    assert response.json()["rows_written"] == 10
+
+    hits = cache.hits
+    assert await historical(client, fmt, "close") == {"close": CLOSES}
+    assert await historical(client, fmt, "volume,close") == {"volume": [100] * 10, "close": CLOSES}
+    assert (cache.hits > hits) == cached
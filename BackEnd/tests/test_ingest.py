@@ -0,0 +1,33 @@
+import pytest
+from sqlalchemy import func, select
+from database.models import MarketData
+from services import ingest_service
+
+pytestmark = pytest.mark.anyio
+
+
+async def body(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+async def test_undecodable_csv_row_is_rejected(session_factory):
+    csv = (b"ticker,date,open,high,low,close,volume\n"
+           b"AAA,2024-01-02,10,11,9,10.5,100\n"
+           b"AAA,2024-01-03,10,11,9,10\xff,100\n"
+           b"AAA,2024-01-04,10,11,9,10.5,100\n")
+    async with session_factory() as db:
+        stats = await ingest_service.ingest_stream(db, body(csv[:50], csv[50:]), "csv")
+        count = (await db.execute(select(func.count()).select_from(MarketData))).scalar()
+    assert (stats.rows_received, stats.rows_written, stats.rows_rejected) == (3, 2, 1)
+    assert stats.rejected_samples[0]["row"] == 2
+    assert "utf-8" in stats.rejected_samples[0]["error"]
+    assert count == 2
+
+
+async def test_undecodable_ndjson_line_is_rejected(session_factory):
+    ndjson = (b'{"ticker": "AAA", "date": "2024-01-02", "open": 10, "high": 11, "low": 9, "close": 10, "volume": 1}\n'
+              b'{"ticker": "\xffAA"}\n')
+    async with session_factory() as db:
+        stats = await ingest_service.ingest_stream(db, body(ndjson), "ndjson")
+    assert (stats.rows_written, stats.rows_rejected) == (1, 1)
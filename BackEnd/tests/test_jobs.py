@@ -0,0 +1,182 @@
+import asyncio
+import json
+import pytest
+from sqlalchemy import select
+from database.models import Job
+from services import job_service
+from services.job_service import JobQueue
+
+pytestmark = pytest.mark.anyio
+
+TIMEOUT = 5
+
+
+class Handlers:
+    # test job kinds: "record" notes its name, "block" waits for release, "stream" reports progress to a
+    # subscriber, "spin" reports progress until cancelled, "fail" raises
+    def __init__(self):
+        self.ran = []
+        self.release = asyncio.Event()
+
+    async def record(self, ctx):
+        self.ran.append(ctx.payload["name"])
+        return {"name": ctx.payload["name"]}
+
+    async def block(self, ctx):
+        self.ran.append(ctx.payload["name"])
+        await self.release.wait()
+        return {"name": ctx.payload["name"]}
+
+    async def stream(self, ctx):
+        while not ctx.state.listeners:
+            await asyncio.sleep(0.01)
+        await ctx.progress(0.5, {"step": 1})
+        await ctx.progress(1.0, {"step": 2})
+        return {"steps": 2}
+
+    async def spin(self, ctx):
+        while True:
+            await ctx.progress(0.1)
+            await asyncio.sleep(0.01)
+
+    async def fail(self, ctx):
+        raise RuntimeError("no data for ZZZ")
+
+    def kinds(self) -> dict:
+        return {name: getattr(self, name) for name in ("record", "block", "stream", "spin", "fail")}
+
+
+@pytest.fixture
+def handlers():
+    return Handlers()
+
+
+@pytest.fixture
+async def make_queue(session_factory, handlers):
+    queues = []
+
+    def make(**options) -> JobQueue:
+        queue = JobQueue(handlers.kinds(), session_factory, **options)
+        queues.append(queue)
+        return queue
+
+    yield make
+    for queue in queues:
+        await queue.stop()
+
+
+async def wait_until(predicate):
+    async def poll():
+        while not predicate():
+            await asyncio.sleep(0.01)
+    await asyncio.wait_for(poll(), TIMEOUT)
+
+
+async def stored(session_factory, job_id: str) -> Job:
+    async with session_factory() as db:
+        return await db.get(Job, job_id)
+
+
+async def test_higher_priority_runs_first(make_queue, handlers):
+    queue = make_queue(workers=1)
+    await queue.start()
+    blocker = await queue.submit(1, "block", {"name": "blocker"})
+    await wait_until(lambda: blocker.status == "running")
+    low = await queue.submit(1, "record", {"name": "low"}, priority=-5)
+    first = await queue.submit(1, "record", {"name": "first"})
+    second = await queue.submit(1, "record", {"name": "second"})
+    handlers.release.set()
+    await wait_until(lambda: low.status == "succeeded")
+    assert handlers.ran == ["blocker", "first", "second", "low"]
+    assert first.status == second.status == "succeeded"
+
+
+async def test_per_user_concurrency_limit(make_queue, handlers):
+    queue = make_queue(workers=3, per_user_limit=1)
+    await queue.start()
+    one = await queue.submit(1, "block", {"name": "one"})
+    two = await queue.submit(1, "block", {"name": "two"})
+    other = await queue.submit(2, "block", {"name": "other"})
+    await wait_until(lambda: one.status == "running" and other.status == "running")
+    await asyncio.sleep(0.05)
+    # a free worker does not take the second job while its owner already has one running
+    assert two.status == "queued"
+    handlers.release.set()
+    await wait_until(lambda: two.status == "succeeded")
+
+
+async def test_queue_limit_answers_429(client, make_queue, monkeypatch):
+    # no workers started, so submitted jobs stay queued
+    monkeypatch.setattr(job_service, "queue", make_queue(per_user_queue_limit=1))
+    body = {"kind": "record", "payload": {"name": "a"}}
+    assert (await client.post("/api/jobs/", json=body)).status_code == 202
+    response = await client.post("/api/jobs/", json=body)
+    assert response.status_code == 429
+
+
+async def test_jobs_survive_a_restart(make_queue, handlers, session_factory):
+    before = make_queue()
+    queued = await before.submit(1, "record", {"name": "queued"})
+    interrupted = await before.submit(1, "record", {"name": "interrupted"})
+    async with session_factory() as db:
+        # as if the process died while this one was running
+        (await db.get(Job, interrupted.id)).status = "running"
+        await db.commit()
+
+    after = make_queue()
+    await after.start()
+    for job_id in (queued.id, interrupted.id):
+        await wait_until(lambda: job_id in after.finished)
+        row = await stored(session_factory, job_id)
+        assert row.status == "succeeded"
+        assert row.progress == 1.0
+    assert sorted(handlers.ran) == ["interrupted", "queued"]
+
+
+async def test_progress_and_partial_results_over_sse(client, make_queue, monkeypatch, user):
+    queue = make_queue()
+    monkeypatch.setattr(job_service, "queue", queue)
+    await queue.start()
+    job = (await client.post("/api/jobs/", json={"kind": "stream", "payload": {}})).json()
+    response = await asyncio.wait_for(client.get(f"/api/jobs/{job['id']}/events"), TIMEOUT)
+    events = []
+    for block in response.text.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.split("\n") if not line.startswith(":"))
+        events.append((fields["event"], json.loads(fields["data"])))
+    progress = [data for name, data in events if name == "progress"]
+    assert [p["partial"] for p in progress] == [{"step": 1}, {"step": 2}]
+    assert [p["progress"] for p in progress] == [0.5, 1.0]
+    assert ("status", {"event": "status", "status": "succeeded"}) in events
+    name, final = events[-1]
+    assert name == "snapshot" and final["status"] == "succeeded" and final["result"] == {"steps": 2}
+    partial = (await client.get(f"/api/jobs/{job['id']}", params={"partial": True})).json()["partial"]
+    assert partial == [{"step": 1}, {"step": 2}]
+
+
+async def test_cancel_running_and_queued_jobs(client, make_queue, monkeypatch, session_factory):
+    queue = make_queue(workers=1)
+    monkeypatch.setattr(job_service, "queue", queue)
+    await queue.start()
+    running = (await client.post("/api/jobs/", json={"kind": "spin", "payload": {}})).json()
+    queued = (await client.post("/api/jobs/", json={"kind": "record", "payload": {"name": "never"}})).json()
+    await wait_until(lambda: queue.active[running["id"]].status == "running")
+
+    assert (await client.delete(f"/api/jobs/{queued['id']}")).json()["status"] == "cancelled"
+    await client.delete(f"/api/jobs/{running['id']}")
+    await wait_until(lambda: running["id"] in queue.finished)
+    assert (await client.get(f"/api/jobs/{running['id']}")).json()["status"] == "cancelled"
+    assert (await stored(session_factory, running["id"])).status == "cancelled"
+    assert (await stored(session_factory, queued["id"])).status == "cancelled"
+
+
+async def test_failing_handler_ends_in_failed_event(make_queue, session_factory):
+    queue = make_queue()
+    state = await queue.submit(1, "fail", {})
+    listener = queue.subscribe(state)
+    await queue.start()
+    events = []
+    while not events or events[-1]["status"] not in job_service.TERMINAL:
+        events.append(await asyncio.wait_for(listener.get(), TIMEOUT))
+    assert [event["status"] for event in events] == ["running", "failed"]
+    row = await stored(session_factory, state.id)
+    assert (row.status, row.error) == ("failed", "no data for ZZZ")
@@ -0,0 +1,24 @@
+from datetime import datetime
+import pytest
+from database.models import DataQualityIssue
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_issues_page_in_date_order(client, session_factory):
+    # ids out of date order, as after an incremental pass rewrote the issues before its cutoff
+    days = [20, 25, 3, 8, 8, 12]
+    async with session_factory() as db:
+        db.add_all([DataQualityIssue(ticker="AAA", date=datetime(2024, 1, day), kind="gap") for day in days])
+        await db.commit()
+
+    seen, after = [], None
+    while True:
+        params = {"limit": 2} if after is None else {"limit": 2, "after": after}
+        response = await client.get("/api/data/AAA/quality", params=params)
+        seen.extend(issue["date"][:10] for issue in response.json())
+        after = response.headers.get("X-Next-Cursor")
+        if after is None:
+            break
+    assert seen == [f"2024-01-{day:02d}" for day in sorted(days)]
+    assert (await client.get("/api/data/AAA/quality", params={"after": "nope"})).status_code == 400
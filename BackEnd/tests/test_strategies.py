@@ -0,0 +1,45 @@
+import pytest
+from database.models import Project, Strategy, User
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def public_strategy(session_factory):
+    # someone else's public strategy
+    async with session_factory() as db:
+        owner = User(email="owner@example.com", name="owner", password_hash="x")
+        project = Project(name="theirs", owner=owner)
+        strategy = Strategy(name="public", project=project, is_public=True, parameters="{}")
+        db.add(strategy)
+        await db.commit()
+        return strategy
+
+
+async def test_public_strategy_is_readable_but_not_runnable(client, public_strategy):
+    url = f"/strategies/{public_strategy.id}"
+    assert (await client.get(url)).status_code == 200
+    runs = [
+        ("backtest", {"ticker": "AAA"}),
+        ("portfolio-backtest", {"tickers": ["AAA"]}),
+        ("sweep", {"tickers": ["AAA"], "grid": {"fast": [5]}}),
+    ]
+    for path, body in runs:
+        response = await client.post(f"{url}/{path}", json=body)
+        assert response.status_code == 404, path
+
+
+async def test_listing_defaults_to_a_bounded_page(client, session_factory, user, monkeypatch):
+    from services import serialization
+    monkeypatch.setattr(serialization, "MAX_PAGE_SIZE", 3)
+    async with session_factory() as db:
+        project = Project(name="mine", owner_id=user.id)
+        db.add_all([Strategy(name=f"s{i}", project=project) for i in range(5)])
+        await db.commit()
+
+    first = await client.get("/strategies/")
+    assert len(first.json()) == 3
+    cursor = first.headers["X-Next-Cursor"]
+    rest = await client.get("/strategies/", params={"after": cursor})
+    assert len(rest.json()) == 2
+    assert "X-Next-Cursor" not in rest.headers